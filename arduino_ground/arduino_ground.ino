@@ -6,6 +6,8 @@ written to the serial port with SERIAL_BAUD speed,
 in the following form:
   - "Temperature: XX.X\n"
   - "Pressure: XXXX.X\n"
+When SERIAL_FRAMED_OUTPUT is set, readings are written as
+compact binary frames instead (see serial_frame.h).
 
 Units:
   - Humidity: percentage (relative humidity)
@@ -38,10 +40,14 @@ Required libraries:
 #include <SoftwareSerial.h>
 
 #include "pms5003.h"
+#include "serial_frame.h"
 
 // Output is written to serial.
 #define SERIAL_BAUD 9600
 
+// Write readings as binary frames instead of text lines.
+#define SERIAL_FRAMED_OUTPUT false
+
 // Temperature and humidity sensor.
 #define DHTPIN 7
 #define DHTTYPE AM2301
@@ -95,6 +101,28 @@ void setup() {
   delay(5000);
 }
 
+// Writes a single reading to the serial output.
+void printReading(const char* name, uint8_t sensor_id, float value) {
+  if (SERIAL_FRAMED_OUTPUT) {
+    writeFrame(&Serial, sensor_id, value);
+  } else {
+    Serial.print(name);
+    Serial.print(": ");
+    Serial.println(value);
+  }
+}
+
+// Same as above, for integer readings.
+void printReading(const char* name, uint8_t sensor_id, unsigned int value) {
+  if (SERIAL_FRAMED_OUTPUT) {
+    writeFrame(&Serial, sensor_id, value);
+  } else {
+    Serial.print(name);
+    Serial.print(": ");
+    Serial.println(value);
+  }
+}
+
 // For the LCD.
 //   0: humidity and temperature
 //   1: water level
@@ -115,32 +143,32 @@ void loop() {
 
   // Print air quality data.
   if (pms_data_available) {
-    Serial.print("PM 1.0 standard: ");
-    Serial.println(pms_data.pm10_standard);
-    Serial.print("PM 2.5 standard: ");
-    Serial.println(pms_data.pm25_standard);
-    Serial.print("PM 10.0 standard: ");
-    Serial.println(pms_data.pm100_standard);
-
-    Serial.print("PM 1.0 environmental: ");
-    Serial.println(pms_data.pm10_env);
-    Serial.print("PM 2.5 environmental: ");
-    Serial.println(pms_data.pm25_env);
-    Serial.print("PM 10.0 environmental: ");
-    Serial.println(pms_data.pm100_env);
-
-    Serial.print("Particles > 0.3um / 0.1L air: ");
-    Serial.println(pms_data.particles_03um);
-    Serial.print("Particles > 0.5um / 0.1L air: ");
-    Serial.println(pms_data.particles_05um);
-    Serial.print("Particles > 1.0um / 0.1L air: ");
-    Serial.println(pms_data.particles_10um);
-    Serial.print("Particles > 2.5um / 0.1L air: ");
-    Serial.println(pms_data.particles_25um);
-    Serial.print("Particles > 5.0um / 0.1L air: ");
-    Serial.println(pms_data.particles_50um);
-    Serial.print("Particles > 10.0 um / 0.1L air: ");
-    Serial.println(pms_data.particles_100um);
+    printReading("PM 1.0 standard",
+                 FRAME_SENSOR_PM10_STANDARD, pms_data.pm10_standard);
+    printReading("PM 2.5 standard",
+                 FRAME_SENSOR_PM25_STANDARD, pms_data.pm25_standard);
+    printReading("PM 10.0 standard",
+                 FRAME_SENSOR_PM100_STANDARD, pms_data.pm100_standard);
+
+    printReading("PM 1.0 environmental",
+                 FRAME_SENSOR_PM10_ENV, pms_data.pm10_env);
+    printReading("PM 2.5 environmental",
+                 FRAME_SENSOR_PM25_ENV, pms_data.pm25_env);
+    printReading("PM 10.0 environmental",
+                 FRAME_SENSOR_PM100_ENV, pms_data.pm100_env);
+
+    printReading("Particles > 0.3um / 0.1L air",
+                 FRAME_SENSOR_PARTICLES_03UM, pms_data.particles_03um);
+    printReading("Particles > 0.5um / 0.1L air",
+                 FRAME_SENSOR_PARTICLES_05UM, pms_data.particles_05um);
+    printReading("Particles > 1.0um / 0.1L air",
+                 FRAME_SENSOR_PARTICLES_10UM, pms_data.particles_10um);
+    printReading("Particles > 2.5um / 0.1L air",
+                 FRAME_SENSOR_PARTICLES_25UM, pms_data.particles_25um);
+    printReading("Particles > 5.0um / 0.1L air",
+                 FRAME_SENSOR_PARTICLES_50UM, pms_data.particles_50um);
+    printReading("Particles > 10.0 um / 0.1L air",
+                 FRAME_SENSOR_PARTICLES_100UM, pms_data.particles_100um);
   }
 
   // Read temperature and humidity.
@@ -149,26 +177,25 @@ void loop() {
 
   // Print temperature and humidity.
   if (!isnan(h)) {
-    Serial.print("Humidity: ");
-    Serial.println(h);
+    printReading("Humidity",
+                 FRAME_SENSOR_HUMIDITY, h);
   }
   if (!isnan(t)) {
-    Serial.print("Temperature: ");
-    Serial.println(t);
+    printReading("Temperature",
+                 FRAME_SENSOR_TEMPERATURE, t);
   }
 
   // Read and print water level.
   int water = 0;
   if (WATER_ENABLED) {
     water = analogRead(WATER_SENSOR);
-    Serial.print("Water level: ");
-    Serial.println(water);
+    printReading("Water level",
+                 FRAME_SENSOR_WATER_LEVEL, (unsigned int) water);
   }
 
   // Read and print pressure.
   const float pressure = bmp.readPressure() / 100.0;
-  Serial.print("Pressure: ");
-  Serial.println(pressure);
+  printReading("Pressure", FRAME_SENSOR_PRESSURE, pressure);
 
   // Print data to LCD.
   lcd.clear();
@@ -0,0 +1,41 @@
+#include "serial_frame.h"
+
+#define FRAME_START_0 0xA5
+#define FRAME_START_1 0x5A
+#define FRAME_PAYLOAD_LENGTH 7
+
+static uint16_t frame_sequence = 0;
+
+// CRC-16/CCITT, polynomial 0x1021, initial value 0xFFFF.
+static uint16_t crc16(const uint8_t* data, uint8_t length) {
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < length; ++i) {
+    crc ^= ((uint16_t)data[i]) << 8;
+    for (uint8_t bit = 0; bit < 8; ++bit) {
+      if (crc & 0x8000) {
+        crc = (crc << 1) ^ 0x1021;
+      } else {
+        crc = crc << 1;
+      }
+    }
+  }
+  return crc;
+}
+
+void writeFrame(Stream* serial, uint8_t sensor_id, float value) {
+  uint8_t payload[FRAME_PAYLOAD_LENGTH];
+  payload[0] = sensor_id;
+  payload[1] = frame_sequence & 0xFF;
+  payload[2] = frame_sequence >> 8;
+  // AVR is little endian, same as the frame.
+  memcpy(payload + 3, &value, 4);
+  frame_sequence++;
+
+  const uint16_t crc = crc16(payload, FRAME_PAYLOAD_LENGTH);
+
+  serial->write(FRAME_START_0);
+  serial->write(FRAME_START_1);
+  serial->write(payload, FRAME_PAYLOAD_LENGTH);
+  serial->write(crc & 0xFF);
+  serial->write(crc >> 8);
+}
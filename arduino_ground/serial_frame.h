@@ -0,0 +1,33 @@
+#include <Arduino.h>
+
+// Compact framed output, an alternative to the text lines.
+//
+// A frame is 11 bytes:
+//   - 0xA5, 0x5A: start bytes (never present in the text output)
+//   - sensor id (uint8)
+//   - sequence number (uint16, little endian)
+//   - value (float32, little endian)
+//   - CRC-16/CCITT of the id, sequence number and value
+//     (polynomial 0x1021, initial value 0xFFFF, little endian)
+//
+// Sensor ids must match COMM_FRAME_SENSOR_IDS in logger/config.py.
+#define FRAME_SENSOR_HUMIDITY 1
+#define FRAME_SENSOR_TEMPERATURE 2
+#define FRAME_SENSOR_WATER_LEVEL 3
+#define FRAME_SENSOR_PRESSURE 4
+#define FRAME_SENSOR_PM10_STANDARD 5
+#define FRAME_SENSOR_PM25_STANDARD 6
+#define FRAME_SENSOR_PM100_STANDARD 7
+#define FRAME_SENSOR_PM10_ENV 8
+#define FRAME_SENSOR_PM25_ENV 9
+#define FRAME_SENSOR_PM100_ENV 10
+#define FRAME_SENSOR_PARTICLES_03UM 11
+#define FRAME_SENSOR_PARTICLES_05UM 12
+#define FRAME_SENSOR_PARTICLES_10UM 13
+#define FRAME_SENSOR_PARTICLES_25UM 14
+#define FRAME_SENSOR_PARTICLES_50UM 15
+#define FRAME_SENSOR_PARTICLES_100UM 16
+
+// Writes a single frame to the serial output.
+// The sequence number is incremented with every frame.
+void writeFrame(Stream* serial, uint8_t sensor_id, float value);
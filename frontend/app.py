@@ -1,18 +1,40 @@
 #!/usr/bin/env python
 
 import bottle
-from collections import defaultdict
 from concurrent import futures
 from datetime import datetime, timezone, timedelta
-import math
-import pysolar
+import hashlib
+import hmac
+import json
+import re
+import struct
+import threading
 import time
+import urllib.parse
 
+import charts
 import config
 import db_access
+import fetch_plan
+import http_cache
+import metrics
+import sampling_profiler
+import series
+import transforms
 
 app = bottle.Bottle()
-executor = futures.ThreadPoolExecutor(max_workers=40)
+# Plugins installed first wrap the ones installed later, so the
+# timings include compression.
+app.install(metrics.timing_plugin)
+app.install(http_cache.gzip_plugin)
+executor = metrics.MeteredThreadPoolExecutor(
+    "executor", max_workers=40, max_queued=config.API_MAX_QUEUED_FETCHES)
+static_files = http_cache.StaticFiles("staticdata/")
+profiler = sampling_profiler.SamplingProfiler(
+    config.PROFILER_OUTPUT_DIR, config.PROFILER_INTERVAL_SEC)
+transform_executor = transforms.TransformExecutor(
+    config.TRANSFORM_PROCESSES, config.TRANSFORM_PROCESS_MIN_POINTS)
+bottle.SimpleTemplate.defaults["static_url"] = static_files.url
 
 
 class BackendLatencyTimer(object):
@@ -28,242 +50,124 @@ class BackendLatencyTimer(object):
         self.total += datetime.now(timezone.utc) - self._start
 
 
-def abs_delta_seconds(first, second):
-    delta = (second - first).total_seconds()
-    return abs(delta)
-
-
-def apply_smoothing(readings, minutes):
-    """Applies a +- X min average to the readings."""
-    output_readings = []
-    for i, (value, timestamp) in enumerate(readings):
-        surround_values = [value]
-
-        fwd_idx = i + 1
-        while fwd_idx < len(readings):
-            fwd_value, fwd_timestamp = readings[fwd_idx]
-            abs_time_delta = abs_delta_seconds(timestamp, fwd_timestamp)
-            if abs_time_delta < minutes * 60:
-                surround_values.append(fwd_value)
-            else:
-                break
-            fwd_idx += 1
-
-        back_idx = i - 1
-        while back_idx >= 0:
-            back_value, back_timestamp = readings[back_idx]
-            abs_time_delta = abs_delta_seconds(timestamp, back_timestamp)
-            if abs_time_delta < minutes * 60:
-                surround_values.append(back_value)
+# Relative times in the from= URL parameter, e.g. "-7d".
+_RELATIVE_TIME_REGEX = re.compile(r"^-(\d+(?:\.\d+)?)([hdwy])$")
+_RELATIVE_TIME_UNITS = {
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+    "w": timedelta(weeks=1),
+    "y": timedelta(days=365),
+}
+
+
+class TimeRange(object):
+    """Time range and number of points of a chart page.
+
+    Set with from=, to= and points= URL parameters. Times are
+    ISO 8601 (UTC if no time zone is given); `from` can also be
+    relative to `to`, e.g. "-7d", and `to` defaults to now
+    (rounded up to CHART_TIME_ROUNDING_SEC)."""
+
+    def __init__(self, time_from, time_to, points):
+        self.time_from = time_from
+        self.time_to = time_to
+        self.points = points
+
+    @classmethod
+    def from_query(cls, query, points_param="points"):
+        """Parses the URL parameters, aborts with 400 if they're invalid."""
+        try:
+            time_to = cls._parse_time(query.get("to") or "now")
+            text_from = query.get("from")
+            if not text_from:
+                time_from = time_to - timedelta(hours=config.CHART_DEFAULT_RANGE_HOURS)
             else:
-                break
-            back_idx -= 1
-
-        average = sum(surround_values) / len(surround_values)
-        output_readings.append((average, timestamp))
-
-    return output_readings
-
-
-def insert_gaps(readings, min_gap_minutes):
-    """Inserts gaps into the readings.
-
-    If there's a reading gap of at least `min_gap_minutes` minutes."""
-    output_readings = []
-    if not readings:
-        return output_readings
-    output_readings.append(readings[0])
-    for i in range(1, len(readings)):
-        _, prev_timestamp = readings[i - 1]
-        curr_value, curr_timestamp = readings[i]
-        minutes_passed = (curr_timestamp - prev_timestamp).total_seconds() / 60.0
-        if minutes_passed > min_gap_minutes:
-            gap_delay = timedelta(minutes=(minutes_passed / 2.0))
-            gap_timestamp = prev_timestamp + gap_delay
-            output_readings.append((None, gap_timestamp))
-        output_readings.append((curr_value, curr_timestamp))
-
-    return output_readings
-
-
-def multiply_series(readings, multiplier):
-    """Multiplies all values in the series by a constant."""
-    output_readings = []
-    for value, timestamp in readings:
-        if value is None:
-            output_readings.append((None, timestamp))
-        else:
-            output_readings.append((value * multiplier, timestamp))
-    return output_readings
-
-
-def round_datetime(dt, minutes):
-    discard = timedelta(
-        minutes=dt.minute % minutes,
-        seconds=dt.second,
-        microseconds=dt.microsecond)
-    dt -= discard
-    if discard >= timedelta(minutes=(minutes / 2.0)):
-        dt += timedelta(minutes=minutes)
-    return dt
-
-
-class HumidityAndTemperature(object):
-    """Humidity and temperature around a certain point in time."""
-
-    # Constants for the saturation vapor pressure formula.
-    # From Lowe, P.R. and J.M. Ficke, 1974: "The computation
-    # of saturation vapor pressure"
-    _A0 = 6.107799961
-    _A1 = 4.436518521e-1
-    _A2 = 1.428945805e-2
-    _A3 = 2.650648471e-4
-    _A4 = 3.031240396e-6
-    _A5 = 2.034080948e-8
-    _A6 = 6.136820929e-11
-
-    def __init__(self):
-        self._humidities = []
-        self._temperatures = []
-
-    def add_hmdt(self, hmdt):
-        self._humidities.append(hmdt)
-
-    def add_temp(self, temp):
-        self._temperatures.append(temp)
-
-    def avg_hmdt(self):
-        if not self._humidities:
-            return None
-        return sum(self._humidities) / len(self._humidities)
-
-    def avg_temp(self):
-        if not self._temperatures:
-            return None
-        return sum(self._temperatures) / len(self._temperatures)
-
-    def saturation_vapor_pressure(self):
-        """Computes the saturation vapor pressure in hPa."""
-        temp = self.avg_temp()
-        if temp is None:
-            return None
-
-        # Computing the polynomial
-        result = HumidityAndTemperature._A6
-        result *= temp
-        result += HumidityAndTemperature._A5
-        result *= temp
-        result += HumidityAndTemperature._A4
-        result *= temp
-        result += HumidityAndTemperature._A3
-        result *= temp
-        result += HumidityAndTemperature._A2
-        result *= temp
-        result += HumidityAndTemperature._A1
-        result *= temp
-        result += HumidityAndTemperature._A0
-
-        return result
-
-    def vapor_pressure(self):
-        """Computes the vapor pressure in hPa."""
-        hmdt = self.avg_hmdt()
-        if hmdt is None:
-            return None
-
-        svp = self.saturation_vapor_pressure()
-        if svp is None:
-            return None
-
-        return (hmdt / 100.0) * svp
-
-
-def compute_vapor_pressure(temp_history, hmdt_history):
-    """Creates a time series with vapor pressure, in hPa."""
-    # First we need to align the temperature history
-    # with humidity history. We'll round to 10-minute
-    # intervals.
-    rounded_map = defaultdict(lambda: HumidityAndTemperature())
-    for temp, time in temp_history:
-        rounded_time = round_datetime(time, minutes=10)
-        rounded_map[rounded_time].add_temp(temp)
-    for hmdt, time in hmdt_history:
-        rounded_time = round_datetime(time, minutes=10)
-        rounded_map[rounded_time].add_hmdt(hmdt)
-
-    vapor_pressure_history = []
-    for time, hmdt_and_temp in rounded_map.items():
-        vapor_pressure = hmdt_and_temp.vapor_pressure()
-        if vapor_pressure is not None:
-            vapor_pressure_history.append((vapor_pressure, time))
-    vapor_pressure_history.sort(key=lambda x: x[1])
-
-    return vapor_pressure_history
-
-
-def dew_point_from_vapor_pressure(vapor_pressure):
-    """Computes the dew point, in deg C.
-
-    Takes vapor pressure in hPa.
-    """
-    # Formula from Wikipedia:
-    # https://en.wikipedia.org/wiki/Dew_point
-    pa = vapor_pressure
-    a = 6.1121
-    b = 18.678
-    c = 257.14
-
-    pa_a = pa / a
-    log_pa_a = math.log(pa_a)
-
-    return c * log_pa_a / (b - log_pa_a)
-
-
-def compute_dew_point(vapor_pressure_history):
-    """Creates a time series with dew point, in deg C.
-
-    Takes a time series with vapor pressure in hPa.
-    """
-    dew_point_history = []
-    for vapor_pressure, time in vapor_pressure_history:
-        if None in [vapor_pressure, time]:
-            continue
-        dew_point = dew_point_from_vapor_pressure(vapor_pressure)
-        dew_point_history.append((dew_point, time))
-
-    return dew_point_history
-
-def compute_sun_altitude(time):
-    return pysolar.solar.get_altitude(
-        config.SITE_LATITUDE,
-        config.SITE_LONGITUDE,
-        time,
-    )
-
-
-def generate_sun_altitude_series(time_from, time_to, num_points=101):
-    """Generates a time series with sun's altitude."""
-    time_per_point = (time_to - time_from)/(num_points - 1)
-    series = []
-    for i in range(num_points):
-        point_time = time_from + (time_per_point * i)
-        sun_altitude = compute_sun_altitude(point_time)
-        series.append((sun_altitude, point_time))
-
-    return series
-
-
-def compute_sun_radiation_power_series(sun_altitude_series):
-    """Compute sun's radiation power using sun's altitude."""
-    output = []
-    for altitude, time in sun_altitude_series:
-        if altitude <= 0.0:
-            radiation = 0.0
-        else:
-            radiation = pysolar.radiation.get_radiation_direct(time, altitude)
-        output.append((radiation, time))
-
-    return output
+                match = _RELATIVE_TIME_REGEX.match(text_from)
+                if match:
+                    amount, unit = match.groups()
+                    time_from = time_to - float(amount) * _RELATIVE_TIME_UNITS[unit]
+                else:
+                    time_from = cls._parse_time(text_from)
+            points = int(query.get(points_param) or config.CHART_DEFAULT_POINTS)
+        except (ValueError, OverflowError) as e:
+            bottle.abort(400, "Invalid time range: %s" % e)
+
+        span = time_to - time_from
+        if span < timedelta(hours=config.CHART_MIN_RANGE_HOURS):
+            bottle.abort(400, "Time range shorter than %.1f hours" %
+                         config.CHART_MIN_RANGE_HOURS)
+        if span > timedelta(days=config.CHART_MAX_RANGE_DAYS):
+            bottle.abort(400, "Time range longer than %d days" %
+                         config.CHART_MAX_RANGE_DAYS)
+        points = max(config.CHART_MIN_POINTS, min(config.CHART_MAX_POINTS, points))
+        return cls(time_from, time_to, points)
+
+    @staticmethod
+    def _parse_time(text):
+        if text == "now":
+            now = datetime.now(timezone.utc).timestamp()
+            rounding = config.CHART_TIME_ROUNDING_SEC
+            return datetime.fromtimestamp(now - now % rounding + rounding, timezone.utc)
+        time = datetime.fromisoformat(text)
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=timezone.utc)
+        return time.astimezone(timezone.utc)
+
+    def span(self):
+        return self.time_to - self.time_from
+
+    def scale(self):
+        """Returns the span relative to the default time range."""
+        return self.span() / timedelta(hours=config.CHART_DEFAULT_RANGE_HOURS)
+
+    def tier(self):
+        """Returns the rollup tier the charts are read from."""
+        return db_access.choose_tier(self.time_from, self.time_to, self.points)
+
+    def smoothing_minutes(self, minutes):
+        """Scales a smoothing window (for the default range) to this range."""
+        return minutes * self.scale()
+
+    def min_gap_minutes(self, minutes):
+        """Scales a gap threshold (for raw readings) to the data resolution.
+
+        Gaps are shown where at least 2.5 points are missing."""
+        resolution_minutes = db_access.resolution_seconds(self.tier()) / 60.0
+        return max(minutes, 2.5 * resolution_minutes)
+
+    def query_string(self, time_from, time_to, timespec="minutes"):
+        return "?" + urllib.parse.urlencode(
+            [("from", time_from.isoformat(timespec=timespec)),
+             ("to", time_to.isoformat(timespec=timespec)),
+             ("points", self.points)])
+
+    def api_query_string(self):
+        """Returns the query string for the series API."""
+        return "?" + urllib.parse.urlencode(
+            [("from", self.time_from.isoformat(timespec="seconds")),
+             ("to", self.time_to.isoformat(timespec="seconds")),
+             ("res", self.points)])
+
+    def is_closed(self):
+        """True if no new readings are expected in the time range."""
+        age = datetime.now(timezone.utc) - self.time_to
+        return age > timedelta(hours=config.API_CLOSED_RANGE_AGE_HOURS)
+
+    def navigation_links(self):
+        """Returns (label, query string) links to neighbouring ranges."""
+        span = self.span()
+        middle = self.time_from + span / 2
+        links = [
+            ("« Earlier", self.query_string(self.time_from - span, self.time_from)),
+            ("Zoom in", self.query_string(middle - span / 4, middle + span / 4)),
+            ("Zoom out", self.query_string(middle - span, middle + span)),
+            ("Later »", self.query_string(self.time_to, self.time_to + span)),
+        ]
+        for label, relative in [("Day", "-1d"), ("2 days", "-2d"), ("Week", "-1w"),
+                                ("Month", "-30d"), ("Year", "-1y")]:
+            links.append((label, "?" + urllib.parse.urlencode(
+                [("from", relative), ("points", self.points)])))
+        return links
 
 
 def date_to_seconds_ago(date):
@@ -286,25 +190,59 @@ def degrees_to_direction_name(degrees):
     return dirs[ix % 16]
 
 
+# Kinds of readings shown on the / page.
+ROOT_KINDS = [
+    config.GCP_TEMP_KIND,
+    config.GCP_HMDT_KIND,
+    config.GCP_PRES_KIND,
+    config.GCP_PM25_KIND,
+]
+
+
+def start_background_refresh(latest_only=False):
+    """Starts a thread keeping the readings behind the pages fresh.
+
+    With `latest_only`, only the latest readings are kept fresh (see
+    prefork_server, where recent readings are refreshed by another
+    process). Also starts the transform processes."""
+    transform_executor.start()
+    names = None if latest_only else charts.source_kinds()
+    thread = threading.Thread(
+        target=db_access.refresher_loop,
+        kwargs=dict(names=names, latest_names=ROOT_KINDS))
+    thread.daemon = True
+    thread.start()
+
+
 @app.get("/")
 def root():
     latency = BackendLatencyTimer()
     rain_time_to = datetime.now(timezone.utc)
     rain_time_from = rain_time_to - timedelta(days=1)
     with latency:
-        client = db_access.get_datastore_client()
-        temp_and_date = executor.submit(
-            db_access.get_latest_reading, client, config.GCP_TEMP_KIND)
-        hmdt_and_date = executor.submit(
-            db_access.get_latest_reading, client, config.GCP_HMDT_KIND)
-        pres_and_date = executor.submit(
-            db_access.get_latest_reading, client, config.GCP_PRES_KIND)
-        pm_25_and_date = executor.submit(
-            db_access.get_latest_reading, client, config.GCP_PM25_KIND)
-        temp, temp_date = temp_and_date.result()
-        hmdt, hmdt_date = hmdt_and_date.result()
-        pres, pres_date = pres_and_date.result()
-        pm_25, pm_25_date = pm_25_and_date.result()
+        storage = db_access.get_storage()
+        with metrics.stage("fetch:latest"):
+            latest = db_access.get_latest_readings(storage, ROOT_KINDS)
+        temp, temp_date = latest[config.GCP_TEMP_KIND]
+        hmdt, hmdt_date = latest[config.GCP_HMDT_KIND]
+        pres, pres_date = latest[config.GCP_PRES_KIND]
+        pm_25, pm_25_date = latest[config.GCP_PM25_KIND]
+
+    # The page only changes with new readings.
+    timestamps = [timestamp for _, timestamp in latest.values()
+                  if timestamp is not None]
+    last_modified = max(timestamps) if timestamps else None
+    etag = '"%s"' % hashlib.sha1(repr(sorted(latest.items())).encode("utf-8")).hexdigest()
+    headers = {"Cache-Control": "public, max-age=%d" % config.PAGE_MAX_AGE_SEC}
+    not_modified = http_cache.not_modified_response(
+        headers, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    bottle.response.set_header("ETag", etag)
+    if last_modified is not None:
+        bottle.response.set_header("Last-Modified", http_cache.http_date(last_modified))
+    for header, value in headers.items():
+        bottle.response.set_header(header, value)
 
     dates = [temp_date, hmdt_date, pres_date]
     if None in dates:
@@ -325,203 +263,261 @@ def root():
         vapor_pres = None
         dew_point = None
     else:
-        hmdt_and_temp = HumidityAndTemperature()
-        hmdt_and_temp.add_hmdt(hmdt)
-        hmdt_and_temp.add_temp(temp)
-        vapor_pres = hmdt_and_temp.vapor_pressure()
-        dew_point = dew_point_from_vapor_pressure(vapor_pres)
-
-    return bottle.template("root.tpl", dict(
-        temp=temp,
-        hmdt=hmdt,
-        vapor_pres=vapor_pres,
-        dew_point=dew_point,
-        pres=pres,
-        pm_25=pm_25,
-        data_age=data_age,
-        latency=latency.total,
-    ))
-
-
-class ChartData(object):
-    """A helper struct to hold chart data.
-
-    Stores a single time series."""
-
-    def __init__(self, name, description, history, chart_type="LineChart"):
-        self.name = name
-        self.description = description
-        self.history = history
-        self.chart_type = chart_type
-
-class MultipleChartData(object):
-    """A helper struct to hold chart data.
-
-    Stores multiple time series."""
-
-    def __init__(self, name, description, chart_type="LineChart"):
-        self.name = name
-        self.description = description
-        self.chart_type = chart_type
-        self.series = []
-
-    def add_series(self, series_description, series):
-        self.series.append((series_description, series))
+        vapor_pres = series.vapor_pressure(temp, hmdt)
+        dew_point = float(series.dew_point_from_vapor_pressure(vapor_pres))
+
+    with metrics.stage("render"):
+        return bottle.template("root.tpl", dict(
+            temp=temp,
+            hmdt=hmdt,
+            vapor_pres=vapor_pres,
+            dew_point=dew_point,
+            pres=pres,
+            pm_25=pm_25,
+            data_age=data_age,
+            latency=latency.total,
+        ))
+
+
+def cached_page(body):
+    """Returns a page, or a 304 response if the client has it already.
+
+    For pages without any readings, the ETag is computed from the body."""
+    etag = http_cache.body_etag(body)
+    headers = {"Cache-Control": "public, max-age=%d" % config.PAGE_MAX_AGE_SEC}
+    not_modified = http_cache.not_modified_response(headers, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    bottle.response.set_header("ETag", etag)
+    for header, value in headers.items():
+        bottle.response.set_header(header, value)
+    return body
 
 
 @app.get("/charts")
 def route_charts():
-    latency = BackendLatencyTimer()
-    time_to = datetime.now(timezone.utc)
-    time_from = time_to - timedelta(days=2)
-    with latency:
-        client = db_access.get_datastore_client()
-        temp_history = executor.submit(
-            db_access.get_last_readings, client, config.GCP_TEMP_KIND,
-            time_from, time_to)
-        hmdt_history = executor.submit(
-            db_access.get_last_readings, client, config.GCP_HMDT_KIND,
-            time_from, time_to)
-        pres_history = executor.submit(
-            db_access.get_last_readings, client, config.GCP_PRES_KIND,
-            time_from, time_to)
-        pm_25_history = executor.submit(
-            db_access.get_last_readings, client, config.GCP_PM25_KIND,
-            time_from, time_to)
-        temp_history = temp_history.result()
-        hmdt_history = hmdt_history.result()
-        pres_history = pres_history.result()
-        pm_25_history = pm_25_history.result()
-
-
-    # Compute sun's altitude and radiation power.
-    sun_altitude_computed = generate_sun_altitude_series(time_from, time_to)
-    sun_radiation_computed = compute_sun_radiation_power_series(sun_altitude_computed)
-
-    # Vapor pressure and dew point are computed
-    # from temperature and humidity.
-    vapor_pres_history = compute_vapor_pressure(temp_history, hmdt_history)
-    dew_point_history = compute_dew_point(vapor_pres_history)
-
-    # Smoothen the data.
-    temp_history = apply_smoothing(temp_history, minutes=20.1)
-    hmdt_history = apply_smoothing(hmdt_history, minutes=20.1)
-    vapor_pres_history = apply_smoothing(vapor_pres_history, minutes=30.1)
-    dew_point_history = apply_smoothing(dew_point_history, minutes=30.1)
-    pres_history = apply_smoothing(pres_history, minutes=20.1)
-    pm_25_history = apply_smoothing(pm_25_history, minutes=40.1)
-
-    # Insert gaps.
-    temp_history = insert_gaps(temp_history, min_gap_minutes=20.1)
-    hmdt_history = insert_gaps(hmdt_history, min_gap_minutes=20.1)
-    vapor_pres_history = insert_gaps(vapor_pres_history, min_gap_minutes=20.1)
-    dew_point_history = insert_gaps(dew_point_history, min_gap_minutes=20.1)
-    pres_history = insert_gaps(pres_history, min_gap_minutes=20.1)
-    pm_25_history = insert_gaps(pm_25_history, min_gap_minutes=20.1)
-
-    # Wrap it together in a single list.
-    chart_datas = []
-    chart_datas.append(ChartData(
-        name="temp", description="Temperature [°C]",
-        history=temp_history))
-    chart_datas.append(ChartData(
-        name="hmdt", description="Humidity [%]",
-        history=hmdt_history))
-    chart_datas.append(ChartData(
-        name="vapor_pres", description="Vapor pressure [hPa]",
-        history=vapor_pres_history))
-    chart_datas.append(ChartData(
-        name="dew_point", description="Dew point [°C]",
-        history=dew_point_history))
-    chart_datas.append(ChartData(
-        name="pres", description="Pressure [hPa]",
-        history=pres_history))
-    chart_datas.append(ChartData(
-        name="pm_25", description="PM 2.5 [μg/m³]",
-        history=pm_25_history))
-    chart_datas.append(ChartData(
-        name="sun_altitude", description="Computed altitude of the Sun [°]",
-        history=sun_altitude_computed))
-    chart_datas.append(ChartData(
-        name="sun_radiation_power",
-        description="Computed clear sky radiation power of the Sun [W/m²]",
-        history=sun_radiation_computed))
-
-    return bottle.template("charts.tpl", dict(
-        chart_datas=chart_datas,
-        time_from=time_from,
-        time_to=time_to,
-        latency=latency.total,
-    ))
+    time_range = TimeRange.from_query(bottle.request.query)
+    with metrics.stage("render"):
+        body = bottle.template("charts.tpl", dict(
+            charts=charts.WEATHER_CHARTS,
+            charts_json=charts.charts_json(charts.WEATHER_CHARTS),
+            time_range=time_range,
+        ))
+    return cached_page(body)
 
 
 @app.get("/devices")
 def route_devices():
-    latency = BackendLatencyTimer()
-    time_to = datetime.now(timezone.utc)
-    time_from = time_to - timedelta(days=2)
-    with latency:
-        client = db_access.get_datastore_client()
-        data_by_logger = dict()
-
-        # Request data
-        for logger_name, (logger_gcp_prefix, _) in config.MONITORED_LOGGERS.items():
-            logger_data = dict()
-            logger_data["latency"] = executor.submit(
-                db_access.get_last_readings,
-                client, logger_gcp_prefix + config.GCP_INTERNET_LATENCY,
-                time_from, time_to)
-            logger_data["db_latency"] = executor.submit(
-                db_access.get_last_readings,
-                client, logger_gcp_prefix + config.GCP_DB_LATENCY,
-                time_from, time_to)
-            logger_data["db_success"] = executor.submit(
-                db_access.get_last_readings,
-                client, logger_gcp_prefix + config.GCP_DB_SUCCESS_RATE,
-                time_from, time_to)
-            logger_data["arduino_bps"] = executor.submit(
-                db_access.get_last_readings,
-                client, logger_gcp_prefix + config.GCP_ARDUINO_BPS,
-                time_from, time_to)
-            data_by_logger[logger_name] = logger_data
-
-        # Get data
-        for logger_name, datas in data_by_logger.items():
-            for name in list(datas.keys()):
-                datas[name] = datas[name].result()
-
-    # Scale from seconds to miliseconds
-    for logger_name, datas in data_by_logger.items():
-        datas["latency"] = multiply_series(datas["latency"], 1000.0)
-        datas["db_latency"] = multiply_series(datas["db_latency"], 1000.0)
-
-    # Insert gaps.
-    for _, datas in data_by_logger.items():
-        for name in list(datas.keys()):
-            datas[name] = insert_gaps(datas[name], min_gap_minutes=30.1)
-
-    # Gather charts
-    charts = []
-    def add_data(name, description):
-        chart_data = MultipleChartData(name=name, description=description)
-        for logger_name, (_, logger_description) in config.MONITORED_LOGGERS.items():
-            datas = data_by_logger[logger_name]
-            chart_data.add_series(logger_description, datas[name])
-        charts.append(chart_data)
-
-    add_data("db_latency", "Cloud DB write latency [ms]")
-    add_data("db_success", "Cloud DB write success rate")
-    add_data("arduino_bps", "Arduino comm output speed [bytes/sec]")
-    add_data("latency", "Internet latency [ms]")
-
-    return bottle.template("devices.tpl", dict(
-        charts=charts,
-        time_from=time_from,
-        time_to=time_to,
-        latency=latency.total,
-    ))
+    time_range = TimeRange.from_query(bottle.request.query)
+    with metrics.stage("render"):
+        body = bottle.template("devices.tpl", dict(
+            charts=charts.DEVICE_CHARTS,
+            charts_json=charts.charts_json(charts.DEVICE_CHARTS),
+            time_range=time_range,
+        ))
+    return cached_page(body)
+
+
+def series_etag(name, time_range, output_format, latest_timestamps):
+    """Returns a strong ETag of a series API response.
+
+    Derived from the request and the timestamps of the latest
+    readings the series is computed from. Readings newer than the
+    time range don't change the response, so these don't count."""
+    parts = [name, time_range.time_from.isoformat(),
+             time_range.time_to.isoformat(), str(time_range.points),
+             output_format]
+    for timestamp in latest_timestamps:
+        if timestamp is not None:
+            timestamp = min(timestamp, time_range.time_to)
+        parts.append(str(timestamp))
+    return '"%s"' % hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def series_request(names, points_param="res"):
+    """Parses a series API request, aborts if it's invalid.
+
+    Returns the FetchPlan of the series, the TimeRange
+    and the output format."""
+    for name in names:
+        if name not in charts.SERIES:
+            bottle.abort(404, "Unknown series: %s" % name)
+    time_range = TimeRange.from_query(bottle.request.query, points_param=points_param)
+    output_format = bottle.request.query.get("format") or "json"
+    if output_format not in ("json", "binary"):
+        bottle.abort(400, "Unknown format: %s" % output_format)
+    return fetch_plan.FetchPlan(names), time_range, output_format
+
+
+def series_cache_headers(plan, time_range, output_format, latest):
+    """Returns HTTP caching headers of a series API response.
+
+    Returns a 304 response instead, if the client has it already."""
+    latest_timestamps = [latest[kind][1] for kind in plan.kinds]
+    etag = series_etag(",".join(plan.names), time_range, output_format,
+                       latest_timestamps)
+    # Readings newer than the time range don't count.
+    timestamps = [min(timestamp, time_range.time_to)
+                  for timestamp in latest_timestamps if timestamp is not None]
+    last_modified = max(timestamps) if timestamps else None
+    if time_range.is_closed():
+        max_age = config.API_CLOSED_RANGE_MAX_AGE_SEC
+    else:
+        max_age = config.API_OPEN_RANGE_MAX_AGE_SEC
+    headers = {"Cache-Control": "public, max-age=%d" % max_age}
+    if output_format == "binary":
+        content_type = "application/octet-stream"
+    else:
+        content_type = "application/json"
+    not_modified = http_cache.not_modified_response(
+        headers, etag=etag, last_modified=last_modified,
+        content_type=content_type)
+    if not_modified is not None:
+        return not_modified
+    headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_cache.http_date(last_modified)
+    return headers
+
+
+@app.get("/api/series/<name>")
+def route_api_series(name):
+    """Returns a chart series, as JSON or binary (see Series.to_binary).
+
+    Takes from=, to= (see TimeRange), res= (max number
+    of points) and format= ("json" or "binary")."""
+    plan, time_range, output_format = series_request([name])
+    storage = db_access.get_storage()
+    with metrics.stage("fetch:latest"):
+        latest = db_access.get_latest_readings(storage, plan.kinds)
+    headers = series_cache_headers(plan, time_range, output_format, latest)
+    if isinstance(headers, bottle.HTTPResponse):
+        return headers
+
+    readings, errors = plan.fetch(
+        storage, executor, time_range,
+        deadline=time.monotonic() + config.API_FETCH_DEADLINE_SEC)
+    for error in errors.values():
+        if isinstance(error, metrics.Overloaded):
+            raise bottle.HTTPError(503, "Too many requests, try again later",
+                                   **{"Retry-After": str(config.API_RETRY_AFTER_SEC)})
+    for error in errors.values():
+        if isinstance(error, (TimeoutError, futures.TimeoutError)):
+            raise bottle.HTTPError(504, "Fetching the readings took too long")
+        raise error
+    history = transform_executor.compute(
+        name, readings, time_range, time_range.points)
+
+    for header, value in headers.items():
+        bottle.response.set_header(header, value)
+    with metrics.stage("serialize"):
+        if output_format == "binary":
+            bottle.response.content_type = "application/octet-stream"
+            return history.to_binary()
+        bottle.response.content_type = "application/json"
+        return json.dumps(history.to_json(), separators=(",", ":"))
+
+
+@app.get("/api/series")
+def route_api_series_batch():
+    """Returns several chart series at once, e.g. all series of a page.
+
+    Takes names= (comma separated series names), and the same
+    parameters as route_api_series. Readings of every kind are
+    fetched once, see FetchPlan. Series that couldn't be fetched
+    in time are missing from the response (and the response
+    isn't cached).
+
+    JSON: {"series": {name: series}, "missing": [names]}.
+    Binary: uint32 number of series, then for every series in the
+    order of names=, its uint32 length in bytes (0 for missing
+    ones) and the series (see Series.to_binary), little-endian."""
+    names = [name for name in (bottle.request.query.get("names") or "").split(",")
+             if name]
+    if not names:
+        bottle.abort(400, "No series names")
+    if len(names) > config.API_MAX_BATCH_SERIES:
+        bottle.abort(400, "More than %d series" % config.API_MAX_BATCH_SERIES)
+    plan, time_range, output_format = series_request(names)
+    storage = db_access.get_storage()
+    with metrics.stage("fetch:latest"):
+        latest = db_access.get_latest_readings(storage, plan.kinds)
+    headers = series_cache_headers(plan, time_range, output_format, latest)
+    if isinstance(headers, bottle.HTTPResponse):
+        return headers
+
+    readings, errors = plan.fetch(
+        storage, executor, time_range,
+        deadline=time.monotonic() + config.API_FETCH_DEADLINE_SEC)
+    # All series are submitted first, to be computed in parallel.
+    pending = {}
+    for name in names:
+        series_readings = plan.series_readings(name, readings)
+        if series_readings is not None:
+            pending[name] = transform_executor.submit(
+                name, series_readings, time_range, time_range.points)
+    results = {name: series.result() for name, series in pending.items()}
+    missing = [name for name in names if name not in results]
+
+    if missing:
+        headers = {"Cache-Control": "no-store"}
+    for header, value in headers.items():
+        bottle.response.set_header(header, value)
+    with metrics.stage("serialize"):
+        if output_format == "binary":
+            bottle.response.content_type = "application/octet-stream"
+            parts = [struct.pack("<I", len(names))]
+            for name in names:
+                body = results[name].to_binary() if name in results else b""
+                parts.append(struct.pack("<I", len(body)))
+                parts.append(body)
+            return b"".join(parts)
+        bottle.response.content_type = "application/json"
+        return json.dumps(dict(
+            series={name: history.to_json() for name, history in results.items()},
+            missing=missing,
+        ), separators=(",", ":"))
+
+
+@app.get("/metrics")
+def route_metrics():
+    bottle.response.content_type = "text/plain"
+    return metrics.render_text()
+
+
+def check_admin_token():
+    """Aborts unless the request has the right admin token."""
+    if not config.ADMIN_TOKEN:
+        bottle.abort(404, "Not found")
+    token = bottle.request.get_header("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"),
+                               config.ADMIN_TOKEN.encode("utf-8")):
+        bottle.abort(403, "Invalid admin token")
+
+
+@app.post("/admin/profile")
+def route_admin_profile():
+    """Starts collecting a profile of this process.
+
+    Takes seconds= (how long to profile), returns the path of
+    the file the profile is written to, see sampling_profiler."""
+    check_admin_token()
+    try:
+        seconds = float(bottle.request.query.get("seconds") or
+                        config.PROFILER_DEFAULT_DURATION_SEC)
+    except ValueError:
+        bottle.abort(400, "Invalid seconds")
+    if not 0.0 < seconds <= config.PROFILER_MAX_DURATION_SEC:
+        bottle.abort(400, "Seconds out of range")
+    path = profiler.start(seconds)
+    if path is None:
+        bottle.abort(409, "A profile is being collected already")
+    bottle.response.status = 202
+    bottle.response.set_header("Cache-Control", "no-store")
+    bottle.response.content_type = "application/json"
+    return json.dumps(dict(path=path, seconds=seconds))
 
 
 @app.get("/static/<filepath:path>")
 def route_static(filepath):
-        return bottle.static_file(filepath, root="staticdata/")
+        return static_files.response(filepath)
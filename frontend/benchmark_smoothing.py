@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""Checks and benchmarks Series.smooth, checks Series.downsample.
+
+Compares the output with the original (quadratic) list-based
+implementation on synthetic series, and times both for 2-day,
+30-day and 1-year ranges of readings taken every ~2 minutes.
+Downsampled series are checked to fit in the number of points,
+and to keep the first and the last reading.
+"""
+
+from datetime import datetime, timezone, timedelta
+import math
+import random
+import time
+
+from series import Series
+
+
+def abs_delta_seconds(first, second):
+    delta = (second - first).total_seconds()
+    return abs(delta)
+
+
+def apply_smoothing_reference(readings, minutes):
+    """The original, list-based smoothing implementation."""
+    output_readings = []
+    for i, (value, timestamp) in enumerate(readings):
+        surround_values = [value]
+
+        fwd_idx = i + 1
+        while fwd_idx < len(readings):
+            fwd_value, fwd_timestamp = readings[fwd_idx]
+            abs_time_delta = abs_delta_seconds(timestamp, fwd_timestamp)
+            if abs_time_delta < minutes * 60:
+                surround_values.append(fwd_value)
+            else:
+                break
+            fwd_idx += 1
+
+        back_idx = i - 1
+        while back_idx >= 0:
+            back_value, back_timestamp = readings[back_idx]
+            abs_time_delta = abs_delta_seconds(timestamp, back_timestamp)
+            if abs_time_delta < minutes * 60:
+                surround_values.append(back_value)
+            else:
+                break
+            back_idx -= 1
+
+        average = sum(surround_values) / len(surround_values)
+        output_readings.append((average, timestamp))
+
+    return output_readings
+
+
+def generate_series(days, seed=0):
+    """Readings every ~2 minutes, with jitter, duplicates and outages."""
+    rng = random.Random(seed)
+    timestamp = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    time_to = timestamp + timedelta(days=days)
+    readings = []
+    while timestamp < time_to:
+        value = 10.0 + 8.0 * math.sin(len(readings) / 100.0) + rng.gauss(0.0, 0.5)
+        readings.append((value, timestamp))
+        if rng.random() < 0.001:
+            # Logger outage.
+            timestamp += timedelta(hours=rng.uniform(0.5, 6.0))
+        elif rng.random() < 0.01:
+            # Two readings with the same timestamp.
+            pass
+        else:
+            timestamp += timedelta(seconds=rng.uniform(100.0, 140.0),
+                                   microseconds=rng.randrange(10**6))
+    return readings
+
+
+def check_same(expected, actual):
+    assert len(expected) == len(actual)
+    for (expected_value, expected_time), (actual_value, actual_time) in zip(expected, actual):
+        assert expected_time == actual_time
+        assert math.isclose(expected_value, actual_value,
+                            rel_tol=1e-9, abs_tol=1e-9), (
+            expected_value, actual_value, actual_time)
+
+
+def check_downsample(readings, max_points):
+    history = Series.from_readings(readings).insert_gaps(min_gap_minutes=5.0)
+    downsampled = history.downsample(max_points)
+    assert len(downsampled) <= max_points, (len(downsampled), max_points)
+    assert downsampled.times[0] == history.times[0]
+    assert downsampled.times[-1] == history.times[-1]
+
+
+def smooth_series(readings, minutes):
+    return Series.from_readings(readings).smooth(minutes)
+
+
+def timed(function, *args, **kwargs):
+    time_start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - time_start
+
+
+if __name__ == "__main__":
+    for name, days in [("2 days", 2), ("30 days", 30), ("1 year", 365)]:
+        readings = generate_series(days)
+        for minutes in [20.1, 30.1, 40.1]:
+            expected, reference_time = timed(
+                apply_smoothing_reference, readings, minutes=minutes)
+            actual, new_time = timed(smooth_series, readings, minutes=minutes)
+            check_same(expected, list(actual))
+            print("%-8s %7d readings, +-%.1f min: %8.3fs -> %8.3fs (%.1fx)" % (
+                name, len(readings), minutes, reference_time, new_time,
+                reference_time / new_time))
+        for max_points in [10, 100, 1500]:
+            check_downsample(readings, max_points)
@@ -0,0 +1,167 @@
+import json
+
+import config
+import metrics
+import series
+import solar
+
+
+class SeriesSource(object):
+    """A series shown on the charts, computed from readings.
+
+    `kinds` lists the kinds of readings it's computed from.
+    `compute` takes a dict with a Series of readings of every
+    kind, and the TimeRange, and returns the series to show."""
+
+    def __init__(self, kinds, compute):
+        self.kinds = kinds
+        self.compute = compute
+
+
+class Chart(object):
+    """A chart, showing one or more series.
+
+    `series` holds (description, series name) tuples."""
+
+    def __init__(self, name, description, series, chart_type="LineChart"):
+        self.name = name
+        self.description = description
+        self.series = series
+        self.chart_type = chart_type
+
+    def to_json(self):
+        return dict(
+            name=self.name,
+            description=self.description,
+            chartType=self.chart_type,
+            series=[dict(description=description, name=name)
+                    for description, name in self.series],
+        )
+
+
+def charts_json(chart_list):
+    """Encodes chart definitions as JSON, to be put in a <script>."""
+    text = json.dumps([chart.to_json() for chart in chart_list])
+    return text.replace("</", "<\\/")
+
+
+def _smoothed_reading(kind, smoothing_minutes):
+    """A smoothed reading, with gaps."""
+    def compute(readings, time_range):
+        with metrics.stage("smooth"):
+            history = readings[kind].smooth(
+                minutes=time_range.smoothing_minutes(smoothing_minutes))
+        with metrics.stage("gaps"):
+            return history.insert_gaps(time_range.min_gap_minutes(20.1))
+    return SeriesSource([kind], compute)
+
+
+def _vapor_pressure(readings, time_range):
+    # Computed from temperature and humidity.
+    with metrics.stage("align"):
+        vapor_pres = series.compute_vapor_pressure(
+            readings[config.GCP_TEMP_KIND], readings[config.GCP_HMDT_KIND])
+    with metrics.stage("smooth"):
+        vapor_pres = vapor_pres.smooth(minutes=time_range.smoothing_minutes(30.1))
+    with metrics.stage("gaps"):
+        return vapor_pres.insert_gaps(time_range.min_gap_minutes(20.1))
+
+
+def _dew_point(readings, time_range):
+    # Computed from vapor pressure.
+    with metrics.stage("align"):
+        vapor_pres = series.compute_vapor_pressure(
+            readings[config.GCP_TEMP_KIND], readings[config.GCP_HMDT_KIND])
+        dew_point = series.compute_dew_point(vapor_pres)
+    with metrics.stage("smooth"):
+        dew_point = dew_point.smooth(minutes=time_range.smoothing_minutes(30.1))
+    with metrics.stage("gaps"):
+        return dew_point.insert_gaps(time_range.min_gap_minutes(20.1))
+
+
+def _sun_altitude(readings, time_range):
+    with metrics.stage("solar"):
+        altitude, _ = solar.generate_sun_series(
+            time_range.time_from, time_range.time_to, time_range.points)
+    return altitude
+
+
+def _sun_radiation(readings, time_range):
+    with metrics.stage("solar"):
+        _, radiation = solar.generate_sun_series(
+            time_range.time_from, time_range.time_to, time_range.points)
+    return radiation
+
+
+def _device_reading(kind, multiplier=None):
+    """A device status reading, with gaps."""
+    def compute(readings, time_range):
+        history = readings[kind]
+        if multiplier is not None:
+            history = history.multiply(multiplier)
+        with metrics.stage("gaps"):
+            return history.insert_gaps(time_range.min_gap_minutes(30.1))
+    return SeriesSource([kind], compute)
+
+
+# All series that can be shown, by name.
+SERIES = {
+    "temp": _smoothed_reading(config.GCP_TEMP_KIND, 20.1),
+    "hmdt": _smoothed_reading(config.GCP_HMDT_KIND, 20.1),
+    "vapor_pres": SeriesSource(
+        [config.GCP_TEMP_KIND, config.GCP_HMDT_KIND], _vapor_pressure),
+    "dew_point": SeriesSource(
+        [config.GCP_TEMP_KIND, config.GCP_HMDT_KIND], _dew_point),
+    "pres": _smoothed_reading(config.GCP_PRES_KIND, 20.1),
+    "pm_25": _smoothed_reading(config.GCP_PM25_KIND, 40.1),
+    "sun_altitude": SeriesSource([], _sun_altitude),
+    "sun_radiation_power": SeriesSource([], _sun_radiation),
+}
+for _logger_name, (_logger_gcp_prefix, _) in config.MONITORED_LOGGERS.items():
+    # Latencies are scaled from seconds to miliseconds.
+    SERIES[_logger_name + ":db_latency"] = _device_reading(
+        _logger_gcp_prefix + config.GCP_DB_LATENCY, multiplier=1000.0)
+    SERIES[_logger_name + ":db_success"] = _device_reading(
+        _logger_gcp_prefix + config.GCP_DB_SUCCESS_RATE)
+    SERIES[_logger_name + ":arduino_bps"] = _device_reading(
+        _logger_gcp_prefix + config.GCP_ARDUINO_BPS)
+    SERIES[_logger_name + ":latency"] = _device_reading(
+        _logger_gcp_prefix + config.GCP_INTERNET_LATENCY, multiplier=1000.0)
+
+
+def source_kinds():
+    """Returns kinds of readings all the series are computed from."""
+    return sorted(set(kind for source in SERIES.values() for kind in source.kinds))
+
+
+# Charts on the /charts page.
+WEATHER_CHARTS = [
+    Chart("temp", "Temperature [°C]", [("Temperature", "temp")]),
+    Chart("hmdt", "Humidity [%]", [("Humidity", "hmdt")]),
+    Chart("vapor_pres", "Vapor pressure [hPa]", [("Vapor pressure", "vapor_pres")]),
+    Chart("dew_point", "Dew point [°C]", [("Dew point", "dew_point")]),
+    Chart("pres", "Pressure [hPa]", [("Pressure", "pres")]),
+    Chart("pm_25", "PM 2.5 [μg/m³]", [("PM 2.5", "pm_25")]),
+    Chart("sun_altitude", "Computed altitude of the Sun [°]",
+          [("Altitude", "sun_altitude")]),
+    Chart("sun_radiation_power",
+          "Computed clear sky radiation power of the Sun [W/m²]",
+          [("Radiation power", "sun_radiation_power")]),
+]
+
+
+def _device_chart(name, description):
+    """A chart with a series for every monitored logger."""
+    return Chart(name, description, [
+        (logger_description, logger_name + ":" + name)
+        for logger_name, (_, logger_description) in config.MONITORED_LOGGERS.items()
+    ])
+
+
+# Charts on the /devices page.
+DEVICE_CHARTS = [
+    _device_chart("db_latency", "Cloud DB write latency [ms]"),
+    _device_chart("db_success", "Cloud DB write success rate"),
+    _device_chart("arduino_bps", "Arduino comm output speed [bytes/sec]"),
+    _device_chart("latency", "Internet latency [ms]"),
+]
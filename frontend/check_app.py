@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""Checks the app, with readings in a temporary SQLite replica.
+
+Needs no access to GCP (see config.STORAGE_BACKEND). Requests are
+made by calling the WSGI app directly. Run with:
+    ./check_app.py
+"""
+
+from datetime import datetime, timedelta, timezone
+import gzip
+import math
+import os
+import shutil
+import tempfile
+from wsgiref import util
+
+import config
+
+_REPLICA_DIRECTORY = tempfile.mkdtemp()
+config.STORAGE_BACKEND = "sqlite"
+config.SQLITE_REPLICA_FILE = os.path.join(_REPLICA_DIRECTORY, "replica.sqlite3")
+
+import app
+import db_access
+import rollups
+import storage_backends
+
+
+def write_readings(kind, time_from, time_to, interval_sec):
+    """Writes readings of a kind to the replica, every `interval_sec`."""
+    replica = storage_backends.SqliteStorage(
+        config.SQLITE_REPLICA_FILE, read_only=False)
+    readings = []
+    timestamp = time_from
+    while timestamp < time_to:
+        readings.append((20.0 + 5.0 * math.sin(timestamp.timestamp() / 3600.0),
+                         timestamp))
+        timestamp += timedelta(seconds=interval_sec)
+    replica.write_readings(kind, readings)
+
+
+def request(path, headers=()):
+    """Makes a GET request, returns the status, headers and body."""
+    environ = dict(PATH_INFO=path.split("?")[0])
+    if "?" in path:
+        environ["QUERY_STRING"] = path.split("?", 1)[1]
+    for header, value in headers:
+        environ["HTTP_" + header.upper().replace("-", "_")] = value
+    util.setup_testing_defaults(environ)
+    response = []
+    body = b"".join(app.app(
+        environ, lambda status, headers: response.extend((status, dict(headers)))))
+    status, headers = response
+    return int(status.split()[0]), headers, body
+
+
+def check_html_gzip():
+    """HTML pages are compressed, if the client accepts gzip."""
+    for path in ["/", "/charts", "/devices"]:
+        status, headers, body = request(path)
+        assert status == 200, (path, status)
+        assert "Content-Encoding" not in headers, path
+
+        status, gzip_headers, gzip_body = request(
+            path, headers=[("Accept-Encoding", "gzip")])
+        assert status == 200, (path, status)
+        assert gzip_headers.get("Content-Encoding") == "gzip", path
+        assert gzip.decompress(gzip_body) == body, path
+        assert gzip_headers["Etag"] != headers["Etag"], path
+
+
+def check_not_modified_etag():
+    """304 responses have the ETag the 200 response would have."""
+    for path in ["/charts", "/api/series/temp", "/api/series/temp?format=binary"]:
+        for accept_encoding in ["gzip", "identity"]:
+            headers = [("Accept-Encoding", accept_encoding)]
+            status, full_headers, _ = request(path, headers=headers)
+            assert status == 200, (path, status)
+            status, not_modified_headers, _ = request(
+                path, headers=headers + [("If-None-Match", full_headers["Etag"])])
+            assert status == 304, (path, status)
+            assert not_modified_headers["Etag"] == full_headers["Etag"], (
+                path, accept_encoding)
+
+
+def check_partial_rollup_tier(now):
+    """Readings before the first bucket of a tier are read raw."""
+    kind = "check:ground_level:reading:temperature"
+    time_from = now - timedelta(days=7)
+    max_points = 1500
+    tier_name = db_access.choose_tier(time_from, now, max_points)
+    assert tier_name is not None
+    bucket_seconds = db_access.resolution_seconds(tier_name)
+    write_readings(kind, now - timedelta(days=8), now,
+                   config.RAW_READING_INTERVAL_SEC)
+    # The tier is backfilled for the last 2 days only.
+    write_readings(db_access.rollup_kind(kind, tier_name),
+                   now - timedelta(days=2), now, bucket_seconds)
+
+    history = db_access.get_readings(
+        db_access.get_storage(), kind, time_from, now, max_points)
+    assert len(history) <= max_points, len(history)
+    assert history.times[0] - time_from.timestamp() <= bucket_seconds
+    assert (history.times[1:] - history.times[:-1]).max() <= 2 * bucket_seconds
+
+
+if __name__ == "__main__":
+    now = datetime.now(timezone.utc)
+    try:
+        for kind in rollups.rollup_source_kinds():
+            write_readings(kind, now - timedelta(days=3), now,
+                           config.RAW_READING_INTERVAL_SEC)
+        for check in [check_html_gzip, check_not_modified_etag]:
+            check()
+            print("OK", check.__name__)
+        check_partial_rollup_tier(now)
+        print("OK", check_partial_rollup_tier.__name__)
+    finally:
+        shutil.rmtree(_REPLICA_DIRECTORY)
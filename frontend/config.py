@@ -1,10 +1,26 @@
+import os
+
 # Site location
 SITE_LATITUDE=53.794847
 SITE_LONGITUDE=20.437800
 
+# Computed Sun's position and radiation.
+# Resolution of the cached per-day tables.
+SOLAR_TABLE_STEP_SEC=120
+# How many per-day tables to keep in memory.
+SOLAR_CACHE_DAYS=400
+# Chart resolution: one point per interval, but no
+# less than SOLAR_MIN_POINTS and no more than SOLAR_MAX_POINTS.
+SOLAR_POINT_INTERVAL_SEC=600
+SOLAR_MIN_POINTS=101
+SOLAR_MAX_POINTS=20000
+
 # Database settings.
 GCP_CREDENTIALS="./gcp-credentials.json"
 GCP_PROJECT="pogoda-240600"
+# Where readings are read from: "datastore", or "sqlite" for a
+# local read replica (SQLITE_REPLICA_FILE, see replica_sync.py).
+STORAGE_BACKEND="datastore"
 
 # GCP kinds for sensor data.
 GCP_TEMP_KIND="wczasowa:ground_level:reading:temperature"
@@ -15,6 +31,10 @@ GCP_WND_SPEED_KIND="wczasowa:roof_level:reading:wind_speed"
 GCP_WND_DIR_KIND="wczasowa:roof_level:reading:wind_direction"
 GCP_RAIN_MM_KIND="wczasowa:roof_level:reading:total_rain_mm"
 
+# GCP kind of the per-station summaries with latest readings,
+# written by the logger.
+GCP_LATEST_KIND="latest"
+
 # GCP kinds for connection status data.
 GCP_INTERNET_LATENCY="connection:internet_latency"
 GCP_DB_LATENCY="connection:cloud_db_write_latency"
@@ -27,9 +47,160 @@ MONITORED_LOGGERS={
     # "roof_level": ("wczasowa:roof_level:", "Roof level"),
 }
 
+# In-memory cache of recent readings.
+# Time ranges starting within this window are served from the cache.
+SERIES_CACHE_WINDOW_HOURS=49.0
+# Readings from the last few minutes before the newest cached one
+# are re-fetched, in case they were uploaded late.
+SERIES_CACHE_OVERLAP_MINUTES=15.0
+# The whole window is re-fetched this often, to pick up
+# readings uploaded much later (after a logger outage).
+SERIES_CACHE_FULL_REFRESH_MINUTES=60.0
+# Approximate memory limit for the cache, across all kinds.
+SERIES_CACHE_MAX_BYTES=64 * 1024 * 1024
+# Recent readings and the latest readings are refreshed in the
+# background this often. Requests wait for the DB only if the
+# cached ones are older than CACHE_MAX_STALENESS_SEC.
+CACHE_REFRESH_SEC=30.0
+CACHE_MAX_STALENESS_SEC=300.0
+
+# Pre-aggregated rollups of the readings, see rollups.py.
+# The entity kind of a rollup is:
+#    GCP_ROLLUP_PREFIX + tier name + ":" + kind of the readings
+GCP_ROLLUP_PREFIX="rollup:"
+# Rollup tiers: name and bucket length in seconds, finest first.
+# Every tier is computed from the one before it, the first
+# one from raw readings.
+ROLLUP_TIERS=[
+    ("10min", 10 * 60),
+    ("hourly", 60 * 60),
+    ("daily", 24 * 60 * 60),
+]
+# Rollups of the last few hours are recomputed on every run,
+# to include readings uploaded late.
+ROLLUP_LOOKBACK_HOURS=6.0
+# Readings are rolled up this many days at a time.
+ROLLUP_CHUNK_DAYS=7
+# How often the logger uploads a reading of each kind.
+RAW_READING_INTERVAL_SEC=120.0
+
+# Local SQLite read replica of the readings and rollups, kept up to
+# date by replica_sync.py. Readings of the last few hours before the
+# newest one are copied again on every sync, to include readings
+# uploaded late and recomputed rollups.
+SQLITE_REPLICA_FILE=os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "replica.sqlite3")
+REPLICA_SYNC_OVERLAP_HOURS=ROLLUP_LOOKBACK_HOURS
+
+# Chart time ranges, set with the from= and to= URL parameters:
+# the default (last 48 hours) and the limits.
+CHART_DEFAULT_RANGE_HOURS=48.0
+CHART_MIN_RANGE_HOURS=1.0
+CHART_MAX_RANGE_DAYS=20 * 365
+# Number of points in a chart series, set with points=.
+# Long time ranges are read from rollups to fit in it.
+CHART_DEFAULT_POINTS=1500
+CHART_MIN_POINTS=50
+CHART_MAX_POINTS=5000
+# Without to=, charts end at the current time rounded up to this,
+# so that the same series are requested for a while.
+CHART_TIME_ROUNDING_SEC=60
+
+# Caching of the series API responses. Time ranges ending this long
+# ago are considered closed (no new readings expected), and can be
+# cached for longer.
+API_CLOSED_RANGE_AGE_HOURS=24.0
+API_CLOSED_RANGE_MAX_AGE_SEC=7 * 24 * 60 * 60
+API_OPEN_RANGE_MAX_AGE_SEC=60
+
+# Series API requests wait up to API_FETCH_DEADLINE_SEC for the
+# readings. With more than API_MAX_QUEUED_FETCHES fetches waiting
+# for a thread, new requests are turned away, and asked to retry
+# after API_RETRY_AFTER_SEC.
+API_FETCH_DEADLINE_SEC=25.0
+API_MAX_QUEUED_FETCHES=200
+API_RETRY_AFTER_SEC=5
+# A single request fetches up to API_FETCH_CONCURRENCY kinds of
+# readings at a time, and up to API_MAX_BATCH_SERIES series.
+API_FETCH_CONCURRENCY=8
+API_MAX_BATCH_SERIES=100
+
+# Long time ranges are fetched from the DB in parts, in parallel:
+# one part per DB_FETCH_SHARD_READINGS expected readings, up to
+# DB_FETCH_MAX_SHARDS parts. Fetches taking longer than
+# DB_FETCH_DEADLINE_SEC fail.
+DB_FETCH_SHARD_READINGS=1000
+DB_FETCH_MAX_SHARDS=8
+DB_FETCH_THREADS=32
+DB_FETCH_MAX_QUEUED=256
+DB_FETCH_DEADLINE_SEC=20.0
+# Timeout of a single DB call (a query page, or a read).
+DB_QUERY_TIMEOUT_SEC=10.0
+# Parts of a fetch taking longer than usual (the 95th percentile
+# of DB_HEDGE_MIN_SAMPLES fetches or more, but no less than
+# DB_HEDGE_MIN_DELAY_SEC) are requested again, and the first
+# result is used.
+DB_HEDGE_MIN_SAMPLES=20
+DB_HEDGE_MIN_DELAY_SEC=0.05
+# Read only values and timestamps of readings, from indexes. Needs
+# the indexes from index.yaml to be deployed first.
+DB_PROJECTION_QUERIES=False
+
+# Concurrent requests for the same kind of readings, with time
+# ranges within the same buckets of this length, share a query.
+SINGLE_FLIGHT_BUCKET_SEC=60
+
+# Series computed from at least TRANSFORM_PROCESS_MIN_POINTS
+# readings are computed in a pool of TRANSFORM_PROCESSES processes,
+# so they don't block other requests (see transforms).
+# With 0 processes, all are computed in the request threads.
+TRANSFORM_PROCESSES=2
+TRANSFORM_PROCESS_MIN_POINTS=4000
+# On start, the pool is checked with a small series, computed
+# within this time (the processes import the app first).
+TRANSFORM_START_TIMEOUT_SEC=30.0
+
+# HTTP caching of the pages (they are revalidated with ETags).
+PAGE_MAX_AGE_SEC=30
+# HTTP caching of static files, with and without a content
+# hash in the URL.
+STATIC_HASHED_MAX_AGE_SEC=365 * 24 * 60 * 60
+STATIC_MAX_AGE_SEC=60 * 60
+# Compression of HTML and JSON responses.
+GZIP_MIN_BYTES=1024
+GZIP_LEVEL=6
+
+# On-demand profiling, with the /admin/profile route: stacks of all
+# threads are sampled every PROFILER_INTERVAL_SEC, for the requested
+# time (up to PROFILER_MAX_DURATION_SEC), and written to
+# PROFILER_OUTPUT_DIR in the collapsed stack (flame graph) format.
+PROFILER_DEFAULT_DURATION_SEC=30.0
+PROFILER_MAX_DURATION_SEC=300.0
+PROFILER_INTERVAL_SEC=0.01
+PROFILER_OUTPUT_DIR=os.path.join(os.path.dirname(os.path.realpath(__file__)), "profiles")
+
+# Token required by the /admin/ routes, in the X-Admin-Token header.
+# Taken from the environment, the routes are disabled if it's unset.
+ADMIN_TOKEN=os.environ.get("POGODA_ADMIN_TOKEN")
+
 # Web server settings.
 PROD_HTTP_HOST='127.0.0.1'
 PROD_HTTP_PORT=8092
+# Number of worker processes of the production server, see
+# prefork_server. With 0, a single process serves all requests.
+PROD_WORKERS=0
+
+# The prefork server. Workers are restarted after serving
+# PREFORK_MAX_REQUESTS requests, plus a random number up to
+# PREFORK_MAX_REQUESTS_JITTER (so they don't restart all at once).
+PREFORK_LISTEN_BACKLOG=128
+PREFORK_MAX_REQUESTS=10000
+PREFORK_MAX_REQUESTS_JITTER=1000
+# How long workers can take to finish requests on shutdown.
+PREFORK_SHUTDOWN_TIMEOUT_SEC=30.0
+# Directory with recent readings, shared by the processes.
+# In memory, preferably.
+SHARED_SERIES_DIR="/dev/shm/pogoda-series"
 
 DEV_HTTP_HOST='127.0.0.1'
 DEV_HTTP_PORT=8080
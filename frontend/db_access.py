@@ -1,10 +1,21 @@
+import collections
+from concurrent import futures
+from datetime import datetime, timezone, timedelta
 from google.cloud import datastore
+import numpy as np
 import os
+import threading
+import time
 
 import config
+from metrics import METRICS, MeteredThreadPoolExecutor
+from series import Series
+import shared_series
+import storage_backends
 
 
 _DATASTORE_CLIENT=None
+_STORAGE=None
 
 def get_datastore_client():
     """Creates a (or returns a cached) Datastore Client object."""
@@ -15,39 +26,621 @@ def get_datastore_client():
     return _DATASTORE_CLIENT
 
 
-def get_latest_reading(client, name):
-    """Returns the value and timestamp of the latest reading."""
-    query = client.query(kind=name)
-    query.order = ["-timestamp"]
-    results = list(query.fetch(limit=1))
+def get_storage():
+    """Returns the (cached) storage backend to read readings from.
 
-    if not results:
-        return None, None
-    result = results[0]
-    if "value" not in result:
-        return None, None
-    value = result["value"]
-    if "timestamp" not in result:
-        return None, None
-    timestamp = result["timestamp"]
+    Cloud Datastore, or a local read replica (see replica_sync.py),
+    depending on STORAGE_BACKEND."""
+    global _STORAGE
+    if _STORAGE is None:
+        if config.STORAGE_BACKEND == "sqlite":
+            _STORAGE = storage_backends.SqliteStorage(config.SQLITE_REPLICA_FILE)
+        else:
+            _STORAGE = storage_backends.DatastoreStorage(get_datastore_client())
+    return _STORAGE
 
-    return value, timestamp
 
+def get_latest_readings(storage, names):
+    """Returns the value and timestamp of the latest reading, by name.
 
-def get_last_readings(client, name, time_from, time_to):
-    """Returns values and timestamps of recent readings."""
-    query = client.query(kind=name)
-    query.add_filter("timestamp", ">=", time_from)
-    query.add_filter("timestamp", "<=", time_to)
-    query.order = ["timestamp"]
+    Concurrent calls for the same names share a single read, and
+    results are kept fresh in the background (see refresher_loop)."""
+    key = ("latest",) + tuple(sorted(names))
+    return dict(_LATEST_CACHE.get(
+        key, _SINGLE_FLIGHT.do, key, storage.latest_readings, names))
 
-    parsed_results = []
-    for entity in query.fetch():
-        if "value" not in entity:
-            continue
-        if "timestamp" not in entity:
-            continue
-        parsed_results.append((entity["value"], entity["timestamp"]))
-    return parsed_results
 
+def iter_readings(storage, name, time_from, time_to=None, exclusive_from=False,
+                  exclusive_to=False, projection=False):
+    """Yields values and timestamps of readings in a time range.
 
+    See DatastoreStorage.iter_readings in storage_backends."""
+    return storage.iter_readings(
+        name, time_from, time_to, exclusive_from=exclusive_from,
+        exclusive_to=exclusive_to, projection=projection)
+
+
+def query_readings(storage, name, time_from, time_to=None, exclusive_from=False):
+    """Returns a Series of readings, see iter_readings.
+
+    Long time ranges are fetched in parallel, see fetch_sharded.
+    Readings are streamed from the DB straight into the arrays."""
+    parts = fetch_sharded(
+        storage, name, time_from, time_to, Series.from_readings,
+        interval_sec=config.RAW_READING_INTERVAL_SEC,
+        exclusive_from=exclusive_from,
+        projection=config.DB_PROJECTION_QUERIES)
+    return _concatenate(parts)
+
+
+def _concatenate(parts):
+    """Returns a Series of all the readings of consecutive Series."""
+    return Series(np.concatenate([part.times for part in parts]),
+                  np.concatenate([part.values for part in parts]))
+
+
+# Fetches of parts of long time ranges. Separate from the request
+# executor, as requests wait for the fetches (with a shared pool
+# these could wait for each other forever).
+_FETCH_EXECUTOR = MeteredThreadPoolExecutor(
+    "db_fetch", max_workers=config.DB_FETCH_THREADS,
+    max_queued=config.DB_FETCH_MAX_QUEUED)
+
+
+def fetch_sharded(storage, name, time_from, time_to, collect, interval_sec,
+                  exclusive_from=False, projection=False):
+    """Fetches readings in a time range, split into parts fetched in parallel.
+
+    The number of parts depends on the expected number of readings
+    (one every `interval_sec`), up to DB_FETCH_MAX_SHARDS, or
+    a single part for storage without `sharded_fetches`.
+    `collect` is called with an iterator over the readings of every
+    part (see iter_readings), its results are returned in order.
+    Slow parts are hedged, see _first_result. Raises TimeoutError
+    if it takes longer than DB_FETCH_DEADLINE_SEC."""
+    deadline = time.monotonic() + config.DB_FETCH_DEADLINE_SEC
+    shard_to = time_to
+    if shard_to is None:
+        shard_to = datetime.now(timezone.utc)
+    seconds = max(0.0, (shard_to - time_from).total_seconds())
+    expected_readings = seconds / interval_sec
+    num_shards = int(min(config.DB_FETCH_MAX_SHARDS,
+                         max(1, expected_readings // config.DB_FETCH_SHARD_READINGS)))
+    if not storage.sharded_fetches:
+        num_shards = 1
+    if num_shards > 1:
+        METRICS.increment("db_fetch_sharded")
+        METRICS.increment("db_fetch_shards", num_shards)
+
+    # Parts are [start, end), except for the last one, which
+    # ends where the whole range does (or doesn't end).
+    bounds = [time_from + (shard_to - time_from) * i / num_shards
+              for i in range(num_shards)] + [time_to]
+    shards = []
+    for i in range(num_shards):
+        args = (collect, storage, name, bounds[i], bounds[i + 1])
+        kwargs = dict(exclusive_from=exclusive_from and i == 0,
+                      exclusive_to=i < num_shards - 1,
+                      projection=projection)
+        shards.append((args, kwargs, [_FETCH_EXECUTOR.submit(
+            _fetch_shard, *args, **kwargs)]))
+
+    # Parts still running after the usual (95th percentile)
+    # time are requested again, unless the DB is overloaded.
+    hedge_delay = _hedge_delay()
+    if hedge_delay is not None:
+        futures.wait([attempts[0] for _, _, attempts in shards],
+                     timeout=max(0.0, min(hedge_delay, deadline - time.monotonic())))
+        for args, kwargs, attempts in shards:
+            if not attempts[0].done() and _FETCH_EXECUTOR.queued() == 0:
+                METRICS.increment("db_fetch_hedged")
+                attempts.append(_FETCH_EXECUTOR.submit(_fetch_shard, *args, **kwargs))
+
+    return [_first_result(name, attempts, deadline)
+            for _, _, attempts in shards]
+
+
+def _hedge_delay():
+    """Returns how long to wait before hedging a fetch, or None."""
+    count, p95 = METRICS.quantile("db_query_seconds", (), 0.95)
+    if count < config.DB_HEDGE_MIN_SAMPLES:
+        return None
+    return max(p95, config.DB_HEDGE_MIN_DELAY_SEC)
+
+
+def _first_result(name, attempts, deadline):
+    """Returns the result of the first successful attempt.
+
+    Raises the error of the first attempt if all of them fail,
+    or TimeoutError after the deadline."""
+    pending = set(attempts)
+    while pending:
+        done, pending = futures.wait(
+            pending, timeout=max(0.0, deadline - time.monotonic()),
+            return_when=futures.FIRST_COMPLETED)
+        if not done:
+            break
+        for attempt in done:
+            if attempt.exception() is None:
+                for other in pending:
+                    other.cancel()
+                if attempt is not attempts[0]:
+                    METRICS.increment("db_fetch_hedge_wins")
+                return attempt.result()
+        if not pending:
+            raise attempts[0].exception()
+    for attempt in pending:
+        attempt.cancel()
+    METRICS.increment("db_fetch_deadline_exceeded")
+    raise TimeoutError("Fetching %s took longer than %.1f sec" %
+                       (name, config.DB_FETCH_DEADLINE_SEC))
+
+
+def _fetch_shard(collect, *args, **kwargs):
+    start = time.monotonic()
+    result = collect(iter_readings(*args, **kwargs))
+    METRICS.observe("db_query_seconds", (), time.monotonic() - start)
+    return result
+
+
+class _CachedSeries(object):
+    """Recent readings of a single kind.
+
+    Readings are complete from `covered_from` up to `last_update`.
+    The series is replaced on update, never modified in place."""
+
+    def __init__(self):
+        # Guards the fields below.
+        self.lock = threading.Lock()
+        # Held while updating, so updates don't block readers.
+        self.update_lock = threading.Lock()
+        self.series = Series([], [])
+        self.covered_from = None
+        self.last_update = None
+        self.last_full_fetch = None
+
+
+class SeriesCache(object):
+    """An in-memory cache of recent readings, by kind.
+
+    Readings are only ever appended to a series, so after the first
+    fetch only readings newer than the ones cached are queried (with
+    a small overlap, for readings uploaded late). Readings older
+    than the cache window are dropped. Least recently used kinds
+    are dropped when the cache gets too large.
+
+    Series are meant to be kept up to date in the background (see
+    refresh). Requests get the cached readings as long as they are
+    no older than `max_staleness`, and only wait for the DB on a
+    cold start, or when the cache is too stale. If the DB fails
+    then, stale readings are returned anyway.
+
+    Thread safe."""
+
+    # Memory used by a single cached reading: two float64 values.
+    _BYTES_PER_READING = 16
+
+    def __init__(self, window, overlap, full_refresh_interval, max_bytes,
+                 max_staleness):
+        self._window = window
+        self._overlap = overlap
+        self._full_refresh_interval = full_refresh_interval
+        self._max_bytes = max_bytes
+        self._max_staleness = max_staleness
+        self._lock = threading.Lock()
+        # name -> _CachedSeries, least recently used first.
+        self._series = collections.OrderedDict()
+
+    def get_readings(self, storage, name, time_from, time_to):
+        """Returns a Series of readings in the time range."""
+        now = datetime.now(timezone.utc)
+        if time_from < now - self._window:
+            # Not covered by the cache.
+            return query_readings(storage, name, time_from, time_to)
+
+        cached = self._get_series(name)
+        with cached.lock:
+            last_update = cached.last_update
+        if last_update is None:
+            # Cold start.
+            self._update(storage, name, cached)
+        elif now - last_update > self._max_staleness:
+            try:
+                self._update(storage, name, cached)
+            except Exception as e:
+                print("Problem while updating cached readings of", name)
+                print(e)
+
+        with cached.lock:
+            series = cached.series
+        start = np.searchsorted(series.times, time_from.timestamp(), side="left")
+        end = np.searchsorted(series.times, time_to.timestamp(), side="right")
+        self._evict()
+        return Series(series.times[start:end], series.values[start:end])
+
+    def refresh(self, storage, names=()):
+        """Updates the given kinds, and all the cached ones."""
+        with self._lock:
+            names = set(names) | set(self._series.keys())
+        for name in sorted(names):
+            try:
+                self._update(storage, name, self._get_series(name, touch=False))
+            except Exception as e:
+                print("Problem while updating cached readings of", name)
+                print(e)
+        self._evict()
+
+    def snapshot(self):
+        """Returns (name, series, covered_from, last_update) of every series."""
+        with self._lock:
+            series = list(self._series.items())
+        results = []
+        for name, cached in series:
+            with cached.lock:
+                if cached.last_update is not None:
+                    results.append((name, cached.series, cached.covered_from,
+                                    cached.last_update))
+        return results
+
+    # Private methods.
+
+    def _get_series(self, name, touch=True):
+        with self._lock:
+            if name not in self._series:
+                self._series[name] = _CachedSeries()
+            if touch:
+                self._series.move_to_end(name)
+            return self._series[name]
+
+    def _update(self, storage, name, cached):
+        """Brings the cached series up to date."""
+        with cached.update_lock:
+            now = datetime.now(timezone.utc)
+            with cached.lock:
+                series = cached.series
+                covered_from = cached.covered_from
+                last_full_fetch = cached.last_full_fetch
+
+            if (last_full_fetch is None or
+                    now - last_full_fetch > self._full_refresh_interval):
+                # Fetch everything within the window.
+                series = query_readings(storage, name, now - self._window)
+                last_full_fetch = now
+            else:
+                # Fetch only the new readings, re-fetching the
+                # last few minutes.
+                if len(series):
+                    newest = datetime.fromtimestamp(series.times[-1], timezone.utc)
+                    fetch_from = max(newest - self._overlap, covered_from)
+                else:
+                    fetch_from = covered_from
+                new_series = query_readings(storage, name, fetch_from,
+                                            exclusive_from=True)
+                keep = np.searchsorted(series.times, fetch_from.timestamp(),
+                                       side="right")
+                series = _concatenate([
+                    Series(series.times[:keep], series.values[:keep]), new_series])
+
+            # Drop readings outside of the window.
+            covered_from = now - self._window
+            drop = np.searchsorted(series.times, covered_from.timestamp(),
+                                   side="left")
+
+            with cached.lock:
+                cached.series = Series(series.times[drop:], series.values[drop:])
+                cached.covered_from = covered_from
+                cached.last_update = now
+                cached.last_full_fetch = last_full_fetch
+
+    def _evict(self):
+        """Drops least recently used series until the cache is small enough."""
+        with self._lock:
+            total_bytes = sum(len(cached.series) * self._BYTES_PER_READING
+                              for cached in self._series.values())
+            while total_bytes > self._max_bytes and len(self._series) > 1:
+                _, cached = self._series.popitem(last=False)
+                total_bytes -= len(cached.series) * self._BYTES_PER_READING
+
+
+class SharedSeriesCache(object):
+    """Recent readings, read from a shared_series.SharedSeriesStore.
+
+    Works like SeriesCache, but the readings are kept up to date
+    by another process (see series_store_loop). Readings not in
+    the store, or too stale, are queried from the DB. Reported as
+    the shared_series_hits and shared_series_misses metrics.
+
+    Thread safe."""
+
+    def __init__(self, store, max_staleness):
+        self._store = store
+        self._max_staleness = max_staleness
+
+    def get_readings(self, storage, name, time_from, time_to):
+        """Returns a Series of readings in the time range.
+
+        Readings from the store aren't copied, the Series
+        points into the shared memory."""
+        series = self._store.read(name)
+        if series is not None:
+            times, values, covered_from, last_update = series
+            now = datetime.now(timezone.utc).timestamp()
+            if (time_from.timestamp() >= covered_from and
+                    now - last_update <= self._max_staleness.total_seconds()):
+                METRICS.increment("shared_series_hits")
+                start = np.searchsorted(times, time_from.timestamp(), side="left")
+                end = np.searchsorted(times, time_to.timestamp(), side="right")
+                return Series(times[start:end], values[start:end])
+        METRICS.increment("shared_series_misses")
+        return query_readings(storage, name, time_from, time_to)
+
+    def refresh(self, storage, names=()):
+        """Does nothing, the store is updated by another process."""
+        pass
+
+
+class SnapshotCache(object):
+    """Keeps results of calls, refreshed in the background.
+
+    Like SeriesCache, returns results no older than `max_staleness`
+    without waiting for the DB, see refresh.
+
+    Thread safe."""
+
+    def __init__(self, max_staleness):
+        self._max_staleness = max_staleness
+        self._lock = threading.Lock()
+        # key -> (function, args, result, time of the call)
+        self._snapshots = {}
+
+    def get(self, key, function, *args):
+        """Returns the result of `function(*args)`, possibly a cached one."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            _, _, result, call_time = snapshot
+            if now - call_time <= self._max_staleness:
+                return result
+        try:
+            return self._call(key, function, args)
+        except Exception as e:
+            if snapshot is None:
+                raise
+            print("Problem while refreshing", key)
+            print(e)
+            return snapshot[2]
+
+    def refresh(self):
+        """Repeats all the calls, updating the results."""
+        with self._lock:
+            snapshots = list(self._snapshots.items())
+        for key, (function, args, _, _) in snapshots:
+            try:
+                self._call(key, function, args)
+            except Exception as e:
+                print("Problem while refreshing", key)
+                print(e)
+
+    def _call(self, key, function, args):
+        now = datetime.now(timezone.utc)
+        result = function(*args)
+        with self._lock:
+            self._snapshots[key] = (function, args, result, now)
+        return result
+
+
+class _Call(object):
+    """A call in progress, see SingleFlight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical calls.
+
+    The first caller with a key makes the call, callers with the
+    same key arriving while it's in progress wait for it and get
+    the same result (or exception). Reported as the
+    db_single_flight_calls and db_single_flight_coalesced metrics.
+
+    Thread safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args):
+        """Calls `function(*args)`, or waits for the same call in progress."""
+        METRICS.increment("db_single_flight_calls")
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            METRICS.increment("db_single_flight_coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
+_SERIES_CACHE = SeriesCache(
+    window=timedelta(hours=config.SERIES_CACHE_WINDOW_HOURS),
+    overlap=timedelta(minutes=config.SERIES_CACHE_OVERLAP_MINUTES),
+    full_refresh_interval=timedelta(minutes=config.SERIES_CACHE_FULL_REFRESH_MINUTES),
+    max_bytes=config.SERIES_CACHE_MAX_BYTES,
+    max_staleness=timedelta(seconds=config.CACHE_MAX_STALENESS_SEC),
+)
+
+_LATEST_CACHE = SnapshotCache(
+    max_staleness=timedelta(seconds=config.CACHE_MAX_STALENESS_SEC),
+)
+
+
+def use_shared_series(directory):
+    """Reads recent readings from a SharedSeriesStore in `directory`.
+
+    Used by the server processes, the store is kept up to
+    date by a separate process running series_store_loop."""
+    global _SERIES_CACHE
+    _SERIES_CACHE = SharedSeriesCache(
+        shared_series.SharedSeriesStore(directory),
+        max_staleness=timedelta(seconds=config.CACHE_MAX_STALENESS_SEC))
+
+
+def get_last_readings(storage, name, time_from, time_to):
+    """Returns a Series of recent readings.
+
+    Served from a cache if the time range is recent enough."""
+    return _SERIES_CACHE.get_readings(storage, name, time_from, time_to)
+
+
+def rollup_kind(name, tier_name):
+    """Returns the entity kind of a rollup tier of readings."""
+    return config.GCP_ROLLUP_PREFIX + tier_name + ":" + name
+
+
+def choose_tier(time_from, time_to, max_points):
+    """Returns the name of the rollup tier to read a time range from.
+
+    None means raw readings. Picks the finest resolution with no more
+    than `max_points` points in the range, or the coarsest tier."""
+    seconds = (time_to - time_from).total_seconds()
+    if seconds / config.RAW_READING_INTERVAL_SEC <= max_points:
+        return None
+    for tier_name, bucket_seconds in config.ROLLUP_TIERS:
+        if seconds / bucket_seconds <= max_points:
+            return tier_name
+    return config.ROLLUP_TIERS[-1][0]
+
+
+def resolution_seconds(tier_name):
+    """Returns the time between points of a rollup tier (or raw readings)."""
+    if tier_name is None:
+        return config.RAW_READING_INTERVAL_SEC
+    return dict(config.ROLLUP_TIERS)[tier_name]
+
+
+def get_readings(storage, name, time_from, time_to,
+                 max_points=config.CHART_DEFAULT_POINTS):
+    """Returns a Series of readings in the time range.
+
+    For long time ranges returns rollups (mean values of fixed
+    time buckets) instead of raw readings, see choose_tier. Before
+    the first bucket of the tier (e.g. when it's not backfilled
+    yet, see rollups.py), returns raw readings, downsampled to
+    their share of `max_points`."""
+    tier_name = choose_tier(time_from, time_to, max_points)
+    history = _get_tier_readings(storage, name, tier_name, time_from, time_to)
+    if tier_name is None:
+        return history
+
+    bucket_seconds = resolution_seconds(tier_name)
+    if len(history):
+        covered_from = history.times[0] - bucket_seconds / 2.0
+        if covered_from - time_from.timestamp() <= bucket_seconds:
+            return history
+        raw_to = datetime.fromtimestamp(covered_from, timezone.utc)
+    else:
+        raw_to = time_to
+    METRICS.increment("rollup_fallbacks")
+    raw = _get_tier_readings(storage, name, None, time_from, raw_to)
+    if len(history):
+        before = raw.times < covered_from
+        raw = Series(raw.times[before], raw.values[before])
+    share = (raw_to - time_from) / (time_to - time_from)
+    raw = raw.downsample(max(2, int(max_points * share)))
+    return Series(np.concatenate([raw.times, history.times]),
+                  np.concatenate([raw.values, history.values]))
+
+
+def _get_tier_readings(storage, name, tier_name, time_from, time_to):
+    # Concurrent requests for about the same time range share a
+    # single query, for the range rounded out to whole buckets.
+    bucket = config.SINGLE_FLIGHT_BUCKET_SEC
+    bucket_from = int(time_from.timestamp() // bucket)
+    bucket_to = -int(-time_to.timestamp() // bucket)
+    readings = _SINGLE_FLIGHT.do(
+        (name, tier_name, bucket_from, bucket_to), _fetch_readings,
+        storage, name, tier_name,
+        datetime.fromtimestamp(bucket_from * bucket, timezone.utc),
+        datetime.fromtimestamp(bucket_to * bucket, timezone.utc))
+
+    start = np.searchsorted(readings.times, time_from.timestamp(), side="left")
+    end = np.searchsorted(readings.times, time_to.timestamp(), side="right")
+    return Series(readings.times[start:end], readings.values[start:end])
+
+
+def _fetch_readings(storage, name, tier_name, time_from, time_to):
+    if tier_name is None:
+        return get_last_readings(storage, name, time_from, time_to)
+    # Rollups are streamed from the DB straight into the arrays.
+    return _concatenate(fetch_sharded(
+        storage, rollup_kind(name, tier_name), time_from, time_to,
+        Series.from_readings, interval_sec=resolution_seconds(tier_name)))
+
+
+def refresher_loop(names, latest_names):
+    """A loop: keeps the cached readings fresh.
+
+    Updates recent readings of `names` (and of all the other cached
+    kinds), and the latest readings of `latest_names` (and of all the
+    other names requested before), every CACHE_REFRESH_SEC seconds.
+    With `names` set to None, only the latest readings are updated
+    (in processes reading recent readings from a SharedSeriesStore,
+    kept fresh by series_store_loop).
+
+    Should be running in a separate daemon thread."""
+    while True:
+        try:
+            storage = get_storage()
+            get_latest_readings(storage, latest_names)
+            _LATEST_CACHE.refresh()
+            if names is not None:
+                _SERIES_CACHE.refresh(storage, names)
+        except Exception as e:
+            print("Problem while refreshing cached readings.")
+            print(e)
+        time.sleep(config.CACHE_REFRESH_SEC)
+
+
+def series_store_loop(names, directory):
+    """A loop: keeps the recent readings in a SharedSeriesStore fresh.
+
+    Updates recent readings of `names` every CACHE_REFRESH_SEC
+    seconds, and writes them to the store in `directory`, for
+    the server processes to read (see use_shared_series).
+
+    Should be running in a separate process."""
+    store = shared_series.SharedSeriesStore(directory)
+    while True:
+        try:
+            storage = get_storage()
+            _SERIES_CACHE.refresh(storage, names)
+            for name, series, covered_from, last_update in _SERIES_CACHE.snapshot():
+                store.write(name, series.times, series.values,
+                            covered_from.timestamp(), last_update.timestamp())
+        except Exception as e:
+            print("Problem while updating shared readings.")
+            print(e)
+        time.sleep(config.CACHE_REFRESH_SEC)
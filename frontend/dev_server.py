@@ -1,18 +1,23 @@
 #!/usr/bin/env python3
 
 import bottle
+import os
 
 import config
 import app
 
-config.DEV_MODE=True
 
-bottle.run(
-    app.app,
-    server='paste',
-    host=config.DEV_HTTP_HOST,
-    port=config.DEV_HTTP_PORT,
-    debug=config.DEV_MODE,
-    reloader=config.DEV_MODE,
-)
+if __name__ == "__main__":
+    config.DEV_MODE=True
+    if os.environ.get("BOTTLE_CHILD"):
+        # With the reloader, the server runs in a child process.
+        app.start_background_refresh()
 
+    bottle.run(
+        app.app,
+        server='paste',
+        host=config.DEV_HTTP_HOST,
+        port=config.DEV_HTTP_PORT,
+        debug=config.DEV_MODE,
+        reloader=config.DEV_MODE,
+    )
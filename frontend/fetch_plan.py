@@ -0,0 +1,73 @@
+from concurrent import futures
+import time
+
+import charts
+import config
+import db_access
+import metrics
+
+
+class FetchPlan(object):
+    """Fetches of readings needed to compute a set of chart series.
+
+    Every kind of readings is fetched once, even if several of the
+    series are computed from it. Kinds are fetched in parallel, up
+    to API_FETCH_CONCURRENCY at a time for a single plan, so a page
+    with many series doesn't take over the executor. Readings are
+    shared with other requests through the caches in db_access."""
+
+    def __init__(self, names):
+        self.names = names
+        self.kinds = sorted(set(
+            kind for name in names for kind in charts.SERIES[name].kinds))
+
+    def fetch(self, storage, executor, time_range, deadline):
+        """Fetches readings of all the kinds, until `deadline` (time.monotonic).
+
+        Returns a dict with a Series of readings of every kind
+        fetched, and a dict with the errors of the other kinds
+        (TimeoutError for ones not fetched before the deadline,
+        metrics.Overloaded for ones the executor didn't take)."""
+        timer = metrics.current_timer()
+        readings = {}
+        errors = {}
+        waiting = list(self.kinds)
+        running = {}
+        while waiting or running:
+            while waiting and len(running) < config.API_FETCH_CONCURRENCY:
+                kind = waiting.pop(0)
+                try:
+                    future = executor.submit(
+                        timer.timed, "fetch:" + kind, db_access.get_readings,
+                        storage, kind, time_range.time_from, time_range.time_to,
+                        time_range.points)
+                except metrics.Overloaded as e:
+                    errors[kind] = e
+                    continue
+                running[future] = kind
+            if not running:
+                break
+
+            done, _ = futures.wait(
+                running, timeout=max(0.0, deadline - time.monotonic()),
+                return_when=futures.FIRST_COMPLETED)
+            if not done:
+                for kind in list(running.values()) + waiting:
+                    errors[kind] = TimeoutError("Fetching %s took too long" % kind)
+                break
+            for future in done:
+                kind = running.pop(future)
+                try:
+                    readings[kind] = future.result()
+                except Exception as e:
+                    print("Problem while fetching", kind)
+                    print(e)
+                    errors[kind] = e
+        return readings, errors
+
+    def series_readings(self, name, readings):
+        """Returns the readings a series is computed from, or None if some are missing."""
+        kinds = charts.SERIES[name].kinds
+        if any(kind not in readings for kind in kinds):
+            return None
+        return {kind: readings[kind] for kind in kinds}
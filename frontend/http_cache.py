@@ -0,0 +1,211 @@
+import bottle
+from datetime import timezone
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+import config
+import metrics
+
+
+# Content types compressed with gzip.
+_COMPRESSED_TYPES = (
+    "text/html",
+    "text/css",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "image/svg+xml",
+)
+
+
+def _accepts_gzip():
+    return "gzip" in bottle.request.get_header("Accept-Encoding", "")
+
+
+def _compressed_with_etag(content_type):
+    """Tells if a response with an ETag is sent compressed.
+
+    Decided by the content type alone, not the size (unknown when
+    checking the client's ETag), so 304 responses get the ETag
+    of the representation a 200 response would have."""
+    return content_type in _COMPRESSED_TYPES and _accepts_gzip()
+
+
+def _gzip_etag(etag):
+    """Returns the ETag of the gzip-compressed version of a response."""
+    return etag[:-1] + '-gzip"'
+
+
+def http_date(timestamp):
+    """Formats a datetime for the Last-Modified header."""
+    return email.utils.format_datetime(timestamp.astimezone(timezone.utc),
+                                       usegmt=True)
+
+
+def not_modified_response(headers, etag=None, last_modified=None,
+                          content_type="text/html"):
+    """Checks the conditional request headers.
+
+    Returns a 304 response if the client's copy (with the given
+    `etag` and/or `last_modified` datetime) is up to date,
+    None otherwise. `headers` are added to the response.
+    `content_type` of the full response decides if its ETag is
+    the one of the gzip-compressed version."""
+    headers = dict(headers)
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    if_none_match = bottle.request.get_header("If-None-Match")
+    if if_none_match is not None:
+        # Takes precedence over If-Modified-Since.
+        if etag is None:
+            return None
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if etag in tags or _gzip_etag(etag) in tags or "*" in tags:
+            if _compressed_with_etag(content_type):
+                headers["ETag"] = _gzip_etag(etag)
+            return bottle.HTTPResponse(status=304, headers=headers)
+        return None
+
+    if_modified_since = bottle.parse_date(
+        bottle.request.get_header("If-Modified-Since", ""))
+    if if_modified_since and last_modified is not None:
+        if int(last_modified.timestamp()) <= if_modified_since:
+            return bottle.HTTPResponse(status=304, headers=headers)
+    return None
+
+
+def body_etag(body):
+    """Returns a strong ETag computed from the response body."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def gzip_plugin(callback):
+    """A Bottle plugin, compresses responses with gzip.
+
+    Only text responses (see _COMPRESSED_TYPES) are compressed, if
+    the client accepts gzip. Without an ETag, only ones of at least
+    GZIP_MIN_BYTES; with one, all of them (see _compressed_with_etag)."""
+    def wrapper(*args, **kwargs):
+        body = callback(*args, **kwargs)
+        if not isinstance(body, (str, bytes)):
+            return body
+        response = bottle.response
+        response.add_header("Vary", "Accept-Encoding")
+        # Without a Content-Type, Bottle sends its default, HTML.
+        content_type = response.content_type.split(";")[0].strip() or "text/html"
+        etag = response.get_header("ETag")
+        if not _compressed_with_etag(content_type):
+            return body
+        if isinstance(body, str):
+            body = body.encode(response.charset or "utf-8")
+        if etag is None and len(body) < config.GZIP_MIN_BYTES:
+            return body
+        response.set_header("Content-Encoding", "gzip")
+        if etag is not None:
+            # A different representation needs a different strong ETag.
+            response.set_header("ETag", _gzip_etag(etag))
+        with metrics.stage("gzip"):
+            return gzip.compress(body, compresslevel=config.GZIP_LEVEL)
+    return wrapper
+
+
+class _StaticFile(object):
+    """A static file, loaded into memory."""
+
+    def __init__(self, path):
+        self.mtime = os.stat(path).st_mtime
+        with open(path, "rb") as f:
+            self.body = f.read()
+        self.content_hash = hashlib.sha1(self.body).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.gzip_body = None
+        if self.mimetype in _COMPRESSED_TYPES:
+            self.gzip_body = gzip.compress(self.body, compresslevel=9)
+
+
+# Matches a file name with a content hash, e.g. "style.0123456789ab.css".
+_HASHED_NAME_REGEX = re.compile(r"^(.*)\.([0-9a-f]{12})(\.[^./]+)$")
+
+
+class StaticFiles(object):
+    """Serves static files, with content-hashed URLs.
+
+    Files are kept in memory, along with their gzip-compressed
+    versions, and reloaded when they change. URLs from url()
+    include a hash of the content, so they can be cached forever.
+
+    Thread safe."""
+
+    def __init__(self, root):
+        self._root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def url(self, filepath):
+        """Returns a content-hashed URL of a static file."""
+        name, extension = os.path.splitext(filepath)
+        static_file = self._get(filepath)
+        return "/static/%s.%s%s" % (name, static_file.content_hash, extension)
+
+    def response(self, filepath):
+        """Returns an HTTPResponse with a static file."""
+        immutable = False
+        match = _HASHED_NAME_REGEX.match(filepath)
+        if match:
+            name, content_hash, extension = match.groups()
+            filepath = name + extension
+            immutable = True
+        try:
+            static_file = self._get(filepath)
+        except (OSError, ValueError):
+            return bottle.HTTPError(404, "File not found.")
+        if immutable and static_file.content_hash != content_hash:
+            # An old version, don't let it be cached for long.
+            immutable = False
+
+        if immutable:
+            max_age = config.STATIC_HASHED_MAX_AGE_SEC
+            cache_control = "public, max-age=%d, immutable" % max_age
+        else:
+            cache_control = "public, max-age=%d" % config.STATIC_MAX_AGE_SEC
+        headers = {
+            "Cache-Control": cache_control,
+            "Content-Type": static_file.mimetype,
+            "Vary": "Accept-Encoding",
+        }
+        etag = '"%s"' % static_file.content_hash
+        not_modified = not_modified_response(
+            headers, etag=etag, content_type=static_file.mimetype)
+        if not_modified is not None:
+            return not_modified
+
+        body = static_file.body
+        headers["ETag"] = etag
+        if static_file.gzip_body is not None and _accepts_gzip():
+            body = static_file.gzip_body
+            headers["Content-Encoding"] = "gzip"
+            headers["ETag"] = _gzip_etag(etag)
+        return bottle.HTTPResponse(body, headers=headers)
+
+    def _get(self, filepath):
+        path = os.path.abspath(os.path.join(self._root, filepath))
+        if not path.startswith(self._root + os.sep):
+            raise ValueError("Path outside of the static files root")
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            static_file = self._files.get(path)
+        if static_file is None or static_file.mtime != mtime:
+            static_file = _StaticFile(path)
+            with self._lock:
+                self._files[path] = static_file
+        return static_file
@@ -0,0 +1,272 @@
+import bisect
+import bottle
+from concurrent import futures
+import contextlib
+import re
+import threading
+import time
+
+
+class Histogram(object):
+    """Counts of observed values, in exponentially growing buckets.
+
+    Bucket bounds go from `min_value` up, each `factor` times
+    larger than the previous one. Not thread safe."""
+
+    def __init__(self, min_value, factor, num_buckets):
+        self._bounds = [min_value * factor ** i for i in range(num_buckets)]
+        # The last bucket is for values above all the bounds.
+        self._counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates a quantile, interpolating within a bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self._counts):
+            if count and seen + count >= rank:
+                low = self._bounds[i - 1] if i > 0 else 0.0
+                high = self._bounds[i] if i < len(self._bounds) else self._bounds[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self._bounds[-1]
+
+
+# Histogram buckets of latencies in seconds: 0.1 ms to over an hour,
+# and of sizes in bytes: 64 bytes to over 256 MiB.
+_LATENCY_BUCKETS = (0.0001, 2 ** 0.25, 100)
+_SIZE_BUCKETS = (64.0, 2 ** 0.5, 45)
+
+
+class Metrics(object):
+    """Named counters, gauges and histograms, shown on the /metrics page.
+
+    Histograms are keyed by name and a tuple of (label, value) pairs.
+
+    Thread safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name):
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def observe(self, name, labels, value, buckets=_LATENCY_BUCKETS):
+        """Adds a value to a histogram."""
+        key = (name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(*buckets)
+            self._histograms[key].observe(value)
+
+    def quantile(self, name, labels, q):
+        """Returns the number of values in a histogram, and a quantile.
+
+        The quantile is None if there are no values."""
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                return 0, None
+            return histogram.count, histogram.quantile(q)
+
+    def snapshot(self):
+        """Returns a copy of all counter and gauge values, by name."""
+        with self._lock:
+            return dict(self._values)
+
+    def histogram_summaries(self):
+        """Returns (name, labels, count, sum, p50, p99) of all histograms."""
+        with self._lock:
+            return sorted(
+                (name, labels, histogram.count, histogram.sum,
+                 histogram.quantile(0.5), histogram.quantile(0.99))
+                for (name, labels), histogram in self._histograms.items())
+
+
+# Metrics of this process.
+METRICS = Metrics()
+
+
+class Overloaded(Exception):
+    """Raised when a MeteredThreadPoolExecutor has too many queued jobs."""
+    pass
+
+
+class MeteredThreadPoolExecutor(futures.ThreadPoolExecutor):
+    """A ThreadPoolExecutor that reports its queue depth.
+
+    Tracks the number of queued (not yet started) and running
+    jobs, as `<name>_queued` and `<name>_running` gauges. With
+    `max_queued` set, submit raises Overloaded instead of queueing
+    more jobs, and counts it in `<name>_rejected`."""
+
+    def __init__(self, name, max_workers, max_queued=None):
+        super().__init__(max_workers=max_workers)
+        self._queued = name + "_queued"
+        self._running = name + "_running"
+        self._rejected = name + "_rejected"
+        self._max_queued = max_queued
+        self._lock = threading.Lock()
+        self._num_queued = 0
+
+    def queued(self):
+        """Returns the number of jobs waiting for a thread."""
+        with self._lock:
+            return self._num_queued
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._max_queued is not None and self._num_queued >= self._max_queued:
+                METRICS.increment(self._rejected)
+                raise Overloaded("Too many queued jobs")
+            self._num_queued += 1
+        METRICS.increment(self._queued)
+        def run():
+            with self._lock:
+                self._num_queued -= 1
+            METRICS.increment(self._queued, -1)
+            METRICS.increment(self._running)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                METRICS.increment(self._running, -1)
+        try:
+            return super().submit(run)
+        except Exception:
+            with self._lock:
+                self._num_queued -= 1
+            METRICS.increment(self._queued, -1)
+            raise
+
+
+class StageTimer(object):
+    """Measures how long stages of handling a request take.
+
+    Thread safe, so stages can run in other threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages.append((name, seconds))
+
+    def timed(self, name, function, *args):
+        """Calls `function(*args)` as a stage."""
+        with self.stage(name):
+            return function(*args)
+
+    def total(self):
+        return time.perf_counter() - self._start
+
+    def server_timing(self):
+        """Formats the stages as a Server-Timing header value."""
+        with self._lock:
+            stages = list(self.stages)
+        entries = []
+        for name, seconds in stages:
+            token = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+            entries.append('%s;desc="%s";dur=%.2f' % (
+                token, name.replace('"', "'"), seconds * 1000.0))
+        entries.append("total;dur=%.2f" % (self.total() * 1000.0))
+        return ", ".join(entries)
+
+
+_TIMER_ENVIRON_KEY = "pogoda.stage_timer"
+
+
+def current_timer():
+    """Returns the StageTimer of the request being handled.
+
+    Outside of a request returns a timer nobody reads."""
+    try:
+        timer = bottle.request.environ.get(_TIMER_ENVIRON_KEY)
+    except RuntimeError:
+        timer = None
+    return timer if timer is not None else StageTimer()
+
+
+def stage(name):
+    """Measures a stage of the request being handled, see StageTimer."""
+    return current_timer().stage(name)
+
+
+def timing_plugin(callback):
+    """A Bottle plugin, measures the stages of every request.
+
+    Adds a Server-Timing header with the stages, and records the
+    total and stage latencies and response sizes per route."""
+    def wrapper(*args, **kwargs):
+        timer = StageTimer()
+        bottle.request.environ[_TIMER_ENVIRON_KEY] = timer
+        body = callback(*args, **kwargs)
+
+        labels = (("route", bottle.request.route.rule),)
+        response = bottle.response
+        if isinstance(body, bottle.HTTPResponse):
+            response = body
+            body = body.body
+        if isinstance(body, (str, bytes)):
+            METRICS.observe("response_bytes", labels, len(body), _SIZE_BUCKETS)
+        for name, seconds in timer.stages:
+            METRICS.observe("stage_seconds", labels + (("stage", name),), seconds)
+        METRICS.observe("route_seconds", labels, timer.total())
+        response.set_header("Server-Timing", timer.server_timing())
+        return body if response is bottle.response else response
+    return wrapper
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % label for label in labels)
+
+
+def render_text():
+    """Returns all metrics as text, one "name value" line each."""
+    values = METRICS.snapshot()
+    # Derived values.
+    calls = values.get("db_single_flight_calls", 0)
+    if calls:
+        values["db_single_flight_coalesce_ratio"] = (
+            values.get("db_single_flight_coalesced", 0) / calls)
+    lines = []
+    for name, value in sorted(values.items()):
+        if isinstance(value, float):
+            lines.append("%s %.6g" % (name, value))
+        else:
+            lines.append("%s %d" % (name, value))
+
+    for name, labels, count, total, p50, p99 in METRICS.histogram_summaries():
+        lines.append("%s_count%s %d" % (name, _labels_text(labels), count))
+        lines.append("%s_sum%s %.6g" % (name, _labels_text(labels), total))
+        lines.append("%s%s %.6g" % (
+            name, _labels_text(labels + (("quantile", "0.5"),)), p50))
+        lines.append("%s%s %.6g" % (
+            name, _labels_text(labels + (("quantile", "0.99"),)), p99))
+    return "\n".join(lines) + "\n"
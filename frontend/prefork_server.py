@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""Production server with several worker processes.
+
+The app is imported once, before forking, and the workers accept
+connections on a single shared listening socket, so requests are
+spread over several processes (and CPU-bound work isn't serialized
+by a single GIL). Recent readings are kept up to date by a single
+refresher process, started by the master, and shared with the
+workers through memory-mapped files (see shared_series). Workers
+only keep the latest readings fresh themselves, in the background.
+
+Workers are restarted after about PREFORK_MAX_REQUESTS requests.
+
+Signals, sent to the master process:
+    SIGHUP: reload. Workers finish the requests in progress, then the
+        server is restarted with new code and config, keeping the
+        listening socket. Nothing is served until the new workers
+        start (a few seconds, importing the app): new connections
+        wait in the listen backlog, up to PREFORK_LISTEN_BACKLOG
+        of them, and may time out.
+    SIGTERM, SIGINT: graceful shutdown.
+"""
+
+import os
+import random
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from wsgiref import simple_server
+
+import config
+import app
+import charts
+import db_access
+
+
+# Environment variable with the file descriptor of the listening
+# socket, passed on to the restarted server on reload.
+_LISTEN_FD_ENV = "POGODA_LISTEN_FD"
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = False
+    # Wait for requests in progress when shutting down.
+    block_on_close = True
+
+    def get_request(self):
+        # The shared socket is non-blocking, so workers don't get
+        # stuck in accept() when another one took the connection.
+        connection, address = self.socket.accept()
+        connection.setblocking(True)
+        return connection, address
+
+
+class _QuietHandler(simple_server.WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _listening_socket(host, port):
+    """Returns the listening socket, inherited or a new one."""
+    fd = os.environ.pop(_LISTEN_FD_ENV, None)
+    if fd is not None:
+        return socket.socket(fileno=int(fd))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(config.PREFORK_LISTEN_BACKLOG)
+    return sock
+
+
+def _worker_main(sock):
+    """Runs in a worker process, serves requests until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    db_access.use_shared_series(config.SHARED_SERIES_DIR)
+    app.start_background_refresh(latest_only=True)
+
+    server = _ThreadingWSGIServer(
+        sock.getsockname(), _QuietHandler, bind_and_activate=False)
+    server.socket.close()
+    sock.setblocking(False)
+    server.socket = sock
+    server.server_name, server.server_port = sock.getsockname()[:2]
+    server.setup_environ()
+
+    max_requests = config.PREFORK_MAX_REQUESTS + random.randint(
+        0, config.PREFORK_MAX_REQUESTS_JITTER)
+    lock = threading.Lock()
+    handled = [0]
+
+    def stop():
+        # shutdown() waits for serve_forever() to return,
+        # so it's called from another thread.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def counting_app(environ, start_response):
+        with lock:
+            handled[0] += 1
+            if handled[0] == max_requests:
+                # Recycle the worker, after this request.
+                stop()
+        return app.app(environ, start_response)
+
+    server.set_app(counting_app)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop())
+    server.serve_forever()
+    server.server_close()
+
+
+def _refresher_main():
+    """Runs in the refresher process, updates the shared readings."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    db_access.series_store_loop(charts.source_kinds(), config.SHARED_SERIES_DIR)
+
+
+class PreforkServer(object):
+    """The master process, starts and watches the other processes."""
+
+    def __init__(self, sock, num_workers):
+        self._sock = sock
+        self._num_workers = num_workers
+        # pid -> "worker" or "refresher"
+        self._children = {}
+        self._stop_signal = None
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGHUP, self._on_signal)
+        self._spawn("refresher")
+        for _ in range(self._num_workers):
+            self._spawn("worker")
+
+        while self._stop_signal is None:
+            self._reap(respawn=True)
+            time.sleep(0.5)
+
+        print("Stopping the workers")
+        self._stop_children()
+        if self._stop_signal == signal.SIGHUP:
+            print("Reloading")
+            self._sock.set_inheritable(True)
+            os.environ[_LISTEN_FD_ENV] = str(self._sock.fileno())
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def _on_signal(self, signum, frame):
+        self._stop_signal = signum
+
+    def _spawn(self, role):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                if role == "worker":
+                    _worker_main(self._sock)
+                else:
+                    _refresher_main()
+            except BaseException as e:
+                print("Problem in the", role, "process")
+                print(e)
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(exit_code)
+        self._children[pid] = role
+
+    def _reap(self, respawn):
+        """Collects exited processes, starts new ones in their place."""
+        while self._children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            role = self._children.pop(pid, None)
+            if role is None:
+                continue
+            if not respawn:
+                continue
+            if status != 0:
+                print("The", role, "process", pid, "died, status", status)
+                # Don't restart failing processes in a tight loop.
+                time.sleep(1.0)
+            self._spawn(role)
+
+    def _stop_children(self):
+        for pid in self._children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + config.PREFORK_SHUTDOWN_TIMEOUT_SEC
+        while self._children and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            time.sleep(0.1)
+        for pid in self._children:
+            print("Killing process", pid)
+            os.kill(pid, signal.SIGKILL)
+        while self._children:
+            pid, _ = os.waitpid(-1, 0)
+            self._children.pop(pid, None)
+
+
+def serve(host, port, num_workers):
+    sock = _listening_socket(host, port)
+    print("Serving on %s:%d, %d workers, pid %d" %
+          (host, port, num_workers, os.getpid()))
+    PreforkServer(sock, num_workers).run()
+
+
+if __name__ == "__main__":
+    config.DEV_MODE=False
+    serve(config.PROD_HTTP_HOST, config.PROD_HTTP_PORT,
+          config.PROD_WORKERS or os.cpu_count())
@@ -4,15 +4,22 @@ import bottle
 
 import config
 import app
+import prefork_server
 
-config.DEV_MODE=False
 
-bottle.run(
-    app.app,
-    server='paste',
-    host=config.PROD_HTTP_HOST,
-    port=config.PROD_HTTP_PORT,
-    debug=config.DEV_MODE,
-    reloader=config.DEV_MODE,
-)
+if __name__ == "__main__":
+    config.DEV_MODE=False
+    if config.PROD_WORKERS > 0:
+        prefork_server.serve(
+            config.PROD_HTTP_HOST, config.PROD_HTTP_PORT, config.PROD_WORKERS)
+    else:
+        app.start_background_refresh()
 
+        bottle.run(
+            app.app,
+            server='paste',
+            host=config.PROD_HTTP_HOST,
+            port=config.PROD_HTTP_PORT,
+            debug=config.DEV_MODE,
+            reloader=config.DEV_MODE,
+        )
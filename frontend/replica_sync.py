@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""Keeps the local SQLite read replica of the readings up to date.
+
+Copies readings of every kind the frontend reads (raw readings, and
+their rollups, see rollups.py) from Datastore to the replica in
+config.SQLITE_REPLICA_FILE. Each run continues from the newest reading
+copied, and copies again the last config.REPLICA_SYNC_OVERLAP_HOURS
+hours. The first run copies everything.
+
+With config.STORAGE_BACKEND set to "sqlite", the frontend reads from
+the replica, and needs no access to GCP.
+
+Example, syncing every 2 minutes:
+    ./replica_sync.py --interval 120
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import itertools
+import time
+
+import charts
+import config
+import db_access
+import rollups
+import storage_backends
+
+
+# Max number of readings written at once.
+_WRITE_BATCH_SIZE = 5000
+
+
+def replica_kinds():
+    """Returns kinds of readings to copy to the replica."""
+    source_kinds = sorted(set(rollups.rollup_source_kinds()) |
+                          set(charts.source_kinds()))
+    kinds = list(source_kinds)
+    for tier_name, _ in config.ROLLUP_TIERS:
+        kinds.extend(db_access.rollup_kind(kind, tier_name)
+                     for kind in rollups.rollup_source_kinds())
+    return kinds
+
+
+def sync_kind(source, replica, kind):
+    """Copies new readings of a kind, returns how many were copied."""
+    newest = replica.newest_timestamp(kind)
+    if newest is None:
+        time_from = datetime.fromtimestamp(0, timezone.utc)
+    else:
+        time_from = newest - timedelta(hours=config.REPLICA_SYNC_OVERLAP_HOURS)
+
+    readings = source.iter_readings(kind, time_from)
+    copied = 0
+    while True:
+        batch = list(itertools.islice(readings, _WRITE_BATCH_SIZE))
+        if not batch:
+            break
+        replica.write_readings(kind, batch)
+        copied += len(batch)
+    return copied
+
+
+def sync_all(source, replica):
+    """Copies new readings of all kinds, reports problems."""
+    for kind in replica_kinds():
+        try:
+            copied = sync_kind(source, replica, kind)
+            print("Synced %s: %d readings" % (kind, copied))
+        except Exception as e:
+            print("Problem while syncing", kind)
+            print(e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Updates the local SQLite read replica of the readings.")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Keep running, syncing every INTERVAL seconds.")
+    parser.add_argument("--file", default=config.SQLITE_REPLICA_FILE,
+                        help="The replica file.")
+    args = parser.parse_args()
+
+    source = storage_backends.DatastoreStorage(db_access.get_datastore_client())
+    replica = storage_backends.SqliteStorage(args.file, read_only=False)
+    while True:
+        sync_all(source, replica)
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""Maintains pre-aggregated rollups of the readings.
+
+For every kind of readings shown on the charts, and every tier in
+config.ROLLUP_TIERS, stores the min, max, mean and count of readings
+in fixed time buckets. Rollups are entities of a separate kind (see
+db_access.rollup_kind), with the mean in `value` and the middle of
+the bucket in `timestamp`, so they read the same way as readings.
+
+The first tier is computed from raw readings, every other tier from
+the tier before it. Each run continues from the last bucket written,
+and recomputes the last config.ROLLUP_LOOKBACK_HOURS hours.
+
+Example, updating the rollups every 10 minutes:
+    ./rollups.py --interval 600
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+from google.cloud import datastore
+import numpy as np
+import time
+
+import config
+import db_access
+import storage_backends
+
+
+# Max number of entities written at once.
+_PUT_BATCH_SIZE = 400
+
+
+def rollup_source_kinds():
+    """Returns kinds of the readings to roll up."""
+    kinds = [
+        config.GCP_TEMP_KIND,
+        config.GCP_HMDT_KIND,
+        config.GCP_PRES_KIND,
+        config.GCP_PM25_KIND,
+        config.GCP_WND_SPEED_KIND,
+        config.GCP_WND_DIR_KIND,
+        config.GCP_RAIN_MM_KIND,
+    ]
+    for logger_gcp_prefix, _ in config.MONITORED_LOGGERS.values():
+        kinds.append(logger_gcp_prefix + config.GCP_INTERNET_LATENCY)
+        kinds.append(logger_gcp_prefix + config.GCP_DB_LATENCY)
+        kinds.append(logger_gcp_prefix + config.GCP_DB_SUCCESS_RATE)
+        kinds.append(logger_gcp_prefix + config.GCP_ARDUINO_BPS)
+    return kinds
+
+
+def aggregate(times, means, mins, maxs, counts, bucket_seconds):
+    """Aggregates (already aggregated) values into time buckets.
+
+    Takes arrays sorted by time; raw readings are passed with
+    means, mins and maxs set to the values, and counts set to 1.
+    Returns bucket start times, and the means, mins, maxs and
+    counts of every non-empty bucket."""
+    if not len(times):
+        empty = np.empty(0)
+        return empty, empty, empty, empty, empty
+    buckets = np.floor(times / bucket_seconds) * bucket_seconds
+    run_starts = np.flatnonzero(
+        np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    bucket_counts = np.add.reduceat(counts, run_starts)
+    bucket_sums = np.add.reduceat(means * counts, run_starts)
+    return (
+        buckets[run_starts],
+        bucket_sums / bucket_counts,
+        np.minimum.reduceat(mins, run_starts),
+        np.maximum.reduceat(maxs, run_starts),
+        bucket_counts,
+    )
+
+
+def fetch_source(client, kind, tier_index, time_from, time_to):
+    """Fetches the data a tier is computed from, as arrays.
+
+    Raw readings for the first tier, the rollups of the previous
+    tier otherwise. Returns times, means, mins, maxs and counts,
+    in the time range (`time_to` excluded)."""
+    if tier_index == 0:
+        # Always read from Datastore, rollups are written there.
+        readings = db_access.query_readings(
+            storage_backends.DatastoreStorage(client), kind, time_from, time_to)
+        before = readings.times < time_to.timestamp()
+        times = readings.times[before]
+        values = readings.values[before]
+        return times, values, values, values, np.ones(len(values))
+
+    source_tier, _ = config.ROLLUP_TIERS[tier_index - 1]
+    query = client.query(kind=db_access.rollup_kind(kind, source_tier))
+    query.add_filter("timestamp", ">=", time_from)
+    query.add_filter("timestamp", "<", time_to)
+    query.order = ["timestamp"]
+    rows = []
+    for entity in query.fetch():
+        rows.append((entity["timestamp"].timestamp(), entity["value"],
+                     entity["min"], entity["max"], entity["count"]))
+    if not rows:
+        empty = np.empty(0)
+        return empty, empty, empty, empty, empty
+    return tuple(np.array(column, dtype=np.float64) for column in zip(*rows))
+
+
+def write_rollups(client, kind, tier, starts, means, mins, maxs, counts):
+    """Writes (or overwrites) rollup entities of a single tier."""
+    tier_name, bucket_seconds = tier
+    rollup_kind = db_access.rollup_kind(kind, tier_name)
+    ents = []
+    for start, mean, low, high, count in zip(
+            starts.tolist(), means.tolist(), mins.tolist(),
+            maxs.tolist(), counts.tolist()):
+        # Keyed by the bucket start, so recomputed
+        # buckets overwrite the old ones.
+        start = datetime.fromtimestamp(start, timezone.utc)
+        ent = datastore.Entity(
+            client.key(rollup_kind, start.isoformat()),
+            exclude_from_indexes=("value", "min", "max", "count"))
+        ent.update(dict(
+            timestamp=start + timedelta(seconds=bucket_seconds / 2.0),
+            value=mean,
+            min=low,
+            max=high,
+            count=int(count),
+        ))
+        ents.append(ent)
+    for i in range(0, len(ents), _PUT_BATCH_SIZE):
+        client.put_multi(ents[i:i + _PUT_BATCH_SIZE])
+    return len(ents)
+
+
+def _first_timestamp(client, kind, descending=False):
+    """Returns the timestamp of the oldest (or newest) entity, or None."""
+    query = client.query(kind=kind)
+    query.order = ["-timestamp" if descending else "timestamp"]
+    for entity in query.fetch(limit=1):
+        return entity["timestamp"]
+    return None
+
+
+def _floor_time(timestamp, seconds):
+    epoch = timestamp.timestamp()
+    return datetime.fromtimestamp(epoch - epoch % seconds, timezone.utc)
+
+
+def update_rollups(client, kind, now, since=None):
+    """Brings all rollup tiers of a kind up to date.
+
+    With `since` set, recomputes everything after that time."""
+    if since is None:
+        since = now - timedelta(hours=config.ROLLUP_LOOKBACK_HOURS)
+    chunk = timedelta(days=config.ROLLUP_CHUNK_DAYS)
+    # Start of the range updated in the previous tier.
+    updated_from = None
+    for tier_index, tier in enumerate(config.ROLLUP_TIERS):
+        tier_name, bucket_seconds = tier
+        time_from = since if updated_from is None else min(since, updated_from)
+        newest = _first_timestamp(
+            client, db_access.rollup_kind(kind, tier_name), descending=True)
+        if newest is None:
+            # A new tier, roll up everything.
+            if tier_index == 0:
+                time_from = _first_timestamp(client, kind)
+            else:
+                previous_tier, _ = config.ROLLUP_TIERS[tier_index - 1]
+                time_from = _first_timestamp(
+                    client, db_access.rollup_kind(kind, previous_tier))
+            if time_from is None:
+                print("No data to roll up for", kind)
+                return
+        else:
+            time_from = min(time_from, newest)
+        time_from = _floor_time(time_from, bucket_seconds)
+        updated_from = time_from
+
+        written = 0
+        # Chunk boundaries are at multiples of the chunk length,
+        # so they never split a bucket.
+        chunk_from = time_from
+        while chunk_from <= now:
+            chunk_to = _floor_time(chunk_from, chunk.total_seconds()) + chunk
+            source = fetch_source(client, kind, tier_index, chunk_from, chunk_to)
+            written += write_rollups(
+                client, kind, tier, *aggregate(*source, bucket_seconds))
+            chunk_from = chunk_to
+        print("Rolled up %s, %s tier: %d buckets from %s" %
+              (kind, tier_name, written, time_from.isoformat()))
+
+
+def update_all_rollups(client, since=None):
+    """Updates rollups of all kinds, reports problems."""
+    now = datetime.now(timezone.utc)
+    for kind in rollup_source_kinds():
+        try:
+            update_rollups(client, kind, now, since=since)
+        except Exception as e:
+            print("Problem while rolling up", kind)
+            print(e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Updates pre-aggregated rollups of the readings.")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Keep running, updating every INTERVAL seconds.")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                        help="Recompute rollups after this time (ISO 8601).")
+    args = parser.parse_args()
+    since = args.since
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    client = db_access.get_datastore_client()
+    while True:
+        update_all_rollups(client, since=since)
+        if args.interval is None:
+            break
+        since = None
+        time.sleep(args.interval)
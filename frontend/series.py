@@ -0,0 +1,308 @@
+import array
+from datetime import datetime, timezone
+import numpy as np
+import struct
+
+
+class Series(object):
+    """A time series, stored as NumPy arrays.
+
+    `times` holds float64 seconds since the epoch, sorted.
+    `values` holds float64 values, NaN marks a gap (no data).
+
+    Transforms return new Series objects."""
+
+    def __init__(self, times, values):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_readings(cls, readings):
+        """Creates a series from (value, timestamp) tuples.
+
+        A None value marks a gap. Takes a list or any other iterable,
+        which is consumed in a single pass, so readings streamed from
+        the DB are never all kept as tuples."""
+        times = array.array("d")
+        values = array.array("d")
+        for value, timestamp in readings:
+            times.append(timestamp.timestamp())
+            values.append(np.nan if value is None else value)
+        return cls(np.frombuffer(times), np.frombuffer(values))
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        """Yields (value, timestamp) tuples, value is None in gaps."""
+        for time, value in zip(self.times.tolist(), self.values.tolist()):
+            if value != value:
+                # NaN, a gap.
+                value = None
+            yield value, datetime.fromtimestamp(time, timezone.utc)
+
+    def gaps(self):
+        """Returns a boolean array, True where there's a gap."""
+        return np.isnan(self.values)
+
+    def smooth(self, minutes):
+        """Applies a +- X min average to the values.
+
+        Gaps are kept, and are not counted in the averages."""
+        window = minutes * 60.0
+        valid = ~self.gaps()
+        if not valid.any():
+            return Series(self.times, self.values)
+
+        # Window bounds for every point, as indices.
+        window_start = np.searchsorted(self.times, self.times - window, side="right")
+        window_end = np.searchsorted(self.times, self.times + window, side="left")
+
+        # Sums over the windows, from cumulative sums. Values are
+        # centered first, to keep the cumulative sums small.
+        offset = self.values[valid].mean()
+        centered = np.where(valid, self.values - offset, 0.0)
+        sums = np.concatenate(([0.0], np.cumsum(centered)))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        window_sums = sums[window_end] - sums[window_start]
+        window_counts = counts[window_end] - counts[window_start]
+
+        values = np.full(len(self), np.nan)
+        values[valid] = window_sums[valid] / window_counts[valid] + offset
+        return Series(self.times, values)
+
+    def insert_gaps(self, min_gap_minutes):
+        """Inserts gaps into the series.
+
+        If there's a reading gap of more than `min_gap_minutes` minutes."""
+        deltas = np.diff(self.times)
+        (gap_indices,) = np.nonzero(deltas > min_gap_minutes * 60.0)
+        gap_times = self.times[gap_indices] + deltas[gap_indices] / 2.0
+        return Series(
+            np.insert(self.times, gap_indices + 1, gap_times),
+            np.insert(self.values, gap_indices + 1, np.nan),
+        )
+
+    def downsample(self, max_points):
+        """Returns a series with at most `max_points` points.
+
+        Uses the Largest-Triangle-Three-Buckets algorithm, which keeps
+        the visual shape of the series, on every run of data between
+        gaps. Gaps are kept (one point for consecutive ones), and so
+        are the first and the last point of every run; the remaining
+        points are split between runs in proportion to their lengths.
+        With too many runs to keep the ends of every one, points
+        are picked evenly instead."""
+        if len(self) <= max_points:
+            return Series(self.times, self.values)
+        gaps = self.gaps()
+        (all_gaps,) = np.nonzero(gaps)
+        (gap_indices,) = np.nonzero(gaps & ~np.concatenate(([False], gaps[:-1])))
+
+        # Runs of data between the gaps, as [start, end) indices.
+        bounds = np.concatenate(([-1], all_gaps, [len(self)]))
+        runs = [(start + 1, end) for start, end in zip(bounds[:-1], bounds[1:])
+                if end > start + 1]
+        lengths = np.array([end - start for start, end in runs], dtype=np.int64)
+        ends = np.minimum(lengths, 2)
+        spare = max_points - len(gap_indices) - int(ends.sum())
+        if spare < 0:
+            keep = np.unique(np.linspace(0, len(self) - 1, max_points)
+                             .round().astype(np.int64))
+            return Series(self.times[keep], self.values[keep])
+
+        inner = lengths - ends
+        run_points = ends
+        if inner.sum() > 0:
+            run_points = np.minimum(lengths, ends + spare * inner // inner.sum())
+        keep = [gap_indices]
+        for (start, end), points in zip(runs, run_points.tolist()):
+            keep.append(start + _lttb_indices(
+                self.times[start:end], self.values[start:end], points))
+        keep = np.sort(np.concatenate(keep))
+        return Series(self.times[keep], self.values[keep])
+
+    def to_json(self):
+        """Returns the series as a dict, ready to be encoded as JSON.
+
+        Times are whole seconds since the epoch, values
+        are rounded, None marks a gap."""
+        values = np.round(self.values, 5).tolist()
+        return dict(
+            times=np.round(self.times).astype(np.int64).tolist(),
+            values=[None if value != value else value for value in values],
+        )
+
+    def to_binary(self):
+        """Packs the series into bytes, little-endian:
+
+        uint32 number of points, float64 base time (seconds since the
+        epoch), int32 times of the points (seconds since the base time),
+        float32 values of the points (NaN marks a gap)."""
+        base_time = float(self.times[0]) if len(self) else 0.0
+        offsets = np.round(self.times - base_time).astype("<i4")
+        return (struct.pack("<Id", len(self), base_time) +
+                offsets.tobytes() + self.values.astype("<f4").tobytes())
+
+    def multiply(self, multiplier):
+        """Multiplies all values in the series by a constant."""
+        return Series(self.times, self.values * multiplier)
+
+
+def _lttb_indices(times, values, num_points):
+    """Picks `num_points` points with Largest-Triangle-Three-Buckets.
+
+    Returns indices of the picked points. The first and the last
+    point are always picked, the rest of points is split into
+    equal buckets, and in every bucket the point forming the
+    largest triangle with the previously picked point and the
+    average of the next bucket is picked."""
+    count = len(times)
+    if num_points >= count:
+        return np.arange(count)
+    if num_points < 3:
+        return np.array([0, count - 1][:num_points])
+
+    # Bucket boundaries, for points between the first and the last.
+    edges = np.linspace(1, count - 1, num_points - 1).astype(np.int64)
+    sums_t = np.add.reduceat(times[1:count - 1], edges[:-1] - 1)
+    sums_v = np.add.reduceat(values[1:count - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    # Averages of every bucket, and of the last point.
+    next_t = np.append(sums_t / sizes, times[-1])
+    next_v = np.append(sums_v / sizes, values[-1])
+
+    picked = np.empty(num_points, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = count - 1
+    a = 0
+    for i in range(num_points - 2):
+        start, end = edges[i], edges[i + 1]
+        bucket_t = times[start:end]
+        bucket_v = values[start:end]
+        # Twice the triangle areas, the sign doesn't matter.
+        areas = np.abs((times[a] - next_t[i + 1]) * (bucket_v - values[a]) -
+                       (times[a] - bucket_t) * (next_v[i + 1] - values[a]))
+        a = start + int(np.argmax(areas))
+        picked[i + 1] = a
+    return picked
+
+
+# Constants for the saturation vapor pressure formula.
+# From Lowe, P.R. and J.M. Ficke, 1974: "The computation
+# of saturation vapor pressure"
+_A0 = 6.107799961
+_A1 = 4.436518521e-1
+_A2 = 1.428945805e-2
+_A3 = 2.650648471e-4
+_A4 = 3.031240396e-6
+_A5 = 2.034080948e-8
+_A6 = 6.136820929e-11
+
+
+def saturation_vapor_pressure(temp):
+    """Computes the saturation vapor pressure in hPa.
+
+    Takes temperature in deg C, a number or an array."""
+    # Computing the polynomial
+    result = _A6
+    result = result * temp + _A5
+    result = result * temp + _A4
+    result = result * temp + _A3
+    result = result * temp + _A2
+    result = result * temp + _A1
+    result = result * temp + _A0
+    return result
+
+
+def vapor_pressure(temp, hmdt):
+    """Computes the vapor pressure in hPa.
+
+    Takes temperature in deg C and relative humidity in %,
+    numbers or arrays."""
+    return (hmdt / 100.0) * saturation_vapor_pressure(temp)
+
+
+def dew_point_from_vapor_pressure(vapor_pressure):
+    """Computes the dew point, in deg C.
+
+    Takes vapor pressure in hPa, a number or an array.
+    """
+    # Formula from Wikipedia:
+    # https://en.wikipedia.org/wiki/Dew_point
+    pa = vapor_pressure
+    a = 6.1121
+    b = 18.678
+    c = 257.14
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_pa_a = np.log(pa / a)
+        return c * log_pa_a / (b - log_pa_a)
+
+
+def bucket_means(series, bucket_seconds):
+    """Averages values in fixed time buckets.
+
+    Times are rounded to the nearest multiple of `bucket_seconds`.
+    Returns a series with the mean value of every non-empty bucket,
+    gaps are skipped. The input needs to be sorted by time, it's
+    then processed in a single pass."""
+    valid = ~series.gaps()
+    values = series.values[valid]
+    if not len(values):
+        return Series([], [])
+    buckets = np.floor((series.times[valid] + bucket_seconds / 2.0) /
+                       bucket_seconds) * bucket_seconds
+
+    # Buckets are sorted, so each one is a run of equal values.
+    run_starts = np.flatnonzero(
+        np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    sums = np.add.reduceat(values, run_starts)
+    counts = np.diff(np.append(run_starts, len(values)))
+    return Series(buckets[run_starts], sums / counts)
+
+
+def align(series_list, bucket_seconds):
+    """Aligns several series in time.
+
+    Merge-joins the sorted series on fixed time buckets (see
+    bucket_means). Returns bucket times and a list with an
+    array of per-bucket means for every series. Only buckets
+    where all series have data are kept."""
+    bucketed = [bucket_means(series, bucket_seconds) for series in series_list]
+    times = bucketed[0].times
+    for other in bucketed[1:]:
+        positions = np.searchsorted(other.times, times)
+        found = positions < len(other.times)
+        found[found] = other.times[positions[found]] == times[found]
+        times = times[found]
+    values = [other.values[np.searchsorted(other.times, times)]
+              for other in bucketed]
+    return times, values
+
+
+def combine(function, series_list, bucket_seconds):
+    """Creates a series derived from several aligned series.
+
+    `function` is called with one array of per-bucket means
+    for every input series (see align), and returns an array
+    of derived values."""
+    times, values = align(series_list, bucket_seconds)
+    return Series(times, function(*values))
+
+
+def compute_vapor_pressure(temp_series, hmdt_series):
+    """Creates a series with vapor pressure, in hPa."""
+    # Temperature and humidity are aligned to
+    # 10-minute intervals.
+    return combine(vapor_pressure, [temp_series, hmdt_series],
+                   bucket_seconds=600.0)
+
+
+def compute_dew_point(vapor_pressure_series):
+    """Creates a series with dew point, in deg C.
+
+    Takes a series with vapor pressure in hPa.
+    """
+    return Series(vapor_pressure_series.times,
+                  dew_point_from_vapor_pressure(vapor_pressure_series.values))
@@ -0,0 +1,100 @@
+"""Recent readings shared between processes, through memory-mapped files.
+
+A single process (see db_access.series_store_loop) keeps the readings
+up to date and writes them, one file per kind; server processes map
+the files and read them without copying. Files are replaced
+atomically, so readers always see a complete series: the old
+version, until they notice the new file.
+
+File layout, little-endian: the _HEADER (magic, number of readings,
+start of the covered time range and time of the update, in seconds
+since the epoch), then float64 times and float64 values."""
+
+import mmap
+import numpy as np
+import os
+import struct
+import threading
+import urllib.parse
+
+
+_MAGIC = b"PGSERIES"
+_HEADER = struct.Struct("<8sQdd")
+
+
+class _MappedSeries(object):
+    """A mapped series file, arrays point into the mapping."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, self.covered_from, self.last_update = (
+            _HEADER.unpack_from(buffer))
+        if magic != _MAGIC:
+            raise ValueError("Not a series file: %s" % path)
+        self.times = np.frombuffer(buffer, dtype="<f8", count=count,
+                                   offset=_HEADER.size)
+        self.values = np.frombuffer(buffer, dtype="<f8", count=count,
+                                    offset=_HEADER.size + 8 * count)
+
+
+class SharedSeriesStore(object):
+    """Series of readings, by kind, in files in `directory`.
+
+    Use a directory in memory (e.g. in /dev/shm), so nothing
+    is actually written to a disk.
+
+    Thread safe."""
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = threading.Lock()
+        # name -> _MappedSeries
+        self._mapped = {}
+
+    def write(self, name, times, values, covered_from, last_update):
+        """Replaces the series of a kind.
+
+        Takes arrays of times (seconds since the epoch) and values,
+        the time range is covered from `covered_from` up to
+        `last_update` (also in seconds since the epoch)."""
+        times = np.asarray(times, dtype="<f8")
+        values = np.asarray(values, dtype="<f8")
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path(name)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(times), covered_from, last_update))
+            f.write(times.tobytes())
+            f.write(values.tobytes())
+        os.replace(temp_path, path)
+
+    def read(self, name):
+        """Returns the series of a kind, or None if there's none.
+
+        Returns arrays of times and values (read only, don't keep
+        them for long), the start of the covered time range and
+        the time of the update."""
+        path = self._path(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            mapped = self._mapped.get(name)
+        if mapped is None or mapped.file_id != (stat.st_ino, stat.st_mtime_ns):
+            # A new version. The old mapping is released when
+            # nothing uses its arrays any more.
+            try:
+                mapped = _MappedSeries(path)
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                self._mapped[name] = mapped
+        return mapped.times, mapped.values, mapped.covered_from, mapped.last_update
+
+    def _path(self, name):
+        return os.path.join(self._directory,
+                            urllib.parse.quote(name, safe="") + ".series")
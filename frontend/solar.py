@@ -0,0 +1,137 @@
+import functools
+import numpy as np
+
+import config
+from series import Series
+
+
+# Seconds in a day.
+_DAY = 86400.0
+
+# Atmospheric refraction at standard conditions (1013.25 hPa,
+# 15 deg C), following the NREL SPA algorithm.
+_REFRACTION_FACTOR = (1013.25 / 1010.0) * (283.0 / 288.15) * 1.02 / 60.0
+_REFRACTION_MIN_ALTITUDE = -(0.26667 + 0.5667)
+
+
+def compute_sun_altitude(times, latitude, longitude):
+    """Computes the altitude of the Sun, in degrees.
+
+    Takes an array of times in seconds since the epoch. Uses
+    the NOAA solar position equations, with refraction."""
+    times = np.asarray(times, dtype=np.float64)
+    julian_century = (times / _DAY + 2440587.5 - 2451545.0) / 36525.0
+    jc = julian_century
+
+    mean_longitude = np.mod(280.46646 + jc * (36000.76983 + jc * 0.0003032), 360.0)
+    mean_anomaly = 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+    eccentricity = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    mean_anomaly_rad = np.radians(mean_anomaly)
+    equation_of_center = (
+        np.sin(mean_anomaly_rad) * (1.914602 - jc * (0.004817 + 0.000014 * jc)) +
+        np.sin(2.0 * mean_anomaly_rad) * (0.019993 - 0.000101 * jc) +
+        np.sin(3.0 * mean_anomaly_rad) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * jc)
+    apparent_longitude = (mean_longitude + equation_of_center -
+                          0.00569 - 0.00478 * np.sin(omega))
+    mean_obliquity = 23.0 + (26.0 + (21.448 - jc * (
+        46.815 + jc * (0.00059 - jc * 0.001813))) / 60.0) / 60.0
+    obliquity = np.radians(mean_obliquity + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(np.radians(apparent_longitude)))
+
+    # Equation of time, in minutes.
+    y = np.tan(obliquity / 2.0) ** 2
+    mean_longitude_rad = np.radians(mean_longitude)
+    equation_of_time = 4.0 * np.degrees(
+        y * np.sin(2.0 * mean_longitude_rad) -
+        2.0 * eccentricity * np.sin(mean_anomaly_rad) +
+        4.0 * eccentricity * y * np.sin(mean_anomaly_rad) * np.cos(2.0 * mean_longitude_rad) -
+        0.5 * y * y * np.sin(4.0 * mean_longitude_rad) -
+        1.25 * eccentricity * eccentricity * np.sin(2.0 * mean_anomaly_rad))
+
+    # Hour angle, from the true solar time in minutes.
+    true_solar_time = np.mod(
+        np.mod(times, _DAY) / 60.0 + equation_of_time + 4.0 * longitude, 1440.0)
+    hour_angle = np.radians(true_solar_time / 4.0 - 180.0)
+
+    latitude_rad = np.radians(latitude)
+    cos_zenith = (np.sin(latitude_rad) * np.sin(declination) +
+                  np.cos(latitude_rad) * np.cos(declination) * np.cos(hour_angle))
+    altitude = 90.0 - np.degrees(np.arccos(np.clip(cos_zenith, -1.0, 1.0)))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        refraction = _REFRACTION_FACTOR / np.tan(
+            np.radians(altitude + 10.3 / (altitude + 5.11)))
+    return np.where(altitude >= _REFRACTION_MIN_ALTITUDE,
+                    altitude + refraction, altitude)
+
+
+def compute_sun_radiation(times, altitude):
+    """Computes the clear sky direct radiation power of the Sun, in W/m².
+
+    Takes arrays of times in seconds since the epoch, and of the
+    Sun's altitude in degrees. Same model as pysolar (Masters, p. 412)."""
+    times = np.asarray(times, dtype=np.float64)
+    altitude = np.asarray(altitude, dtype=np.float64)
+    dates = np.floor(times / _DAY).astype(np.int64).astype("datetime64[D]")
+    day_of_year = (dates - dates.astype("datetime64[Y]")).astype(np.float64) + 1.0
+    flux = 1160.0 + 75.0 * np.sin(2.0 * np.pi / 365.0 * (day_of_year - 275.0))
+    optical_depth = 0.174 + 0.035 * np.sin(2.0 * np.pi / 365.0 * (day_of_year - 100.0))
+    daytime = altitude > 0.0
+    radiation = np.zeros(len(times))
+    air_mass_ratio = 1.0 / np.sin(np.radians(altitude[daytime]))
+    radiation[daytime] = flux[daytime] * np.exp(-optical_depth[daytime] * air_mass_ratio)
+    return radiation
+
+
+@functools.lru_cache(maxsize=config.SOLAR_CACHE_DAYS)
+def _day_table(day, latitude, longitude):
+    """Precomputed Sun's altitude and radiation for a single day.
+
+    `day` is the number of days since the epoch. Covers the whole
+    day, both ends included, with SOLAR_TABLE_STEP_SEC resolution."""
+    steps = int(round(_DAY / config.SOLAR_TABLE_STEP_SEC))
+    times = np.linspace(day * _DAY, (day + 1) * _DAY, steps + 1)
+    altitude = compute_sun_altitude(times, latitude, longitude)
+    radiation = compute_sun_radiation(times, altitude)
+    for array in [times, altitude, radiation]:
+        array.flags.writeable = False
+    return times, altitude, radiation
+
+
+def sun_altitude_and_radiation(times):
+    """Returns the Sun's altitude and radiation power at given times.
+
+    Values are interpolated from cached per-day tables, for the
+    site location from the config."""
+    times = np.asarray(times, dtype=np.float64)
+    if not len(times):
+        return np.empty(0), np.empty(0)
+
+    # Join the tables of all days in range. Neighbouring
+    # tables share the midnight point.
+    first_day = int(np.floor(times.min() / _DAY))
+    last_day = int(np.floor(times.max() / _DAY))
+    tables = [_day_table(day, config.SITE_LATITUDE, config.SITE_LONGITUDE)
+              for day in range(first_day, last_day + 1)]
+    table_times, table_altitude, table_radiation = [
+        np.concatenate([table[i][:-1] for table in tables] + [tables[-1][i][-1:]])
+        for i in range(3)]
+
+    altitude = np.interp(times, table_times, table_altitude)
+    radiation = np.interp(times, table_times, table_radiation)
+    return altitude, radiation
+
+
+def generate_sun_series(time_from, time_to, max_points=config.SOLAR_MAX_POINTS):
+    """Generates series with the Sun's altitude and radiation power.
+
+    The number of points grows with the time range, one per
+    SOLAR_POINT_INTERVAL_SEC, within SOLAR_MIN_POINTS and
+    `max_points`."""
+    seconds = (time_to - time_from).total_seconds()
+    num_points = int(seconds / config.SOLAR_POINT_INTERVAL_SEC) + 1
+    num_points = max(config.SOLAR_MIN_POINTS, min(max_points, num_points))
+    times = np.linspace(time_from.timestamp(), time_to.timestamp(), num_points)
+    altitude, radiation = sun_altitude_and_radiation(times)
+    return Series(times, altitude), Series(times, radiation)
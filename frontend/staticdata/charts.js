@@ -0,0 +1,126 @@
+// Fetches chart series from the series API, draws the charts.
+
+// Decodes a series in the binary format (see Series.to_binary).
+function parseSeries(buffer) {
+  var view = new DataView(buffer);
+  var count = view.getUint32(0, true);
+  var baseTime = view.getFloat64(4, true);
+  var timesOffset = 12;
+  var valuesOffset = timesOffset + 4 * count;
+  var times = new Array(count);
+  var values = new Array(count);
+  for (var i = 0; i < count; i++) {
+    times[i] = new Date(1000 * (baseTime + view.getInt32(timesOffset + 4 * i, true)));
+    var value = view.getFloat32(valuesOffset + 4 * i, true);
+    values[i] = isNaN(value) ? null : value;
+  }
+  return { times: times, values: values };
+}
+
+// Fetches several series at once, returns them by name. Missing
+// series (see route_api_series_batch) are { error: Error }.
+function fetchSeriesBatch(names, query) {
+  var url = '/api/series' + query + '&format=binary&names=' +
+      names.map(encodeURIComponent).join(',');
+  return fetch(url).then(function(response) {
+    if (!response.ok) {
+      throw new Error('Failed to fetch the series: ' + response.status);
+    }
+    return response.arrayBuffer();
+  }).then(function(buffer) {
+    var view = new DataView(buffer);
+    var count = view.getUint32(0, true);
+    var offset = 4;
+    var results = {};
+    for (var i = 0; i < count; i++) {
+      var length = view.getUint32(offset, true);
+      offset += 4;
+      results[names[i]] = length ?
+          parseSeries(buffer.slice(offset, offset + length)) :
+          { error: new Error('Failed to fetch ' + names[i]) };
+      offset += length;
+    }
+    return results;
+  });
+}
+
+function drawChart(chart, seriesList, options) {
+  var data = new google.visualization.DataTable();
+  data.addColumn('datetime', 'Time');
+  chart.series.forEach(function(series) {
+    data.addColumn('number', series.description);
+  });
+  // Every series goes into its own rows,
+  // with nulls in the columns of other series.
+  var rows = [];
+  seriesList.forEach(function(series, i) {
+    for (var j = 0; j < series.times.length; j++) {
+      var row = [series.times[j]];
+      for (var k = 0; k < seriesList.length; k++) {
+        row.push(k == i ? series.values[j] : null);
+      }
+      rows.push(row);
+    }
+  });
+  data.addRows(rows);
+
+  var chartOptions = Object.assign({ title: chart.description }, options);
+  var element = document.getElementById(chart.name + '_chart');
+  new google.visualization[chart.chartType](element).draw(data, chartOptions);
+}
+
+// Draws a chart with the series that loaded, and marks the missing ones.
+function drawAvailable(chart, results, options) {
+  var available = [];
+  var seriesList = [];
+  var missing = [];
+  results.forEach(function(result, i) {
+    if (result.error) {
+      missing.push(chart.series[i].description);
+    } else {
+      available.push(chart.series[i]);
+      seriesList.push(result);
+    }
+  });
+  if (!available.length) {
+    document.getElementById(chart.name + '_chart').textContent =
+        'Failed to load the chart: ' + results[0].error.message;
+    return;
+  }
+  var description = chart.description;
+  if (missing.length) {
+    description += ' (missing: ' + missing.join(', ') + ')';
+  }
+  drawChart(Object.assign({}, chart, { description: description, series: available }),
+            seriesList, options);
+}
+
+// Fetches all series of the page at once, draws the charts when
+// the data and the charts library are ready.
+function loadCharts(charts, query, options) {
+  var names = [];
+  charts.forEach(function(chart) {
+    chart.series.forEach(function(series) {
+      if (names.indexOf(series.name) < 0) {
+        names.push(series.name);
+      }
+    });
+  });
+  var batch = fetchSeriesBatch(names, query).catch(function(error) {
+    var results = {};
+    names.forEach(function(name) {
+      results[name] = { error: error };
+    });
+    return results;
+  });
+  google.charts.load('current', {'packages':['corechart']});
+  google.charts.setOnLoadCallback(function() {
+    batch.then(function(results) {
+      charts.forEach(function(chart) {
+        drawAvailable(chart, chart.series.map(function(series) {
+          return results[series.name];
+        }), options);
+      });
+    });
+  });
+}
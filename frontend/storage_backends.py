@@ -0,0 +1,204 @@
+"""Storage backends the readings are read from.
+
+Both have the same methods, db_access reads through whichever
+is configured (see db_access.get_storage):
+    iter_readings(name, time_from, time_to, ...)
+    latest_reading(name)
+    latest_readings(names)
+"""
+
+from datetime import datetime, timezone
+import os
+import sqlite3
+import threading
+
+import config
+
+
+def _split_kind(name):
+    """Splits a kind into station and reading names, or returns None.
+
+    A copy of split_kind in logger/cloud_db.py, which names the
+    fields of the summaries read here; the two must stay in sync.
+    Not imported, as the frontend and the logger deploy separately."""
+    parts = name.rsplit(":", 2)
+    if len(parts) < 3:
+        return None
+    station, category, reading = parts
+    return station, category + ":" + reading
+
+
+class DatastoreStorage(object):
+    """Reads readings from Cloud Datastore."""
+
+    # Long time ranges are fetched in parts, in parallel.
+    sharded_fetches = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def iter_readings(self, name, time_from, time_to=None, exclusive_from=False,
+                      exclusive_to=False, projection=False):
+        """Queries the DB for values and timestamps of readings.
+
+        Yields readings with timestamps from `time_from` (excluded if
+        `exclusive_from` is set) up to `time_to` (excluded if
+        `exclusive_to` is set, or all recent ones if it's None).
+        Results are fetched a page at a time, as they are consumed.
+
+        With `projection` set, only the value and timestamp are read,
+        from an index (see index.yaml)."""
+        query = self.client.query(kind=name)
+        query.add_filter("timestamp", ">" if exclusive_from else ">=", time_from)
+        if time_to is not None:
+            query.add_filter("timestamp", "<" if exclusive_to else "<=", time_to)
+        query.order = ["timestamp"]
+        if projection:
+            query.projection = ["timestamp", "value"]
+
+        for entity in query.fetch(timeout=config.DB_QUERY_TIMEOUT_SEC):
+            if "value" not in entity:
+                continue
+            if "timestamp" not in entity:
+                continue
+            yield entity["value"], entity["timestamp"]
+
+    def latest_reading(self, name):
+        """Returns the value and timestamp of the latest reading."""
+        query = self.client.query(kind=name)
+        query.order = ["-timestamp"]
+        results = list(query.fetch(limit=1, timeout=config.DB_QUERY_TIMEOUT_SEC))
+
+        if not results:
+            return None, None
+        result = results[0]
+        if "value" not in result:
+            return None, None
+        value = result["value"]
+        if "timestamp" not in result:
+            return None, None
+        timestamp = result["timestamp"]
+
+        return value, timestamp
+
+    def latest_readings(self, names):
+        """Returns the value and timestamp of the latest reading, by name.
+
+        Reads the per-station summary entities written by the logger,
+        all at once. Readings missing there are queried one by one."""
+        splits = {name: _split_kind(name) for name in names}
+        stations = sorted(set(split[0] for split in splits.values()
+                              if split is not None))
+        keys = [self.client.key(config.GCP_LATEST_KIND, station)
+                for station in stations]
+        summaries = {}
+        if keys:
+            for entity in self.client.get_multi(
+                    keys, timeout=config.DB_QUERY_TIMEOUT_SEC):
+                summaries[entity.key.name] = entity
+
+        results = {}
+        for name, split in splits.items():
+            summary = None if split is None else summaries.get(split[0])
+            if summary is None or split[1] not in summary:
+                results[name] = self.latest_reading(name)
+                continue
+            reading = summary[split[1]]
+            if "value" not in reading or "timestamp" not in reading:
+                results[name] = (None, None)
+                continue
+            results[name] = (reading["value"], reading["timestamp"])
+        return results
+
+
+class SqliteStorage(object):
+    """Reads readings from a local SQLite read replica.
+
+    Readings of every kind (raw ones and rollups) are kept in a single
+    table, with the (kind, timestamp) primary key as the index, so
+    time range queries are local index range scans. The replica is
+    kept up to date by replica_sync.py, the only writer; readers
+    open it read-only.
+
+    Thread safe, every thread gets its own connection."""
+
+    # Local queries are fast enough on their own.
+    sharded_fetches = False
+
+    def __init__(self, path, read_only=True):
+        self._path = path
+        self._read_only = read_only
+        self._local = threading.local()
+        if not read_only:
+            self._create_tables()
+
+    def iter_readings(self, name, time_from, time_to=None, exclusive_from=False,
+                      exclusive_to=False, projection=False):
+        """Yields values and timestamps of readings, see DatastoreStorage."""
+        sql = "SELECT value, timestamp FROM readings WHERE kind = ? AND timestamp %s ?" % (
+            ">" if exclusive_from else ">=")
+        params = [name, time_from.timestamp()]
+        if time_to is not None:
+            sql += " AND timestamp %s ?" % ("<" if exclusive_to else "<=")
+            params.append(time_to.timestamp())
+        sql += " ORDER BY timestamp"
+        for value, timestamp in self._connection().execute(sql, params):
+            yield value, datetime.fromtimestamp(timestamp, timezone.utc)
+
+    def latest_reading(self, name):
+        """Returns the value and timestamp of the latest reading."""
+        row = self._connection().execute(
+            "SELECT value, timestamp FROM readings WHERE kind = ? "
+            "ORDER BY timestamp DESC LIMIT 1", (name,)).fetchone()
+        if row is None:
+            return None, None
+        value, timestamp = row
+        return value, datetime.fromtimestamp(timestamp, timezone.utc)
+
+    def latest_readings(self, names):
+        """Returns the value and timestamp of the latest reading, by name."""
+        return {name: self.latest_reading(name) for name in names}
+
+    def newest_timestamp(self, name):
+        """Returns the timestamp of the newest reading of a kind, or None."""
+        _, timestamp = self.latest_reading(name)
+        return timestamp
+
+    def write_readings(self, name, readings):
+        """Adds (or replaces) readings of a kind, returns how many.
+
+        Takes an iterable of (value, timestamp) tuples."""
+        connection = self._connection()
+        with connection:
+            cursor = connection.executemany(
+                "INSERT OR REPLACE INTO readings (kind, timestamp, value) "
+                "VALUES (?, ?, ?)",
+                ((name, timestamp.timestamp(), value)
+                 for value, timestamp in readings))
+        return cursor.rowcount
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self._read_only:
+                connection = sqlite3.connect(
+                    "file:%s?mode=ro" % self._path, uri=True)
+            else:
+                connection = sqlite3.connect(self._path)
+            self._local.connection = connection
+        return connection
+
+    def _create_tables(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        # Readers aren't blocked while the replica is written.
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            "kind TEXT NOT NULL, "
+            "timestamp REAL NOT NULL, "
+            "value REAL, "
+            "PRIMARY KEY (kind, timestamp)) WITHOUT ROWID")
+        connection.commit()
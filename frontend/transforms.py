@@ -0,0 +1,149 @@
+"""Computes chart series, in a pool of processes for large inputs.
+
+Transforms of long series (smoothing, and mostly downsampling)
+take tens of milliseconds of CPU, holding the GIL and blocking
+other requests of the process. Series computed from at least
+TRANSFORM_PROCESS_MIN_POINTS readings are computed in a separate
+process; readings are sent as NumPy arrays, which pickle compactly.
+Smaller ones are computed in the request thread, where it's
+cheaper than sending them away."""
+
+from concurrent import futures
+import multiprocessing
+import numpy as np
+import threading
+import time
+
+import charts
+import config
+import metrics
+from series import Series
+
+
+def _compute(name, arrays, time_range, max_points):
+    """Runs in a pool process, returns times, values and the CPU time."""
+    start = time.perf_counter()
+    readings = {kind: Series(times, values)
+                for kind, (times, values) in arrays.items()}
+    history = charts.SERIES[name].compute(readings, time_range)
+    history = history.downsample(max_points)
+    return history.times, history.values, time.perf_counter() - start
+
+
+def _check(times, values):
+    """Runs in a pool process, checks that the pool works."""
+    return Series(times, values).downsample(2).times
+
+
+class _PendingSeries(object):
+    """A series being computed, see TransformExecutor.submit."""
+
+    def __init__(self, executor, future, name, readings, time_range, max_points):
+        self._executor = executor
+        self._future = future
+        self._args = (name, readings, time_range, max_points)
+
+    def result(self):
+        """Waits for the series, returns it."""
+        if self._future is not None:
+            try:
+                with metrics.stage("process_pool"):
+                    times, values, seconds = self._future.result()
+                metrics.current_timer().add("compute", seconds)
+                metrics.METRICS.increment("transform_process_calls")
+                return Series(times, values)
+            except futures.process.BrokenProcessPool as e:
+                print("Problem with the transform process pool")
+                print(e)
+                self._executor._reset_pool()
+        return self._executor._compute_locally(*self._args)
+
+
+class TransformExecutor(object):
+    """Computes chart series, see the module docstring.
+
+    The pool is started on first use, so processes forking after
+    importing this module (see prefork_server) get their own pool.
+
+    Thread safe."""
+
+    def __init__(self, max_workers, min_points):
+        self._max_workers = max_workers
+        self._min_points = min_points
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def start(self):
+        """Starts the pool processes, instead of on the first request.
+
+        Checks that the pool works, by computing a small series in
+        it. If it doesn't, series are computed in the request threads."""
+        if self._max_workers <= 0:
+            return
+        times = np.arange(3, dtype=np.float64)
+        try:
+            pool = self._get_pool()
+            for _ in range(self._max_workers - 1):
+                pool.submit(time.sleep, 0.0)
+            result = pool.submit(_check, times, times).result(
+                timeout=config.TRANSFORM_START_TIMEOUT_SEC)
+            if list(result) != [0.0, 2.0]:
+                raise ValueError("Unexpected result: %s" % result)
+        except Exception as e:
+            print("Problem while starting the transform process pool,"
+                  " computing series in the request threads")
+            print(e)
+            with self._lock:
+                self._max_workers = 0
+            self._reset_pool()
+
+    def submit(self, name, readings, time_range, max_points):
+        """Starts computing a series from charts.SERIES, see compute.
+
+        Returns an object with a result() method, which waits for
+        the series and returns it. Submit all series of a request
+        before waiting for any, so they are computed in parallel."""
+        num_points = sum(len(history) for history in readings.values())
+        future = None
+        if self._max_workers > 0 and num_points >= self._min_points:
+            arrays = {kind: (history.times, history.values)
+                      for kind, history in readings.items()}
+            try:
+                future = self._get_pool().submit(
+                    _compute, name, arrays, time_range, max_points)
+            except futures.process.BrokenProcessPool as e:
+                print("Problem with the transform process pool")
+                print(e)
+                self._reset_pool()
+        return _PendingSeries(self, future, name, readings, time_range, max_points)
+
+    def compute(self, name, readings, time_range, max_points):
+        """Computes a series from charts.SERIES, downsampled to `max_points`.
+
+        Takes a dict with a Series of readings of every kind."""
+        return self.submit(name, readings, time_range, max_points).result()
+
+    def _compute_locally(self, name, readings, time_range, max_points):
+        metrics.METRICS.increment("transform_local_calls")
+        history = charts.SERIES[name].compute(readings, time_range)
+        with metrics.stage("downsample"):
+            return history.downsample(max_points)
+
+    def _reset_pool(self):
+        with self._lock:
+            self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Forking a process with threads running isn't safe,
+                # the pool processes are forked from a clean server
+                # process instead, with the app (where TimeRange is)
+                # imported. The server process also imports the main
+                # script (as __mp_main__), so the server scripts only
+                # start serving under `if __name__ == "__main__"`.
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["app"])
+                self._pool = futures.ProcessPoolExecutor(
+                    max_workers=self._max_workers, mp_context=context)
+            return self._pool
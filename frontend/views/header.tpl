@@ -4,12 +4,12 @@
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Weather station</title>
-    <link rel="stylesheet" href="/static/style.css">
+    <link rel="stylesheet" href="{{ static_url('style.css') }}">
 </head>
 
 <body>
   <header>
-    <div id="logo"><img src="/static/logo.png">Weather&nbsp;Station</div>
+    <div id="logo"><img src="{{ static_url('logo.png') }}">Weather&nbsp;Station</div>
     <nav>
       <ul>
         <li><a href="/">Current reading</a>
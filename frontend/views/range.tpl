@@ -0,0 +1,16 @@
+<section id="timeRange">
+  <form method="get">
+    From <input type="text" name="from" size="16"
+                value="{{ time_range.time_from.isoformat(timespec='minutes') }}">
+    to <input type="text" name="to" size="16"
+              value="{{ time_range.time_to.isoformat(timespec='minutes') }}">
+    (UTC), points <input type="number" name="points" style="width: 5em"
+                         value="{{ time_range.points }}">
+    <input type="submit" value="Show">
+  </form>
+  <p>
+    % for label, query_string in time_range.navigation_links():
+      <a href="{{ query_string }}">{{ label }}</a>
+    % end
+  </p>
+</section>
@@ -1,9 +1,13 @@
+import binascii
 import collections
 from datetime import datetime, timedelta, timezone
 import io
+import math
 import re
+import struct
 import threading
 import time
+import tty
 
 import config
 import instance_config
@@ -37,6 +41,176 @@ class LastValueRead(object):
             return self._value, self._timestamp
 
 
+# Binary frames, see arduino_ground/serial_frame.h.
+_FRAME_START = b"\xa5\x5a"
+_FRAME_LENGTH = 11
+# Sensor id, sequence number, value. Starts after _FRAME_START.
+_FRAME_PAYLOAD = struct.Struct("<BHf")
+# CRC of the payload. Starts after the payload.
+_FRAME_CRC = struct.Struct("<H")
+_FRAME_CRC_INITIAL = 0xFFFF
+
+# A text line, "Kind: value".
+_TEXT_LINE_REGEX = re.compile(rb"([^:]+): ([0-9.]+)")
+_TEXT_WHITESPACE = b" \t\r"
+
+# Max amount of bytes read from the comm port at once.
+_READ_SIZE = 4096
+
+
+def encode_frame(sensor_id, sequence, value):
+    """Encodes a single binary frame, the same way Arduino does."""
+    payload = _FRAME_PAYLOAD.pack(sensor_id, sequence & 0xFFFF, value)
+    crc = binascii.crc_hqx(payload, _FRAME_CRC_INITIAL)
+    return _FRAME_START + payload + _FRAME_CRC.pack(crc)
+
+
+class StreamDecoder(object):
+    """Decodes the Arduino output into readings.
+
+    The output can contain both text lines and binary frames,
+    mixed in any way. Data is decoded in place, from the read
+    buffer, without creating a string per line.
+
+    Not thread safe."""
+
+    def __init__(self, logger_statistics):
+        self._logger_statistics = logger_statistics
+        self._buffer = bytearray()
+        self._last_sequence = None
+
+    def feed(self, data):
+        """Decodes data read from the comm port.
+
+        Returns a list of (comm_name, value) readings. Incomplete
+        lines and frames are kept until more data is fed."""
+        self._buffer += data
+        readings = []
+        with memoryview(self._buffer) as view:
+            consumed = self._decode(view, readings)
+        del self._buffer[:consumed]
+        return readings
+
+    # Private methods.
+
+    def _decode(self, view, readings):
+        """Decodes all complete records, returns the amount of bytes used."""
+        buffer = self._buffer
+        end = len(buffer)
+        pos = 0
+        while pos < end:
+            if buffer[pos] == _FRAME_START[0]:
+                if end - pos < _FRAME_LENGTH:
+                    if end - pos == 1 or buffer[pos + 1] == _FRAME_START[1]:
+                        # Wait for the rest of the frame.
+                        break
+                elif buffer[pos + 1] == _FRAME_START[1]:
+                    if self._decode_frame(view, pos, readings):
+                        pos += _FRAME_LENGTH
+                    else:
+                        # Damaged frame, re-synchronize on the next byte.
+                        self._logger_statistics.add_comm_damaged_records()
+                        pos += 1
+                    continue
+
+            # A text line. Ends with a newline, or is cut short
+            # by the start of a frame.
+            newline = buffer.find(b"\n", pos)
+            frame_start = buffer.find(_FRAME_START[:1], pos + 1)
+            if newline == -1 and frame_start == -1:
+                if end - pos > config.COMM_MAX_LINE_LENGTH:
+                    # Garbage, with no line end in sight.
+                    self._logger_statistics.add_comm_damaged_records()
+                    pos = end
+                # Otherwise wait for the rest of the line.
+                break
+            if frame_start != -1 and (newline == -1 or frame_start < newline):
+                line_start, line_stop = self._strip(pos, frame_start)
+                if line_start < line_stop:
+                    # Line interrupted by a frame.
+                    self._logger_statistics.add_comm_damaged_records()
+                pos = frame_start
+                continue
+            self._decode_line(pos, newline, readings)
+            pos = newline + 1
+
+        return pos
+
+    def _strip(self, start, stop):
+        """Returns line bounds without the surrounding whitespace."""
+        buffer = self._buffer
+        while start < stop and buffer[start] in _TEXT_WHITESPACE:
+            start += 1
+        while stop > start and buffer[stop - 1] in _TEXT_WHITESPACE:
+            stop -= 1
+        return start, stop
+
+    def _decode_line(self, start, stop, readings):
+        start, stop = self._strip(start, stop)
+        if start == stop:
+            # Empty line (except for newline character).
+            return
+
+        # Update stats.
+        self._logger_statistics.add_comm_lines_read()
+        self._logger_statistics.add_comm_bytes_read(stop - start)
+
+        # Decompose the line into kind and value
+        match = _TEXT_LINE_REGEX.fullmatch(self._buffer, start, stop)
+        if not match:
+            # Damaged line.
+            self._logger_statistics.add_comm_damaged_records()
+            return
+
+        # Try to parse the value as a float.
+        try:
+            value = float(match.group(2))
+        except ValueError:
+            # Not a valid float value
+            self._logger_statistics.add_comm_damaged_records()
+            return
+        kind = match.group(1).decode("utf-8", errors="replace")
+
+        # This line is parsed, log that.
+        self._logger_statistics.add_comm_parsed_lines_read()
+        readings.append((kind, value))
+
+    def _decode_frame(self, view, pos, readings):
+        """Decodes a frame at pos. Returns False if it's damaged."""
+        payload_start = pos + len(_FRAME_START)
+        crc_start = payload_start + _FRAME_PAYLOAD.size
+        (crc,) = _FRAME_CRC.unpack_from(view, crc_start)
+        if binascii.crc_hqx(view[payload_start:crc_start], _FRAME_CRC_INITIAL) != crc:
+            return False
+        sensor_id, sequence, value = _FRAME_PAYLOAD.unpack_from(view, payload_start)
+
+        # Update stats.
+        self._logger_statistics.add_comm_lines_read()
+        self._logger_statistics.add_comm_bytes_read(_FRAME_LENGTH)
+        self._check_sequence(sequence)
+
+        comm_name = config.COMM_FRAME_SENSOR_IDS.get(sensor_id)
+        if comm_name is None or math.isnan(value):
+            # Unknown sensor or no value.
+            self._logger_statistics.add_comm_damaged_records()
+            return True
+
+        # This frame is parsed, log that.
+        self._logger_statistics.add_comm_parsed_lines_read()
+        # Same precision as in the text output.
+        readings.append((comm_name, round(value, 2)))
+        return True
+
+    def _check_sequence(self, sequence):
+        """Counts frames lost since the previous frame."""
+        # Sequence numbers start from 0 after an Arduino reset.
+        if self._last_sequence is not None and sequence != 0:
+            lost = (sequence - self._last_sequence - 1) & 0xFFFF
+            if lost:
+                self._logger_statistics.add_comm_frames_lost(lost)
+        self._last_sequence = sequence
+
+
 class WeatherDataSource(object):
     """Retrieves from device and stores all recent weather data."""
 
@@ -64,43 +238,22 @@ class WeatherDataSource(object):
 
     def _stream_reader(self, data_queue, logger_statistics):
         print("Opening Arduino comm port at", config.COMM_PORT)
-        with io.open(config.COMM_PORT, mode='rt', buffering=1, errors='replace') as stream:
+        with io.open(config.COMM_PORT, mode='rb', buffering=0) as stream:
             print("Opened", config.COMM_PORT)
+            if stream.isatty():
+                # Binary frames must reach us unaltered
+                # by the terminal line discipline.
+                tty.setraw(stream.fileno())
+            decoder = StreamDecoder(logger_statistics)
             while True:
-                line = stream.readline()
-                if not line:
+                data = stream.read(_READ_SIZE)
+                if not data:
                     raise RuntimeError("Input stream %s was terminated" % config.COMM_PORT)
 
-                line = line.strip()
-                if not line:
-                    # Empty line (except for newline character).
-                    continue
-
-                # Update stats.
-                logger_statistics.add_comm_lines_read()
-                logger_statistics.add_comm_bytes_read(len(line))
-
-                # Decompose the line into kind and value
-                match = re.match("^([^:]+): ([0-9.]+)$", line)
-                if not match:
-                    # Damaged line.
-                    continue
-                kind = match.group(1)
-                value = match.group(2)
-
-                # Try to parse the value as a float.
-                try:
-                    value = float(value)
-                except:
-                    # Not a valid float value
-                    continue
-
-                # This line is parsed, log that.
-                logger_statistics.add_comm_parsed_lines_read()
-
-                # Store the value.
-                with self._lock:
-                    self._readings[kind].set(value)
+                # Store the values.
+                for kind, value in decoder.feed(data):
+                    with self._lock:
+                        self._readings[kind].set(value)
 
 
     def _scrape_readings_once(self, data_queue, logger_statistics, last_timestamp_read):
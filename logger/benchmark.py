@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""Synthetic end-to-end benchmark of the logger pipeline.
+
+Runs the real reader, scraper, SQLite buffer and uploader threads
+against a fake Arduino (writing into a pseudo-terminal) and a local
+stand-in of the cloud Datastore, then reports throughput numbers.
+
+Example:
+    ./benchmark.py --lines-per-sec 2000 --duration 60 \\
+        --outage 10:20 --db-error-rate 0.05
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import os
+import pty
+import random
+import resource
+import tempfile
+import threading
+import time
+import tty
+
+import arduino_interface
+import cloud_db
+import config
+import custom_queue
+import db_buffer
+import logger_stats
+
+
+# Value ranges of the synthetic readings, by comm name.
+# Readings not listed here are generated in the 0-100 range.
+_READING_RANGES = {
+    "Humidity": (20.0, 100.0),
+    "Temperature": (-20.0, 35.0),
+    "Pressure": (980.0, 1040.0),
+    "Wind direction": (0.0, 360.0),
+    "Total rain": (0.0, 500.0),
+}
+
+
+class FakeArduino(object):
+    """Writes `Kind: value` lines into a pseudo-terminal.
+
+    With `framed` set, writes binary frames instead.
+
+    The logger reads the other end of the terminal (`port`)
+    the same way it reads the real Arduino comm port."""
+
+    def __init__(self, lines_per_sec, framed=False):
+        self._lines_per_sec = lines_per_sec
+        self._framed = framed
+        self._master_fd, self._slave_fd = pty.openpty()
+        # No echo, no newline translation.
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._lock = threading.Lock()
+        self._lines_written = 0
+        self._bytes_written = 0
+
+    def lines_written(self):
+        with self._lock:
+            return self._lines_written
+
+    def bytes_written(self):
+        with self._lock:
+            return self._bytes_written
+
+    def writer_loop(self):
+        """Writes lines at the requested rate. Runs forever."""
+        if self._framed:
+            sensor_ids = list(config.COMM_FRAME_SENSOR_IDS.keys())
+        else:
+            comm_names = list(config.GCP_READING_NAME_TRANSLATION.keys())
+        sequence = 0
+        # Write in small bursts, the way the Arduino does.
+        burst_interval = 0.05
+        lines_per_burst = max(1, int(self._lines_per_sec * burst_interval))
+        next_burst = time.monotonic()
+        while True:
+            lines = []
+            for _ in range(lines_per_burst):
+                if self._framed:
+                    sensor_id = random.choice(sensor_ids)
+                    comm_name = config.COMM_FRAME_SENSOR_IDS[sensor_id]
+                else:
+                    comm_name = random.choice(comm_names)
+                low, high = _READING_RANGES.get(comm_name, (0.0, 100.0))
+                value = random.uniform(low, high)
+                if self._framed:
+                    lines.append(arduino_interface.encode_frame(
+                        sensor_id, sequence, value))
+                    sequence += 1
+                else:
+                    lines.append(("%s: %.2f\r\n" % (comm_name, value)).encode("ascii"))
+            data = b"".join(lines)
+            os.write(self._master_fd, data)
+            with self._lock:
+                self._lines_written += len(lines)
+                self._bytes_written += len(data)
+
+            next_burst += lines_per_burst / float(self._lines_per_sec)
+            time.sleep(max(0.0, next_burst - time.monotonic()))
+
+
+class FakeDatastoreClient(object):
+    """A local stand-in for the Datastore client.
+
+    Supports the subset of the API used by cloud_db. Writes
+    can be slowed down, can fail at random, and fail always
+    during the outage windows (given in seconds since start).
+
+    Thread safe."""
+
+    def __init__(self, latency_sec=0.0, latency_jitter_sec=0.0,
+                 error_rate=0.0, outages=()):
+        self._latency_sec = latency_sec
+        self._latency_jitter_sec = latency_jitter_sec
+        self._error_rate = error_rate
+        self._outages = list(outages)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._entities_written = 0
+        self._put_calls = 0
+        self._failed_put_calls = 0
+
+    def key(self, *path):
+        return path
+
+    def get(self, key):
+        return None
+
+    def put_multi(self, entities):
+        latency = self._latency_sec + random.uniform(0.0, self._latency_jitter_sec)
+        time.sleep(latency)
+
+        elapsed = time.monotonic() - self._start
+        in_outage = any(start <= elapsed < start + duration
+                        for start, duration in self._outages)
+        failed = in_outage or random.random() < self._error_rate
+        with self._lock:
+            self._put_calls += 1
+            if failed:
+                self._failed_put_calls += 1
+            else:
+                self._entities_written += len(entities)
+        if failed:
+            raise RuntimeError("Fake Datastore write failure")
+
+    def entities_written(self):
+        with self._lock:
+            return self._entities_written
+
+    def put_calls(self):
+        with self._lock:
+            return self._put_calls, self._failed_put_calls
+
+
+def storage_bytes_written():
+    """Returns bytes written to storage by this process, or None."""
+    try:
+        with open("/proc/self/io") as io_stats:
+            for line in io_stats:
+                name, value = line.split(":")
+                if name == "write_bytes":
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def parse_outage(text):
+    """Parses a `START:DURATION` outage spec, in seconds."""
+    start, duration = text.split(":")
+    return float(start), float(duration)
+
+
+def preload_backlog(data_queue, amount):
+    """Puts `amount` old readings into the queue."""
+    now = datetime.now(timezone.utc)
+    names = list(config.GCP_READING_NAME_TRANSLATION.values())
+    for i in range(amount):
+        timestamp = now - timedelta(days=1, seconds=i)
+        kind = "benchmark:" + config.GCP_READING_PREFIX + names[i % len(names)]
+        data_queue.put(timestamp, kind, random.uniform(0.0, 100.0))
+
+
+def run_benchmark(args):
+    fake_arduino = FakeArduino(lines_per_sec=args.lines_per_sec,
+                               framed=args.framed)
+    fake_client = FakeDatastoreClient(
+        latency_sec=args.db_latency,
+        latency_jitter_sec=args.db_latency_jitter,
+        error_rate=args.db_error_rate,
+        outages=args.outage,
+    )
+    db_dir = tempfile.mkdtemp(prefix="logger_benchmark_")
+
+    # Point the pipeline at the fakes.
+    config.COMM_PORT = fake_arduino.port
+    config.SQLITE_DB_FILE = os.path.join(db_dir, config.SQLITE_DB_FILENAME)
+    config.LOGGER_INTERVAL_SEC = args.scrape_interval
+    config.LOGGER_DRY_RUN = False
+    if args.retry_sec is not None:
+        config.CLOUD_DB_RETRY_SEC = args.retry_sec
+
+    data_queue = custom_queue.CustomQueue()
+    logger_statistics = logger_stats.LoggerStatistics()
+    weather_data = arduino_interface.WeatherDataSource()
+    preload_backlog(data_queue, args.backlog)
+
+    def thread_kickoff(target, **kwargs):
+        thread = threading.Thread(target=target, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+
+    start_bytes = storage_bytes_written()
+    start_time = time.monotonic()
+    thread_kickoff(fake_arduino.writer_loop)
+    thread_kickoff(weather_data.reader_loop, data_queue=data_queue,
+                   logger_statistics=logger_statistics)
+    thread_kickoff(weather_data.scraper_loop, data_queue=data_queue,
+                   logger_statistics=logger_statistics)
+    thread_kickoff(db_buffer.sqlite_buffer_loop, data_queue=data_queue,
+                   logger_statistics=logger_statistics)
+    thread_kickoff(cloud_db.cloud_uploader_loop, data_queue=data_queue,
+                   logger_statistics=logger_statistics,
+                   client_factory=lambda: fake_client)
+
+    time.sleep(args.duration)
+    ingest_time = time.monotonic() - start_time
+    lines_parsed = logger_statistics.total_comm_parsed_lines_read()
+    lines_written = fake_arduino.lines_written()
+
+    # Wait for the backlog (queue and SQLite buffer) to drain.
+    drain_start = max([0.0] + [start + duration for start, duration in args.outage])
+    drained_at = None
+    while time.monotonic() - start_time < args.duration + args.drain_timeout:
+        if data_queue.qsize() == 0 and db_buffer.count_sqlite_elements() == 0:
+            drained_at = time.monotonic() - start_time
+            break
+        time.sleep(0.1)
+    total_time = time.monotonic() - start_time
+
+    end_bytes = storage_bytes_written()
+    put_calls, failed_put_calls = fake_client.put_calls()
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print()
+    print("Benchmark results")
+    print("Lines written by fake Arduino:", lines_written)
+    print("Lines parsed by logger:", lines_parsed)
+    print("Damaged lines or frames:", logger_statistics.total_comm_damaged_records())
+    print("Frames lost:", logger_statistics.total_comm_frames_lost())
+    print("Ingest rate: %.1f lines/sec" % (lines_parsed / ingest_time))
+    print("Entities uploaded:", fake_client.entities_written())
+    print("Upload rate: %.1f entities/sec" %
+          (fake_client.entities_written() / total_time))
+    print("Put calls: %d (%d failed)" % (put_calls, failed_put_calls))
+    if drained_at is None:
+        print("Backlog drain time: not drained within %.1f sec" % args.drain_timeout)
+    else:
+        print("Backlog drain time: %.1f sec" % max(0.0, drained_at - drain_start))
+    print("Peak RSS: %.1f MiB" % (peak_rss_kb / 1024.0))
+    if start_bytes is None or end_bytes is None:
+        print("SQLite bytes written: unknown")
+    else:
+        print("SQLite bytes written:", end_bytes - start_bytes)
+    print("SQLite file size:", os.path.getsize(config.SQLITE_DB_FILE))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the logger pipeline with a fake Arduino "
+                    "and a fake cloud DB.")
+    parser.add_argument("--lines-per-sec", type=float, default=100.0,
+                        help="Rate of lines written by the fake Arduino.")
+    parser.add_argument("--framed", action="store_true",
+                        help="Fake Arduino writes binary frames, not text.")
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="How long to generate data for, in seconds.")
+    parser.add_argument("--drain-timeout", type=float, default=300.0,
+                        help="How long to wait for the backlog to drain.")
+    parser.add_argument("--scrape-interval", type=float, default=1.0,
+                        help="Overrides config.LOGGER_INTERVAL_SEC.")
+    parser.add_argument("--retry-sec", type=float, default=None,
+                        help="Overrides config.CLOUD_DB_RETRY_SEC.")
+    parser.add_argument("--backlog", type=int, default=0,
+                        help="Readings put into the queue before starting.")
+    parser.add_argument("--db-latency", type=float, default=0.05,
+                        help="Fake cloud DB write latency, in seconds.")
+    parser.add_argument("--db-latency-jitter", type=float, default=0.0,
+                        help="Extra random write latency, in seconds.")
+    parser.add_argument("--db-error-rate", type=float, default=0.0,
+                        help="Probability of a fake cloud DB write failing.")
+    parser.add_argument("--outage", type=parse_outage, action="append",
+                        default=[], metavar="START:DURATION",
+                        help="Fake cloud DB outage window, in seconds since "
+                             "start. Can be repeated.")
+    run_benchmark(parser.parse_args())
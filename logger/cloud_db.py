@@ -14,8 +14,86 @@ def create_datastore_client():
     return client
 
 
-def insert_into_cloud_db(client, elements):
-    """Inserts entries into the cloud DB."""
+def split_kind(kind):
+    """Splits an entity kind into station and reading names.
+
+    E.g. "wczasowa:ground_level:reading:temperature" into
+    "wczasowa:ground_level" and "reading:temperature".
+    Returns None if the kind has no station name. Copied in
+    frontend/storage_backends.py, keep the two in sync."""
+    parts = kind.rsplit(":", 2)
+    if len(parts) < 3:
+        return None
+    station, category, name = parts
+    return station, category + ":" + name
+
+
+class LatestReadings(object):
+    """Latest value and timestamp of every reading, by station.
+
+    Mirrors the summary entities of kind GCP_LATEST_KIND in the
+    cloud DB, one per station, keyed by the station name. Each one
+    holds an embedded entity (timestamp, value) per reading name.
+    The frontend reads them instead of querying every kind.
+
+    Not thread safe, used by the uploader thread only."""
+
+    def __init__(self):
+        # station -> {reading name -> (timestamp, value)}
+        self._stations = {}
+
+    def update(self, client, elements):
+        """Merges in the elements, returns summary entities to write.
+
+        Only stations with newer readings get an entity."""
+        updated = set()
+        for timestamp, kind, value in elements:
+            split = split_kind(kind)
+            if split is None:
+                continue
+            station, name = split
+            readings = self._get_station(client, station)
+            if name in readings and readings[name][0] > timestamp:
+                # Backlog, older than what we have.
+                continue
+            readings[name] = (timestamp, value)
+            updated.add(station)
+
+        ents = []
+        for station in sorted(updated):
+            readings = self._stations[station]
+            ent = datastore.Entity(
+                client.key(config.GCP_LATEST_KIND, station),
+                exclude_from_indexes=tuple(readings.keys()))
+            for name, (timestamp, value) in readings.items():
+                reading = datastore.Entity()
+                reading.update(dict(timestamp=timestamp))
+                if value is not None:
+                    reading.update(dict(value=value))
+                ent[name] = reading
+            ents.append(ent)
+        return ents
+
+    def _get_station(self, client, station):
+        """Returns readings of a station, loaded from the DB if needed.
+
+        Keeps readings written before the logger was restarted."""
+        if station not in self._stations:
+            readings = {}
+            ent = client.get(client.key(config.GCP_LATEST_KIND, station))
+            if ent is not None:
+                for name, reading in ent.items():
+                    if "timestamp" in reading:
+                        readings[name] = (reading["timestamp"], reading.get("value"))
+            self._stations[station] = readings
+        return self._stations[station]
+
+
+def insert_into_cloud_db(client, elements, latest_readings=None):
+    """Inserts entries into the cloud DB.
+
+    If `latest_readings` is given, the station summary entities
+    are updated in the same write."""
     if config.LOGGER_DRY_RUN:
         for timestamp, kind, value in elements:
             print(timestamp, kind, value)
@@ -29,40 +107,42 @@ def insert_into_cloud_db(client, elements):
         if value is not None:
             ent.update(dict(value=value))
         ents.append(ent)
+    if ents and latest_readings is not None:
+        ents.extend(latest_readings.update(client, elements))
     if ents:
         client.put_multi(ents)
 
 
-def cloud_uploader_loop(data_queue, logger_statistics):
+def cloud_uploader_loop(data_queue, logger_statistics,
+                        client_factory=create_datastore_client,
+                        batch_size=None, linger_sec=0.0):
     """A loop: popping items from queue, inserting them into the cloud DB.
 
     If there's multiple items pending in the queue it will attempt to move
-    to the cloud DB a few items at a time.
+    to the cloud DB a few items at a time (up to `batch_size`, by default
+    config.CLOUD_DB_BATCH_SIZE). With `linger_sec` set it waits a little
+    for more items before each write.
+
+    `client_factory` creates the DB client, it can be replaced
+    with a local stand-in (see benchmark.py).
     """
+    if batch_size is None:
+        batch_size = config.CLOUD_DB_BATCH_SIZE
+    latest_readings = LatestReadings()
     while True:
         try:
-            client = create_datastore_client()
+            client = client_factory()
             while True:
-                # Get one element from the queue.
-                elements = []
-                timestamp, kind, value = data_queue.get_youngest()
-                elements.append((timestamp, kind, value))
-
-                # Try to get extra 9 elements for a total of max 10
-                # if there's anything else in the queue. This speeds
-                # up bulk upload of data.
-                for i in range(9):
-                    data = data_queue.get_youngest_nowait()
-                    if data is None:
-                        break
-                    timestamp, kind, value = data
-                    elements.append((timestamp, kind, value))
+                # Get a few elements from the queue. Writing many
+                # at once speeds up bulk upload of data.
+                elements = data_queue.get_youngest_batch(
+                    batch_size, linger_sec=linger_sec)
 
                 # Try to write.
                 written = False
                 time_start = datetime.now(timezone.utc)
                 try:
-                    insert_into_cloud_db(client, elements)
+                    insert_into_cloud_db(client, elements, latest_readings)
                     written = True
                 finally:
                     if written:
@@ -83,5 +163,5 @@ def cloud_uploader_loop(data_queue, logger_statistics):
         except Exception as e:
             print("Problem while inserting data into the cloud DB.")
             print(e)
-            time.sleep(120.0)
+            time.sleep(config.CLOUD_DB_RETRY_SEC)
 
@@ -21,6 +21,14 @@ LOGGER_STATS_INTERVAL_SEC=10.0 * 60.0
 # instead of pushing it to the cloud DB.
 LOGGER_DRY_RUN=False
 
+# How the logger runs:
+#  - "standalone": reads Arduino data and uploads it to the cloud DB.
+#  - "agent": reads Arduino data and sends it to the gateway
+#    at GATEWAY_ADDRESS, on the local network.
+#  - "gateway": receives data from the agents and uploads it
+#    all to the cloud DB. Does not read Arduino data.
+LOGGER_MODE="standalone"
+
 #
 # ARDUINO
 #
@@ -28,6 +36,33 @@ LOGGER_DRY_RUN=False
 # The port with Arduino data stream.
 COMM_PORT="/dev/ttyUSB0"
 
+# Arduino can write readings either as text lines
+# ("Kind: value") or as binary frames (see
+# arduino_ground/serial_frame.h). Both are accepted.
+# Sensor ids used in the binary frames, mapped to the
+# names used in the text lines.
+COMM_FRAME_SENSOR_IDS={
+    1: "Humidity",
+    2: "Temperature",
+    3: "Water level",
+    4: "Pressure",
+    5: "PM 1.0 standard",
+    6: "PM 2.5 standard",
+    7: "PM 10.0 standard",
+    8: "PM 1.0 environmental",
+    9: "PM 2.5 environmental",
+    10: "PM 10.0 environmental",
+    11: "Particles > 0.3um / 0.1L air",
+    12: "Particles > 0.5um / 0.1L air",
+    13: "Particles > 1.0um / 0.1L air",
+    14: "Particles > 2.5um / 0.1L air",
+    15: "Particles > 5.0um / 0.1L air",
+    16: "Particles > 10.0 um / 0.1L air",
+}
+
+# Max length of a text line. Longer lines are dropped.
+COMM_MAX_LINE_LENGTH=256
+
 
 #
 # IN-MEMORY QUEUE
@@ -63,6 +98,10 @@ SQLITE_FETCH_QUEUE_LENGTH=10
 # Fetch this many items at once.
 SQLITE_FETCH_AMOUNT=50
 
+# How long the SQLite buffer thread waits between
+# checking the queue length.
+SQLITE_BUFFER_INTERVAL_SEC=5.0
+
 
 #
 # CLOUD DATABASE
@@ -74,6 +113,13 @@ GCP_CREDENTIALS=os.path.join(this_directory, "gcp-credentials.json")
 # GCP project.
 GCP_PROJECT="pogoda-240600"
 
+# How long to wait before reconnecting after a failed
+# cloud DB write.
+CLOUD_DB_RETRY_SEC=120.0
+
+# Max number of elements written to the cloud DB at once.
+CLOUD_DB_BATCH_SIZE=10
+
 # Cloud database schema settings.
 
 # The entity kind for a sensor reading is fully specified as:
@@ -115,3 +161,50 @@ GCP_READING_NAME_TRANSLATION={
 #    GCP_CONN_QUALITY_PREFIX +
 #    "internet_latency"
 GCP_CONN_QUALITY_PREFIX="connection:"
+
+# Entity kind of the per-station summaries with the latest value
+# of every reading. The entity key name is the station name, i.e.
+# instance_config.GCP_INSTANCE_NAME_PREFIX without the trailing ":".
+GCP_LATEST_KIND="latest"
+
+
+#
+# GATEWAY
+#
+
+# Gateway address (host, port), used by the agents.
+GATEWAY_ADDRESS=("192.168.1.2", 8093)
+
+# Address the gateway listens on.
+GATEWAY_LISTEN_ADDRESS=("0.0.0.0", 8093)
+
+# Max number of readings an agent sends at once.
+GATEWAY_BATCH_SIZE=100
+
+# Network timeout for the agent-gateway connection.
+GATEWAY_TIMEOUT_SEC=10.0
+
+# How long an agent waits before reconnecting after
+# a failed send.
+GATEWAY_RETRY_SEC=30.0
+
+# The gateway writes readings from all stations together,
+# up to this many at once (Datastore allows up to 500).
+GATEWAY_CLOUD_DB_BATCH_SIZE=400
+
+# How long the gateway waits for more readings to
+# fill a cloud DB write.
+GATEWAY_CLOUD_DB_LINGER_SEC=5.0
+
+
+#
+# PROFILER
+#
+
+# Sending SIGUSR1 to the logger collects a profile: stacks of all
+# threads are sampled every PROFILER_INTERVAL_SEC, for
+# PROFILER_DURATION_SEC, and written to PROFILER_OUTPUT_DIR
+# in the collapsed stack (flame graph) format.
+PROFILER_DURATION_SEC=30.0
+PROFILER_INTERVAL_SEC=0.01
+PROFILER_OUTPUT_DIR=os.path.join(this_directory, "profiles")
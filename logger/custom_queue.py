@@ -1,4 +1,5 @@
 import threading
+import time
 
 class CustomQueue(object):
     """A priority queue that can return both oldest and youngest elements.
@@ -45,6 +46,26 @@ class CustomQueue(object):
             timestamp, kind, value = self._data.pop(-1)
             return timestamp, kind, value
 
+    def get_youngest_batch(self, max_elements, linger_sec=0.0):
+        """Retrieves up to `max_elements` youngest elements as a list.
+
+        Blocks until there's at least one element, then waits up
+        to `linger_sec` for more elements to arrive.
+        """
+        with self._cv:
+            while self._queue_empty():
+                self._cv.wait()
+            deadline = time.monotonic() + linger_sec
+            while len(self._data) < max_elements:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0.0:
+                    break
+                self._cv.wait(timeout=remaining)
+            batch = self._data[-max_elements:]
+            del self._data[-max_elements:]
+            batch.reverse()
+            return batch
+
     def get_oldest(self):
         """Retrieves one element from the queue (with smallest timestamp).
 
@@ -144,7 +144,7 @@ def sqlite_buffer_loop(data_queue, logger_statistics):
 
                 # Wait a little before the next iteration.
                 # This should ideally block on qsize() changing value.
-                time.sleep(5.0)
+                time.sleep(config.SQLITE_BUFFER_INTERVAL_SEC)
         except Exception as e:
             print("Problem with the SQLite buffer.")
             print(e)
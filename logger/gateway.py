@@ -0,0 +1,150 @@
+from datetime import datetime, timezone
+import json
+import socket
+import socketserver
+import time
+
+import config
+
+
+# Wire protocol between the agents and the gateway.
+#
+# The agent sends one JSON object per line:
+#   {"readings": [[timestamp, kind, value], ...]}
+# with ISO 8601 timestamps. The gateway queues the readings
+# and answers with one line:
+#   {"accepted": <number of readings>}
+# or, if it can't take the readings right now:
+#   {"error": <description>}
+# Readings not accepted stay with the agent.
+
+
+def encode_readings(elements):
+    """Encodes (timestamp, kind, value) elements into a request line."""
+    readings = [[timestamp.isoformat(), kind, value]
+                for timestamp, kind, value in elements]
+    return (json.dumps(dict(readings=readings)) + "\n").encode("utf-8")
+
+
+def decode_readings(line):
+    """Decodes a request line into (timestamp, kind, value) elements."""
+    elements = []
+    for timestamp, kind, value in json.loads(line)["readings"]:
+        timestamp = datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+        if value is not None:
+            value = float(value)
+        elements.append((timestamp, str(kind), value))
+    return elements
+
+
+def send_to_gateway(stream, elements):
+    """Sends elements to the gateway, waits for the confirmation."""
+    stream.write(encode_readings(elements))
+    stream.flush()
+    response = stream.readline()
+    if not response:
+        raise RuntimeError("Gateway closed the connection")
+    response = json.loads(response)
+    if "error" in response:
+        raise RuntimeError("Gateway error: %s" % response["error"])
+    if response.get("accepted") != len(elements):
+        raise RuntimeError("Gateway accepted %s of %d readings" %
+                           (response.get("accepted"), len(elements)))
+
+
+def gateway_uploader_loop(data_queue, logger_statistics):
+    """A loop: popping items from queue, sending them to the gateway.
+
+    Used in the agent mode instead of cloud_db.cloud_uploader_loop.
+    Write results are recorded the same way as cloud DB writes."""
+    while True:
+        try:
+            print("Connecting to the gateway at %s:%d" % config.GATEWAY_ADDRESS)
+            with socket.create_connection(
+                    config.GATEWAY_ADDRESS,
+                    timeout=config.GATEWAY_TIMEOUT_SEC) as sock:
+                with sock.makefile("rwb") as stream:
+                    print("Connected to the gateway")
+                    while True:
+                        elements = data_queue.get_youngest_batch(
+                            config.GATEWAY_BATCH_SIZE)
+
+                        # Try to send.
+                        sent = False
+                        time_start = datetime.now(timezone.utc)
+                        try:
+                            send_to_gateway(stream, elements)
+                            sent = True
+                        finally:
+                            if sent:
+                                # Record the success.
+                                latency = datetime.now(timezone.utc) - time_start
+                                logger_statistics.cloud_db_write_result(
+                                    success=True,
+                                    latency=latency.total_seconds(),
+                                    elements=len(elements),
+                                )
+                            else:
+                                # Put back elements in the readings queue
+                                for timestamp, kind, value in elements:
+                                    data_queue.put(timestamp, kind, value)
+                                # Record the failure.
+                                logger_statistics.cloud_db_write_result(success=False)
+
+        except Exception as e:
+            print("Problem while sending data to the gateway.")
+            print(e)
+            time.sleep(config.GATEWAY_RETRY_SEC)
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    """Handles a single agent connection."""
+
+    def handle(self):
+        peer = "%s:%d" % self.client_address[:2]
+        print("Agent connected from", peer)
+        for line in self.rfile:
+            try:
+                elements = decode_readings(line)
+            except Exception as e:
+                self._respond(dict(error="Malformed request: %s" % e))
+                continue
+
+            data_queue = self.server.data_queue
+            if data_queue.qsize() + len(elements) > config.MAX_QUEUE_SIZE:
+                # Keep the readings at the agent for now.
+                self._respond(dict(error="Queue full"))
+                continue
+
+            for timestamp, kind, value in elements:
+                data_queue.put(timestamp, kind, value)
+            self.server.logger_statistics.add_gateway_readings_received(
+                len(elements))
+            self._respond(dict(accepted=len(elements)))
+        print("Agent disconnected from", peer)
+
+    def _respond(self, response):
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class _GatewayServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def gateway_server_loop(data_queue, logger_statistics):
+    """Receives readings from the agents, puts them into the queue.
+
+    Should be running in a separate daemon thread."""
+    while True:
+        try:
+            with _GatewayServer(config.GATEWAY_LISTEN_ADDRESS,
+                                _AgentHandler) as server:
+                server.data_queue = data_queue
+                server.logger_statistics = logger_statistics
+                print("Gateway listening at %s:%d" % config.GATEWAY_LISTEN_ADDRESS)
+                server.serve_forever()
+        except Exception as e:
+            print("Problem in the gateway server.")
+            print(e)
+            time.sleep(60.0)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from datetime import datetime, timezone
+import signal
 import threading
 import time
 
@@ -9,9 +10,11 @@ import cloud_db
 import config
 import custom_queue
 import db_buffer
+import gateway
 import instance_config
 import logger_stats
 import ping
+import sampling_profiler
 
 
 if __name__ == "__main__":
@@ -21,6 +24,12 @@ if __name__ == "__main__":
         print("Running in dry run mode. No data will be written to the cloud DB.")
         print()
 
+    assert config.LOGGER_MODE in ["standalone", "agent", "gateway"], (
+        "Unknown logger mode %s" % config.LOGGER_MODE)
+    reads_arduino = config.LOGGER_MODE in ["standalone", "agent"]
+    writes_cloud_db = config.LOGGER_MODE in ["standalone", "gateway"]
+
+    print("Logger mode:", config.LOGGER_MODE)
     print("Logger instance name for GCP:", instance_config.GCP_INSTANCE_NAME_PREFIX)
     print("Logger interval:", config.LOGGER_INTERVAL_SEC, "sec")
     print("Logger stats interval:", config.LOGGER_STATS_INTERVAL_SEC, "sec")
@@ -44,38 +53,76 @@ if __name__ == "__main__":
         thread.setDaemon(True)
         thread.start()
 
-    # Start a thread to read Arduino output.
-    arduino_reader_thread = thread_kickoff(
-        target=weather_data.reader_loop,
-    )
+    if reads_arduino:
+        # Start a thread to read Arduino output.
+        arduino_reader_thread = thread_kickoff(
+            target=weather_data.reader_loop,
+        )
 
-    # Start a thread to periodically push
-    # Arduino data to the queue.
-    arduino_scraper_thread = thread_kickoff(
-        target=weather_data.scraper_loop,
-    )
+        # Start a thread to periodically push
+        # Arduino data to the queue.
+        arduino_scraper_thread = thread_kickoff(
+            target=weather_data.scraper_loop,
+        )
 
     # Start a thread to scrape connection quality data.
     conn_quality_scraper_thread = thread_kickoff(
         target=ping.conn_quality_scraper_loop,
     )
 
-    # Start popping items from the readings queue
-    # and inserting them into the DB.
-    cloud_uploader_thread = thread_kickoff(
-        target=cloud_db.cloud_uploader_loop,
-    )
+    if config.LOGGER_MODE == "standalone":
+        # Start popping items from the readings queue
+        # and inserting them into the DB.
+        cloud_uploader_thread = thread_kickoff(
+            target=cloud_db.cloud_uploader_loop,
+        )
 
-    # Start the SQLite DB buffer thread.
-    sqlite_buffer_thread = thread_kickoff(
-        target=db_buffer.sqlite_buffer_loop,
-    )
+    if config.LOGGER_MODE == "agent":
+        # Start popping items from the readings queue
+        # and sending them to the gateway.
+        gateway_uploader_thread = thread_kickoff(
+            target=gateway.gateway_uploader_loop,
+        )
+
+    if config.LOGGER_MODE == "gateway":
+        # Start receiving items from the agents.
+        gateway_server_thread = thread_kickoff(
+            target=gateway.gateway_server_loop,
+        )
+
+        # Start popping items from the readings queue
+        # and inserting them into the DB, in large batches.
+        cloud_uploader_thread = thread_kickoff(
+            target=cloud_db.cloud_uploader_loop,
+            batch_size=config.GATEWAY_CLOUD_DB_BATCH_SIZE,
+            linger_sec=config.GATEWAY_CLOUD_DB_LINGER_SEC,
+        )
+
+    if writes_cloud_db:
+        # Start the SQLite DB buffer thread.
+        sqlite_buffer_thread = thread_kickoff(
+            target=db_buffer.sqlite_buffer_loop,
+        )
 
     # Start the statistics writer thread.
     logger_statistics_thread = thread_kickoff(
         target=logger_statistics.statistics_writer_thread,
     )
 
+    # Collect a profile on SIGUSR1, see config.PROFILER_DURATION_SEC.
+    profiler = sampling_profiler.SamplingProfiler(
+        config.PROFILER_OUTPUT_DIR, config.PROFILER_INTERVAL_SEC)
+
+    def start_profiler(signum, frame):
+        path = profiler.start(config.PROFILER_DURATION_SEC)
+        if path is None:
+            print("A profile is being collected already")
+        else:
+            print("Collecting a profile for", config.PROFILER_DURATION_SEC,
+                  "sec, to", path)
+
+    signal.signal(signal.SIGUSR1, start_profiler)
+
     # Show the "user menu".
     time.sleep(10.0)
     while True:
@@ -88,12 +135,18 @@ if __name__ == "__main__":
             elements_in_queue = data_queue.qsize()
             number_of_new_readings = logger_statistics.number_of_new_readings()
             cloud_db_elements_written = logger_statistics.cloud_db_elements_written()
-            sqlite_elements = db_buffer.count_sqlite_elements()
+            if writes_cloud_db:
+                sqlite_elements = db_buffer.count_sqlite_elements()
+            else:
+                sqlite_elements = None
+            gateway_readings_received = logger_statistics.gateway_readings_received()
             time_since_cloud_success = logger_statistics.cloud_db_time_since_success()
             time_since_cloud_failure = logger_statistics.cloud_db_time_since_failure()
             comm_lines_read = logger_statistics.total_comm_lines_read()
             comm_parsed_lines_read = logger_statistics.total_comm_parsed_lines_read()
             comm_bytes_read = logger_statistics.total_comm_bytes_read()
+            comm_damaged_records = logger_statistics.total_comm_damaged_records()
+            comm_frames_lost = logger_statistics.total_comm_frames_lost()
             time_running = logger_statistics.time_running()
 
             # Show it
@@ -101,7 +154,10 @@ if __name__ == "__main__":
                   cloud_db_elements_written)
             print("Total number of new readings:", number_of_new_readings)
             print("Elements currently in the queue:", elements_in_queue)
-            print("Elements currently in the SQLite DB:", sqlite_elements)
+            if sqlite_elements is not None:
+                print("Elements currently in the SQLite DB:", sqlite_elements)
+            if config.LOGGER_MODE == "gateway":
+                print("Readings received from agents:", gateway_readings_received)
             print("Time since last cloud DB write success:",
                   time_since_cloud_success)
             print("Time since last cloud DB write failure:",
@@ -112,6 +168,10 @@ if __name__ == "__main__":
                   comm_parsed_lines_read)
             print("Bytes read from Arduino comm port:",
                   comm_bytes_read)
+            print("Damaged lines or frames from Arduino comm port:",
+                  comm_damaged_records)
+            print("Frames lost (sequence gaps) from Arduino comm port:",
+                  comm_frames_lost)
             print("Program running (time):", time_running)
             print()
 
@@ -17,6 +17,8 @@ class LoggerStatistics(object):
         self._total_comm_lines_read = 0
         self._total_comm_parsed_lines_read = 0
         self._total_comm_bytes_read = 0
+        self._total_comm_damaged_records = 0
+        self._total_comm_frames_lost = 0
         self._arduino_bps_last_time = None
         self._arduino_bps_last_bytes = None
         self._arduino_lps_last_time = None
@@ -27,6 +29,7 @@ class LoggerStatistics(object):
         self._last_cloud_db_success_time = None
         self._last_cloud_db_failure_time = None
         self._number_of_new_readings = 0
+        self._gateway_readings_received = 0
         self._timestamp_start = datetime.now(timezone.utc)
 
     def add_comm_lines_read(self, to_add=1):
@@ -44,6 +47,16 @@ class LoggerStatistics(object):
         with self._lock:
             self._total_comm_bytes_read += to_add
 
+    def add_comm_damaged_records(self, to_add=1):
+        """Increments the amount of damaged lines or frames from the comm port."""
+        with self._lock:
+            self._total_comm_damaged_records += to_add
+
+    def add_comm_frames_lost(self, to_add=1):
+        """Increments the amount of frames lost (sequence number gaps)."""
+        with self._lock:
+            self._total_comm_frames_lost += to_add
+
     def total_comm_lines_read(self):
         """Returns the amount of lines read from the comm port."""
         with self._lock:
@@ -59,6 +72,16 @@ class LoggerStatistics(object):
         with self._lock:
             return self._total_comm_bytes_read
 
+    def total_comm_damaged_records(self):
+        """Returns the amount of damaged lines or frames from the comm port."""
+        with self._lock:
+            return self._total_comm_damaged_records
+
+    def total_comm_frames_lost(self):
+        """Returns the amount of frames lost (sequence number gaps)."""
+        with self._lock:
+            return self._total_comm_frames_lost
+
     def cloud_db_write_result(self, success, latency=None, elements=0):
         """Saves a single cloud DB write result.
 
@@ -79,6 +102,16 @@ class LoggerStatistics(object):
         with self._lock:
             self._number_of_new_readings += 1
 
+    def add_gateway_readings_received(self, to_add=1):
+        """Increments the amount of readings received from the agents."""
+        with self._lock:
+            self._gateway_readings_received += to_add
+
+    def gateway_readings_received(self):
+        """Returns the amount of readings received from the agents."""
+        with self._lock:
+            return self._gateway_readings_received
+
     def number_of_new_readings(self):
         """Returns the total amount of new readings."""
         with self._lock:
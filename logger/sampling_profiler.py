@@ -0,0 +1,102 @@
+# A copy of frontend/sampling_profiler.py, on purpose: the frontend
+# and the logger are deployed separately. Keep both the same.
+
+import collections
+from datetime import datetime, timezone
+import os
+import sys
+import threading
+import time
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                           frame.f_lineno)
+
+
+def _collapsed_stack(thread_name, frame):
+    """Returns a stack as a single line, from the thread name down."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame).replace(";", ":"))
+        frame = frame.f_back
+    names.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(names))
+
+
+def sample_stacks(duration_sec, interval_sec):
+    """Samples stacks of all the other threads, for `duration_sec`.
+
+    Returns a Counter of collapsed stacks (see _collapsed_stack)."""
+    counts = collections.Counter()
+    own_thread = threading.get_ident()
+    deadline = time.monotonic() + duration_sec
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        for thread_id, frame in frames.items():
+            if thread_id == own_thread:
+                continue
+            name = names.get(thread_id, "thread-%d" % thread_id)
+            counts[_collapsed_stack(name, frame)] += 1
+        # Don't keep the frames (and their locals) alive while sleeping.
+        del frames, frame
+        time.sleep(interval_sec)
+    return counts
+
+
+def write_collapsed(counts, path):
+    """Writes stacks in the collapsed format, one "stack count" per line.
+
+    The file can be turned into a flame graph, e.g. with
+    flamegraph.pl or speedscope."""
+    with open(path, "w") as f:
+        for stack, count in counts.most_common():
+            f.write("%s %d\n" % (stack, count))
+
+
+class SamplingProfiler(object):
+    """Profiles the running program, on demand.
+
+    Stacks of all threads are sampled in the background, and
+    written to a file in `output_dir`. One profile at a time.
+
+    Thread safe."""
+
+    def __init__(self, output_dir, interval_sec):
+        self._output_dir = output_dir
+        self._interval_sec = interval_sec
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self, duration_sec):
+        """Starts profiling, returns the output file path.
+
+        Returns None if a profile is being collected already."""
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self._output_dir, "profile-%s-%d.collapsed" %
+                            (timestamp, os.getpid()))
+        thread = threading.Thread(
+            target=self._profile, args=(duration_sec, path),
+            name="sampling-profiler")
+        thread.daemon = True
+        thread.start()
+        return path
+
+    def _profile(self, duration_sec, path):
+        try:
+            counts = sample_stacks(duration_sec, self._interval_sec)
+            os.makedirs(self._output_dir, exist_ok=True)
+            write_collapsed(counts, path)
+            print("Profile written to", path)
+        except Exception as e:
+            print("Problem while profiling")
+            print(e)
+        finally:
+            with self._lock:
+                self._running = False